@@ -0,0 +1,245 @@
+import datetime
+import itertools
+import logging
+import os
+import pathlib
+import re
+import sqlite3
+import stat
+from typing import Iterator, List, Optional
+
+from mtag.helper import datetime_helper, filesystem_helper
+
+# Closed months of entries are moved to a database file of their own, which is never written
+# to again. The archive table of the main database tells which months have been archived, and
+# the repositories attach the archives which overlap the period they are looking up.
+
+# Copied to an archive in this order, so that the foreign keys are satisfied. The entries
+# keep referring to the rows of the main database, and the copies make an archive complete.
+archived_reference_tables = ["application_path", "application", "application_window", "category"]
+# The entries which are moved to an archive, by their start column, with their end column
+archived_entry_tables = [("logged_entry", "le_start", "le_last_update"),
+                         ("activity_entry", "ae_start", "ae_last_update"),
+                         ("tagged_entry", "te_start", "te_end")]
+ARCHIVE_SCHEMA_PREFIX = "archive_"
+# SQLite allows ten attached databases by default. Leave room for the archiving itself.
+MAX_ATTACHED_ARCHIVES = 8
+
+
+class ArchivedMonthError(Exception):
+    # Raised when changing entries of an archived month, since the archives are read-only
+    pass
+
+
+def get_archive_path(month: str) -> str:
+    return os.path.join(filesystem_helper.get_userdataarchive_path(), f"mtag_{month}.db")
+
+
+def get_archive_schemas(conn: sqlite3.Connection, from_timestamp: Optional[int] = None,
+                        to_timestamp: Optional[int] = None) -> Iterator[str]:
+    # Attach the archives with entries within the period, or all of them, and yield their schema names.
+    # Archives are detached again when too many are attached, so use each one before taking the next.
+    cursor = conn.execute("SELECT ar_month FROM archive"
+                          " WHERE (:from_date IS NULL OR :from_date <= ar_max_end)"
+                          " AND (:to_date IS NULL OR ar_min_start < :to_date)"
+                          " ORDER BY ar_month ASC",
+                          {"from_date": from_timestamp, "to_date": to_timestamp})
+    for db_archive in cursor.fetchall():
+        yield _attach(conn=conn, month=db_archive["ar_month"])
+
+
+def is_archived_period(conn: sqlite3.Connection, from_datetime: datetime.datetime,
+                       to_datetime: datetime.datetime) -> bool:
+    # Whether the period overlaps an archived month, or an archived entry reaching into the next month
+    from_timestamp = datetime_helper.datetime_to_timestamp(from_datetime)
+    to_timestamp = datetime_helper.datetime_to_timestamp(to_datetime)
+    for db_archive in conn.execute("SELECT ar_month, ar_max_end FROM archive").fetchall():
+        month_start = datetime.datetime.strptime(db_archive["ar_month"], "%Y-%m")
+        archived_from = datetime_helper.datetime_to_timestamp(month_start)
+        archived_to = max(datetime_helper.datetime_to_timestamp(_add_months(month_start, 1)), db_archive["ar_max_end"])
+        if from_timestamp < archived_to and archived_from < to_timestamp:
+            return True
+
+    return False
+
+
+def is_archived_entry(conn: sqlite3.Connection, table: str, id_column: str, db_id: int) -> bool:
+    # The archives are only looked in when the entry isn't in the main database
+    in_main = conn.execute(f"SELECT COUNT(*) FROM main.{table} WHERE {id_column}=:db_id",
+                           {"db_id": db_id}).fetchone()[0] > 0
+    return not in_main and exists_in_archives(conn=conn, table=table, column=id_column, value=db_id)
+
+
+def exists_in_archives(conn: sqlite3.Connection, table: str, column: str, value: int) -> bool:
+    # The foreign keys of the main database don't reach into the archives, so this is used in their place
+    for schema in get_archive_schemas(conn=conn):
+        if conn.execute(f"SELECT COUNT(*) FROM {schema}.{table} WHERE {column}=:value",
+                        {"value": value}).fetchone()[0] > 0:
+            return True
+
+    return False
+
+
+def get_overlapping_rows(conn: sqlite3.Connection, table: str, start_column: str, end_column: str,
+                         from_datetime: datetime.datetime, to_datetime: datetime.datetime,
+                         joins: str = "") -> List[sqlite3.Row]:
+    # The joins are made within the same database as the entries, which is given as {schema},
+    # e.g. "INNER JOIN {schema}.application_window ON le_application_window_id=aw_id"
+    from_timestamp = datetime_helper.datetime_to_timestamp(from_datetime)
+    to_timestamp = datetime_helper.datetime_to_timestamp(to_datetime)
+    archive_schemas = get_archive_schemas(conn=conn, from_timestamp=from_timestamp, to_timestamp=to_timestamp)
+
+    # Each database is read before the next archive is attached, since attaching may detach the
+    # others. Entries overlapping the period. See interval_bound in migration_helper.
+    rows = []
+    for schema in itertools.chain(["main"], archive_schemas):
+        cursor = conn.execute(f"SELECT * FROM {schema}.{table} {joins.format(schema=schema)} WHERE"
+                              f" :from_date - (SELECT ib_max_duration FROM {schema}.interval_bound"
+                              f"               WHERE ib_table='{table}') <= {start_column}"
+                              f" AND {start_column} < :to_date"
+                              f" AND :from_date <= {end_column}",
+                              {"from_date": from_timestamp, "to_date": to_timestamp})
+        rows.extend(cursor.fetchall())
+
+    return sorted(rows, key=lambda row: row[start_column])
+
+
+def archive_closed_months(conn: sqlite3.Connection, months_to_keep: int) -> List[str]:
+    # Archive the months which ended at least months_to_keep months ago. Returns the archived months.
+    if months_to_keep <= 0:
+        return []
+
+    today = datetime.date.today()
+    first_kept_month = _add_months(datetime.datetime(year=today.year, month=today.month, day=1), -months_to_keep)
+    first_kept_timestamp = datetime_helper.datetime_to_timestamp(first_kept_month)
+
+    # Tagging an archived month is refused, but entries may still be added to a month after it was
+    # archived, e.g. by a watcher with a wrong clock. They stay in the main database, which is looked up as well.
+    months = " UNION ".join(f"SELECT strftime('%Y-%m', {start_column}, 'unixepoch', 'localtime') AS month"
+                            f" FROM main.{table} WHERE {start_column} < :first_kept"
+                            for table, start_column, _ in archived_entry_tables)
+    cursor = conn.execute(f"SELECT month FROM ({months})"
+                          f" WHERE month NOT IN (SELECT ar_month FROM archive) ORDER BY month ASC",
+                          {"first_kept": first_kept_timestamp})
+
+    archived_months = []
+    for db_month in cursor.fetchall():
+        month = db_month["month"]
+        month_start = datetime.datetime.strptime(month, "%Y-%m")
+        archive_month(conn=conn, month=month, month_start=month_start, month_end=_add_months(month_start, 1))
+        archived_months.append(month)
+
+    return archived_months
+
+
+def archive_month(conn: sqlite3.Connection, month: str, month_start: datetime.datetime,
+                  month_end: datetime.datetime) -> None:
+    archived = conn.execute("SELECT COUNT(*) FROM archive WHERE ar_month=:month", {"month": month}).fetchone()[0]
+    if archived > 0:
+        raise ValueError(f"The month {month} has already been archived")
+
+    logging.info(f"Archiving {month}")
+    archive_path = get_archive_path(month)
+    # An archive without a row in the archive table was left behind by an interrupted archiving
+    for file_path in (archive_path, archive_path + ".tmp"):
+        if os.path.exists(file_path):
+            os.chmod(file_path, stat.S_IREAD | stat.S_IWRITE)
+            os.remove(file_path)
+
+    period = {"from_date": datetime_helper.datetime_to_timestamp(month_start),
+              "to_date": datetime_helper.datetime_to_timestamp(month_end)}
+    _create_archive(conn=conn, month=month, archive_path=archive_path + ".tmp", period=period)
+    _finish_archive(month=month)
+
+    logging.info(f"Archived {month} to {archive_path}")
+
+
+def _create_archive(conn: sqlite3.Connection, month: str, archive_path: str, period: dict) -> None:
+    # Attaching is not possible within a transaction
+    conn.execute("ATTACH DATABASE :path AS new_archive", {"path": archive_path})
+    try:
+        # The entries are copied and removed from the main database under the same write lock, so that
+        # they are visible either in the main database or in the archive, never in both or neither.
+        # An entry written to the month in the meantime would otherwise be removed without being copied.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # The tables are created like those of the main database, but without any triggers
+            for table in archived_reference_tables + [t for t, _, _ in archived_entry_tables] + ["interval_bound"]:
+                table_sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name=:name",
+                                         {"name": table}).fetchone()[0]
+                conn.execute(re.sub(r'^CREATE TABLE\s+"?\w+"?', f"CREATE TABLE new_archive.{table}", table_sql))
+
+            _copy_referenced_rows(conn=conn, period=period)
+            for table, start_column, _ in archived_entry_tables:
+                conn.execute(f"INSERT INTO new_archive.{table} SELECT * FROM main.{table}"
+                             f" WHERE :from_date <= {start_column} AND {start_column} < :to_date", period)
+
+            conn.execute("INSERT INTO new_archive.interval_bound(ib_table, ib_max_duration) " +
+                         " UNION ALL ".join(f"SELECT '{table}', COALESCE(MAX({end_column} - {start_column}), 0)"
+                                            f" FROM new_archive.{table}"
+                                            for table, start_column, end_column in archived_entry_tables))
+
+            bounds = [conn.execute(f"SELECT MIN({start_column}), MAX({end_column}) FROM new_archive.{table}").fetchone()
+                      for table, start_column, end_column in archived_entry_tables]
+            conn.execute("INSERT INTO archive(ar_month, ar_min_start, ar_max_end)"
+                         " VALUES (:month, :min_start, :max_end)",
+                         {"month": month,
+                          "min_start": min((b[0] for b in bounds if b[0] is not None), default=period["from_date"]),
+                          "max_end": max((b[1] for b in bounds if b[1] is not None), default=period["from_date"])})
+            for table, start_column, _ in archived_entry_tables:
+                conn.execute(f"DELETE FROM main.{table} WHERE :from_date <= {start_column} AND {start_column} < :to_date",
+                             period)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    finally:
+        conn.execute("DETACH DATABASE new_archive")
+
+
+def _finish_archive(month: str) -> None:
+    # The archive is given its name once its month has been removed from the main database. This is
+    # also done when attaching it, in case the archiving was interrupted between the two.
+    archive_path = get_archive_path(month)
+    if os.path.exists(archive_path + ".tmp"):
+        os.replace(archive_path + ".tmp", archive_path)
+        os.chmod(archive_path, stat.S_IREAD)
+
+
+def _copy_referenced_rows(conn: sqlite3.Connection, period: dict) -> None:
+    windows = ("SELECT le_application_window_id FROM main.logged_entry"
+               " WHERE :from_date <= le_start AND le_start < :to_date")
+    applications = f"SELECT aw_application_id FROM main.application_window WHERE aw_id IN ({windows})"
+    application_paths = f"SELECT a_path_id FROM main.application WHERE a_id IN ({applications})"
+    conn.execute(f"INSERT INTO new_archive.application_path SELECT * FROM main.application_path"
+                 f" WHERE ap_id IN ({application_paths})", period)
+    conn.execute(f"INSERT INTO new_archive.application SELECT * FROM main.application"
+                 f" WHERE a_id IN ({applications})", period)
+    conn.execute(f"INSERT INTO new_archive.application_window SELECT * FROM main.application_window"
+                 f" WHERE aw_id IN ({windows})", period)
+    # The categories are few, so all of them are copied, parents first
+    conn.execute("INSERT INTO new_archive.category SELECT * FROM main.category ORDER BY c_parent_id IS NOT NULL")
+
+
+def _attach(conn: sqlite3.Connection, month: str) -> str:
+    schema = ARCHIVE_SCHEMA_PREFIX + month.replace("-", "_")
+    attached_archives = [row["name"] for row in conn.execute("PRAGMA database_list")
+                         if row["name"].startswith(ARCHIVE_SCHEMA_PREFIX)]
+    if schema in attached_archives:
+        return schema
+
+    _finish_archive(month=month)
+    if MAX_ATTACHED_ARCHIVES <= len(attached_archives):
+        for attached_archive in attached_archives:
+            conn.execute(f"DETACH DATABASE {attached_archive}")
+
+    # Archives are only read, so open them read-only. This relies on the connection accepting URIs,
+    # see database_helper.open_connection, since the URI would otherwise be taken as a file name.
+    archive_uri = pathlib.Path(get_archive_path(month)).as_uri() + "?mode=ro"
+    conn.execute(f"ATTACH DATABASE :uri AS {schema}", {"uri": archive_uri})
+    return schema
+
+
+def _add_months(dt: datetime.datetime, months: int) -> datetime.datetime:
+    month_index = dt.year * 12 + dt.month - 1 + months
+    return dt.replace(year=month_index // 12, month=month_index % 12 + 1)
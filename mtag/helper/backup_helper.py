@@ -0,0 +1,333 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Set, Tuple
+
+from mtag.helper import filesystem_helper
+from mtag.helper.cache_helper import LruCache
+
+# A backup is a manifest, listing the hashes of the pages of the database in order.
+# The pages themselves are stored once, in compressed chunks in the pack files. Each
+# pack has an index of where its pages are. A backup only adds the pages which no
+# earlier backup has stored, so a daily backup of a mostly unchanged database is small.
+MANIFEST_EXTENSION = ".manifest"
+LEGACY_BACKUP_EXTENSION = ".db"
+PACK_EXTENSION = ".pack"
+PACK_INDEX_EXTENSION = ".index"
+PAGES_PER_CHUNK = 64
+COMPRESSION_LEVEL = 6
+# A pack where less than this share of the pages is still used is rewritten when purging
+MIN_LIVE_PAGE_SHARE = 0.5
+# Separates the name of the backup which first stored a pack's pages from the time the pack was written.
+# Every pack gets a name of its own, so a pack left behind by an interrupted backup is never overwritten.
+PACK_NAME_SEPARATOR = "+"
+# The number of decompressed chunks to keep in memory when restoring
+CHUNK_CACHE_SIZE = 16
+LOCK_FILE_NAME = "backup.lock"
+# A lock this old was left behind by a process which didn't finish its backup
+STALE_LOCK_SECONDS = 60 * 60
+
+# The daily backups are purged, but the backups of the archives are kept
+DAILY_BACKUP_PREFIX = "mtag_"
+ARCHIVE_BACKUP_PREFIX = "archive_"
+
+# The position of a page: its chunk's offset and length in the pack, and its position in the chunk
+PageLocation = Tuple[int, int, int]
+
+
+@contextmanager
+def lock() -> Iterator[bool]:
+    # Yields whether the lock was taken. Another process, e.g. the watcher and the web
+    # server both starting a new day, may already be storing a backup.
+    lock_path = os.path.join(filesystem_helper.get_userdatabackup_path(), LOCK_FILE_NAME)
+    if os.path.exists(lock_path) and STALE_LOCK_SECONDS < time.time() - os.path.getmtime(lock_path):
+        logging.warning("Removing a stale backup lock")
+        os.remove(lock_path)
+
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        yield False
+        return
+
+    try:
+        yield True
+    finally:
+        os.remove(lock_path)
+
+
+def get_packs_path() -> str:
+    packs_path = os.path.join(filesystem_helper.get_userdatabackup_path(), "packs")
+    if not os.path.exists(packs_path):
+        os.mkdir(packs_path)
+
+    return packs_path
+
+
+def get_backup_names() -> List[str]:
+    # Both the backups in the page store and the full copies made before it, oldest first
+    backup_names = set()
+    for f in os.listdir(filesystem_helper.get_userdatabackup_path()):
+        if f.endswith(MANIFEST_EXTENSION):
+            backup_names.add(f[:-len(MANIFEST_EXTENSION)])
+        elif f.endswith(LEGACY_BACKUP_EXTENSION):
+            backup_names.add(f[:-len(LEGACY_BACKUP_EXTENSION)])
+
+    return sorted(backup_names)
+
+
+def get_daily_backup_names() -> List[str]:
+    return [backup_name for backup_name in get_backup_names() if backup_name.startswith(DAILY_BACKUP_PREFIX)]
+
+
+def backup_exists(backup_name: str) -> bool:
+    return backup_name in get_backup_names()
+
+
+def store_backup(database_file_path: str, backup_name: str) -> None:
+    start = time.perf_counter()
+    known_hashes = set()
+    for pack_name in _get_pack_names():
+        known_hashes.update(_read_pack_index(pack_name)["pages"].keys())
+
+    with open(database_file_path, "rb") as database_file:
+        page_size = _get_page_size(database_file.read(100))
+        database_file.seek(0)
+
+        pack_writer = PackWriter(pack_name=_create_pack_name(backup_name), page_size=page_size)
+        page_hashes = []
+        for page in iter(lambda: database_file.read(page_size), b""):
+            page_hash = _hash_page(page)
+            page_hashes.append(page_hash)
+            if page_hash not in known_hashes:
+                known_hashes.add(page_hash)
+                pack_writer.add_page(page_hash=page_hash, page=page)
+
+    pack_writer.close()
+
+    # The manifest is written last, so a backup is only visible once all of its pages are stored
+    _write_compressed_json(file_path=_get_manifest_path(backup_name),
+                           content={"page_size": page_size, "pages": page_hashes})
+    logging.info(f"Stored the backup '{backup_name}' in {time.perf_counter() - start:.2f} seconds:"
+                 f" {pack_writer.page_count} of {len(page_hashes)} pages were new,"
+                 f" taking up {pack_writer.offset} bytes")
+
+
+def restore_backup(backup_name: str, output_file_path: str) -> None:
+    manifest_path = _get_manifest_path(backup_name)
+    if not os.path.exists(manifest_path):
+        legacy_backup_path = os.path.join(filesystem_helper.get_userdatabackup_path(),
+                                          backup_name + LEGACY_BACKUP_EXTENSION)
+        raise FileNotFoundError(f"There is no backup named '{backup_name}' in the page store."
+                                + (f" It's a copy of the database: {legacy_backup_path}"
+                                   if os.path.exists(legacy_backup_path) else ""))
+
+    manifest = _read_compressed_json(manifest_path)
+    needed_hashes = set(manifest["pages"])
+    page_locations: Dict[str, Tuple[str, PageLocation]] = {}
+    for pack_name in _get_pack_names():
+        for page_hash, page_location in _read_pack_index(pack_name)["pages"].items():
+            if page_hash in needed_hashes:
+                page_locations[page_hash] = (pack_name, tuple(page_location))
+
+    missing_hashes = needed_hashes - page_locations.keys()
+    if len(missing_hashes) > 0:
+        raise ValueError(f"The backup '{backup_name}' is missing {len(missing_hashes)} pages")
+
+    # Write to a temporary file first, so that a failed restore doesn't leave a broken database behind
+    temporary_file_path = output_file_path + ".tmp"
+    with PackReader() as pack_reader, open(temporary_file_path, "wb") as output_file:
+        for page_hash in manifest["pages"]:
+            pack_name, page_location = page_locations[page_hash]
+            page = pack_reader.read_page(pack_name=pack_name, page_location=page_location,
+                                         page_size=manifest["page_size"])
+            if _hash_page(page) != page_hash:
+                raise ValueError(f"A page of the backup '{backup_name}' is corrupt")
+            output_file.write(page)
+
+    os.replace(temporary_file_path, output_file_path)
+    logging.info(f"Restored the backup '{backup_name}' to {output_file_path}")
+
+
+def purge_backups_if_needed(retention_count: int) -> None:
+    # The latest backup is always kept. Slicing with a count of 0 would keep them all.
+    retention_count = max(retention_count, 1)
+    backup_names = get_daily_backup_names()
+    if len(backup_names) <= retention_count:
+        return
+
+    backup_path = filesystem_helper.get_userdatabackup_path()
+    for backup_name in backup_names[:-retention_count]:
+        logging.info(f"Removing backup '{backup_name}'")
+        for extension in (MANIFEST_EXTENSION, LEGACY_BACKUP_EXTENSION):
+            file_path = os.path.join(backup_path, backup_name + extension)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    _collect_garbage()
+
+
+def _collect_garbage() -> None:
+    live_hashes: Set[str] = set()
+    for backup_name in get_backup_names():
+        if os.path.exists(_get_manifest_path(backup_name)):
+            live_hashes.update(_read_compressed_json(_get_manifest_path(backup_name))["pages"])
+
+    for pack_name in _get_pack_names():
+        pack_index = _read_pack_index(pack_name)
+        page_size = pack_index["page_size"]
+        pack_locations = pack_index["pages"]
+        live_page_hashes = [h for h in pack_locations if h in live_hashes]
+        if len(live_page_hashes) == 0:
+            logging.info(f"Removing the unused pack '{pack_name}'")
+        elif len(pack_locations) * MIN_LIVE_PAGE_SHARE <= len(live_page_hashes):
+            continue
+        else:
+            # Move the pages which are still used to a new pack. Until the old pack is removed,
+            # the pages are in both, which is harmless.
+            logging.info(f"Repacking the pack '{pack_name}' with {len(live_page_hashes)}"
+                         f" of its {len(pack_locations)} pages")
+            pack_writer = PackWriter(pack_name=_create_pack_name(pack_name.split(PACK_NAME_SEPARATOR)[0]),
+                                     page_size=page_size)
+            with PackReader() as pack_reader:
+                for page_hash in live_page_hashes:
+                    pack_writer.add_page(page_hash=page_hash,
+                                         page=pack_reader.read_page(pack_name=pack_name,
+                                                                    page_location=tuple(pack_locations[page_hash]),
+                                                                    page_size=page_size))
+            pack_writer.close()
+
+        # The index is removed first, so that the pages are never listed without their pack
+        os.remove(_get_pack_index_path(pack_name))
+        os.remove(_get_pack_path(pack_name))
+
+
+class PackWriter:
+    def __init__(self, pack_name: str, page_size: int):
+        self.pack_name = pack_name
+        self.page_size = page_size
+        self.pack_file = None
+        self.pack_index: Dict[str, PageLocation] = {}
+        self.chunk_hashes: List[str] = []
+        self.chunk_pages: List[bytes] = []
+        self.offset = 0
+        self.page_count = 0
+
+    def add_page(self, page_hash: str, page: bytes) -> None:
+        self.chunk_hashes.append(page_hash)
+        self.chunk_pages.append(page)
+        self.page_count += 1
+        if len(self.chunk_pages) == PAGES_PER_CHUNK:
+            self._write_chunk()
+
+    def close(self) -> None:
+        self._write_chunk()
+        if self.pack_file is None:
+            # Nothing new to store
+            return
+
+        self.pack_file.close()
+        os.replace(_get_pack_path(self.pack_name) + ".tmp", _get_pack_path(self.pack_name))
+        _write_compressed_json(file_path=_get_pack_index_path(self.pack_name),
+                               content={"page_size": self.page_size, "pages": self.pack_index})
+
+    def _write_chunk(self) -> None:
+        if len(self.chunk_pages) == 0:
+            return
+
+        if self.pack_file is None:
+            self.pack_file = open(_get_pack_path(self.pack_name) + ".tmp", "wb")
+
+        # The pages of a chunk are of the pack's page size, so they are just concatenated
+        chunk = zlib.compress(b"".join(self.chunk_pages), COMPRESSION_LEVEL)
+        self.pack_file.write(chunk)
+        for i, page_hash in enumerate(self.chunk_hashes):
+            self.pack_index[page_hash] = (self.offset, len(chunk), i)
+
+        self.offset += len(chunk)
+        self.chunk_hashes.clear()
+        self.chunk_pages.clear()
+
+
+class PackReader:
+    def __init__(self):
+        self.pack_files = {}
+        self.chunk_cache = LruCache(max_size=CHUNK_CACHE_SIZE)
+
+    def __enter__(self) -> "PackReader":
+        return self
+
+    def __exit__(self, *_) -> None:
+        for pack_file in self.pack_files.values():
+            pack_file.close()
+        self.pack_files.clear()
+
+    def read_page(self, pack_name: str, page_location: PageLocation, page_size: int) -> bytes:
+        chunk_offset, chunk_length, page_position = page_location
+        chunk_key = (pack_name, chunk_offset)
+        chunk = self.chunk_cache.get(chunk_key)
+        if chunk is None:
+            if pack_name not in self.pack_files:
+                self.pack_files[pack_name] = open(_get_pack_path(pack_name), "rb")
+            pack_file = self.pack_files[pack_name]
+            pack_file.seek(chunk_offset)
+            chunk = zlib.decompress(pack_file.read(chunk_length))
+            self.chunk_cache.put(chunk_key, chunk)
+
+        return chunk[page_position * page_size:(page_position + 1) * page_size]
+
+
+def _get_page_size(database_header: bytes) -> int:
+    if not database_header.startswith(b"SQLite format 3\0"):
+        raise ValueError("Not an SQLite database")
+
+    # A big-endian value at offset 16, where 1 means 65536
+    page_size = int.from_bytes(database_header[16:18], "big")
+    return 65536 if page_size == 1 else page_size
+
+
+def _create_pack_name(backup_name: str) -> str:
+    return f"{backup_name}{PACK_NAME_SEPARATOR}{time.time_ns()}"
+
+
+def _hash_page(page: bytes) -> str:
+    return hashlib.blake2b(page, digest_size=16).hexdigest()
+
+
+def _get_pack_names() -> Iterator[str]:
+    # Only packs with an index are complete
+    for f in sorted(os.listdir(get_packs_path())):
+        if f.endswith(PACK_INDEX_EXTENSION):
+            yield f[:-len(PACK_INDEX_EXTENSION)]
+
+
+def _get_manifest_path(backup_name: str) -> str:
+    return os.path.join(filesystem_helper.get_userdatabackup_path(), backup_name + MANIFEST_EXTENSION)
+
+
+def _get_pack_path(pack_name: str) -> str:
+    return os.path.join(get_packs_path(), pack_name + PACK_EXTENSION)
+
+
+def _get_pack_index_path(pack_name: str) -> str:
+    return os.path.join(get_packs_path(), pack_name + PACK_INDEX_EXTENSION)
+
+
+def _read_pack_index(pack_name: str) -> Dict:
+    return _read_compressed_json(_get_pack_index_path(pack_name))
+
+
+def _read_compressed_json(file_path: str) -> Dict:
+    with open(file_path, "rb") as json_file:
+        return json.loads(zlib.decompress(json_file.read()))
+
+
+def _write_compressed_json(file_path: str, content: Dict) -> None:
+    temporary_file_path = file_path + ".tmp"
+    with open(temporary_file_path, "wb") as json_file:
+        json_file.write(zlib.compress(json.dumps(content, separators=(",", ":")).encode("utf-8"), COMPRESSION_LEVEL))
+    os.replace(temporary_file_path, file_path)
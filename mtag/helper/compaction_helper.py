@@ -0,0 +1,137 @@
+import datetime
+import logging
+import sqlite3
+from collections import namedtuple
+from typing import List
+
+from mtag.helper import datetime_helper
+
+# Old logged entries are compacted a day at a time. Entries shorter than the minimum duration
+# lose their window title, by being moved to the "N/A" window of their application. Adjacent
+# entries of the same window are then merged into one. Only the logged entries are changed,
+# so the tagged and activity entries, and thereby the tagged time, stay as they are.
+# Each compacted day is recorded in the logged_entry_compaction table.
+
+# The title the watcher registers when the window title is unknown
+NO_TITLE = "N/A"
+
+Compaction = namedtuple("Compaction", ["from_timestamp", "to_timestamp", "entries_before", "entries_after",
+                                       "titles_dropped"])
+
+
+def compact_old_entries(conn: sqlite3.Connection, days_to_keep: int, min_entry_seconds: int,
+                        max_gap_seconds: int) -> List[Compaction]:
+    # Compact the days which ended at least days_to_keep days ago. Returns the compacted days.
+    if days_to_keep <= 0:
+        return []
+
+    first_kept_day = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=days_to_keep),
+                                               datetime.time())
+    first_kept_timestamp = datetime_helper.datetime_to_timestamp(first_kept_day)
+    compacted_to = conn.execute("SELECT MAX(lec_to) FROM logged_entry_compaction").fetchone()[0]
+
+    compactions = []
+    while True:
+        # Jump to the next day with entries, rather than going through empty days
+        next_start = conn.execute("SELECT MIN(le_start) FROM main.logged_entry"
+                                  " WHERE :compacted_to <= le_start AND le_start < :first_kept",
+                                  {"compacted_to": compacted_to if compacted_to is not None else 0,
+                                   "first_kept": first_kept_timestamp}).fetchone()[0]
+        if next_start is None:
+            break
+
+        day_start = datetime.datetime.combine(datetime_helper.timestamp_to_datetime(next_start).date(),
+                                              datetime.time())
+        compaction = compact_period(conn=conn,
+                                    from_datetime=day_start,
+                                    to_datetime=day_start + datetime.timedelta(days=1),
+                                    min_entry_seconds=min_entry_seconds,
+                                    max_gap_seconds=max_gap_seconds)
+        compactions.append(compaction)
+        compacted_to = compaction.to_timestamp
+
+    if len(compactions) > 0:
+        logging.info(f"Compacted the logged entries of {len(compactions)} days:"
+                     f" {sum(c.entries_before for c in compactions)} entries became"
+                     f" {sum(c.entries_after for c in compactions)}")
+    return compactions
+
+
+def compact_period(conn: sqlite3.Connection, from_datetime: datetime.datetime, to_datetime: datetime.datetime,
+                   min_entry_seconds: int, max_gap_seconds: int) -> Compaction:
+    # The entries starting within the period are compacted in a transaction of their own
+    period = {"from_date": datetime_helper.datetime_to_timestamp(from_datetime),
+              "to_date": datetime_helper.datetime_to_timestamp(to_datetime),
+              "min_entry_seconds": min_entry_seconds,
+              "no_title": NO_TITLE}
+    with conn:
+        entries_before = conn.execute("SELECT COUNT(*) FROM main.logged_entry"
+                                      " WHERE :from_date <= le_start AND le_start < :to_date",
+                                      period).fetchone()[0]
+        titles_dropped = _drop_short_titles(conn=conn, period=period)
+        entries_merged = _merge_adjacent_entries(conn=conn, period=period, max_gap_seconds=max_gap_seconds)
+
+        compaction = Compaction(from_timestamp=period["from_date"], to_timestamp=period["to_date"],
+                                entries_before=entries_before, entries_after=entries_before - entries_merged,
+                                titles_dropped=titles_dropped)
+        conn.execute("INSERT INTO logged_entry_compaction(lec_compacted_at, lec_from, lec_to, lec_min_entry_seconds,"
+                     " lec_entries_before, lec_entries_after, lec_titles_dropped)"
+                     " VALUES (:compacted_at, :from_date, :to_date, :min_entry_seconds,"
+                     " :entries_before, :entries_after, :titles_dropped)",
+                     {"compacted_at": datetime_helper.datetime_to_timestamp(datetime.datetime.now()),
+                      "from_date": compaction.from_timestamp,
+                      "to_date": compaction.to_timestamp,
+                      "min_entry_seconds": min_entry_seconds,
+                      "entries_before": compaction.entries_before,
+                      "entries_after": compaction.entries_after,
+                      "titles_dropped": compaction.titles_dropped})
+
+    logging.debug(f"Compacted the logged entries from {from_datetime}: {compaction}")
+    return compaction
+
+
+def _drop_short_titles(conn: sqlite3.Connection, period: dict) -> int:
+    short_entries = ("FROM main.logged_entry"
+                     " INNER JOIN main.application_window ON le_application_window_id=aw_id"
+                     " WHERE :from_date <= le_start AND le_start < :to_date"
+                     " AND le_last_update - le_start < :min_entry_seconds AND aw_title != :no_title")
+
+    # The applications of the short entries may not have had a window without a title yet
+    conn.execute(f"INSERT OR IGNORE INTO main.application_window(aw_application_id, aw_title)"
+                 f" SELECT DISTINCT aw_application_id, :no_title {short_entries}", period)
+    cursor = conn.execute(f"UPDATE main.logged_entry SET le_application_window_id="
+                          f" (SELECT no_title_window.aw_id FROM main.application_window AS titled_window"
+                          f"  INNER JOIN main.application_window AS no_title_window"
+                          f"  ON no_title_window.aw_application_id=titled_window.aw_application_id"
+                          f"  AND no_title_window.aw_title=:no_title"
+                          f"  WHERE titled_window.aw_id=le_application_window_id)"
+                          f" WHERE le_id IN (SELECT le_id {short_entries})", period)
+    return cursor.rowcount
+
+
+def _merge_adjacent_entries(conn: sqlite3.Connection, period: dict, max_gap_seconds: int) -> int:
+    # Entries of the same window which are at most max_gap_seconds apart are merged, like the watcher
+    # would have made them one entry. The first entry is extended and the following ones are removed.
+    cursor = conn.execute("SELECT le_id, le_application_window_id, le_start, le_last_update FROM main.logged_entry"
+                          " WHERE :from_date <= le_start AND le_start < :to_date ORDER BY le_start ASC", period)
+
+    merged_entry_ids = []
+    extended_entries = {}
+    kept_entry = None
+    kept_last_update = None
+    for db_le in cursor.fetchall():
+        if kept_entry is not None and kept_entry["le_application_window_id"] == db_le["le_application_window_id"] \
+                and db_le["le_start"] - kept_last_update <= max_gap_seconds:
+            kept_last_update = max(kept_last_update, db_le["le_last_update"])
+            merged_entry_ids.append((db_le["le_id"],))
+            extended_entries[kept_entry["le_id"]] = kept_last_update
+            continue
+
+        kept_entry = db_le
+        kept_last_update = db_le["le_last_update"]
+
+    # The last updates are unique, so remove the merged entries before extending the kept ones
+    conn.executemany("DELETE FROM main.logged_entry WHERE le_id=?", merged_entry_ids)
+    conn.executemany("UPDATE main.logged_entry SET le_last_update=? WHERE le_id=?",
+                     [(last_update, le_id) for le_id, last_update in extended_entries.items()])
+    return len(merged_entry_ids)
@@ -1,6 +1,7 @@
 import json
+import logging
 import os
-from typing import Dict
+from typing import Callable, Dict, List, Optional, Tuple
 
 from mtag.helper import filesystem_helper
 
@@ -9,24 +10,76 @@ class Configuration:
     default_configuration = {
         "seconds_before_new_entry": 10,
         "inactive_after_idle_seconds": 600,
-        "log_application_path": False
+        "log_application_path": False,
+        "watcher_cache_size": 512,
+        "watcher_flush_interval_seconds": 30,
+        "watcher_inactive_sample_interval_seconds": 30,
+        "watcher_statistics_enabled": True,
+        "watcher_probe_timeout_seconds": 1,
+        "backup_retention_count": 3,
+        "archive_after_months": 0,
+        "compact_after_days": 0,
+        "compact_min_entry_seconds": 60
     }
-
-    def __init__(self, inactive_after_idle_seconds: int, seconds_before_new_entry: int, log_application_path: bool):
+    # Settings which may also be given as a fraction, the others have the type of their default value
+    fractional_keys = {"watcher_probe_timeout_seconds"}
+    # The least value of the settings, 0 for those not listed
+    min_values = {"backup_retention_count": 1}
+
+    def __init__(self, inactive_after_idle_seconds: int, seconds_before_new_entry: int, log_application_path: bool,
+                 watcher_cache_size: int = default_configuration["watcher_cache_size"],
+                 watcher_flush_interval_seconds: int = default_configuration["watcher_flush_interval_seconds"],
+                 watcher_inactive_sample_interval_seconds: int = default_configuration["watcher_inactive_sample_interval_seconds"],
+                 watcher_statistics_enabled: bool = default_configuration["watcher_statistics_enabled"],
+                 watcher_probe_timeout_seconds: float = default_configuration["watcher_probe_timeout_seconds"],
+                 backup_retention_count: int = default_configuration["backup_retention_count"],
+                 archive_after_months: int = default_configuration["archive_after_months"],
+                 compact_after_days: int = default_configuration["compact_after_days"],
+                 compact_min_entry_seconds: int = default_configuration["compact_min_entry_seconds"]):
         self.inactive_after_idle_seconds = inactive_after_idle_seconds
         self.seconds_before_new_entry = seconds_before_new_entry
         self.log_application_path = log_application_path
+        self.watcher_cache_size = watcher_cache_size
+        # At most this many seconds of extended entries are kept in memory only
+        self.watcher_flush_interval_seconds = watcher_flush_interval_seconds
+        # Used while locked or idle. Capped so that the inactive period isn't split into several entries.
+        self.watcher_inactive_sample_interval_seconds = watcher_inactive_sample_interval_seconds
+        self.watcher_statistics_enabled = watcher_statistics_enabled
+        # A probe slower than this gets its last known value
+        self.watcher_probe_timeout_seconds = watcher_probe_timeout_seconds
+        # The number of daily backups to keep
+        self.backup_retention_count = backup_retention_count
+        # Months which ended this many months ago are moved to archives, after which their tagged
+        # entries can't be changed. 0 disables the archiving.
+        self.archive_after_months = archive_after_months
+        # Logged entries of days which ended this many days ago are compacted, which can't be undone.
+        # 0 disables the compaction.
+        self.compact_after_days = compact_after_days
+        # Compacted logged entries shorter than this lose their window title
+        self.compact_min_entry_seconds = compact_min_entry_seconds
 
     def asdict(self) -> Dict:
         d = {k: self.__getattribute__(k) for k, v in Configuration.default_configuration.items()}
         return d
 
 
+cached_configuration: Optional[Configuration] = None
+cached_configuration_stat: Optional[Tuple[int, int]] = None
+configuration_listeners: List[Callable[[Configuration], None]] = []
+
+
 def get_configuration() -> Configuration:
+    global cached_configuration, cached_configuration_stat
     configuration_path = get_configuration_path()
     if not os.path.exists(configuration_path):
         save_configuration(Configuration.default_configuration)
 
+    # Only read the file again if it has been changed since the last time
+    configuration_stat = os.stat(configuration_path)
+    stat_key = (configuration_stat.st_mtime_ns, configuration_stat.st_size)
+    if cached_configuration is not None and cached_configuration_stat == stat_key:
+        return Configuration(**cached_configuration.asdict())
+
     with open(configuration_path, "r") as config_file:
         read_configuration = json.load(fp=config_file)
 
@@ -34,7 +87,45 @@ def get_configuration() -> Configuration:
         if k not in read_configuration:
             read_configuration[k] = v
 
-    return Configuration(**read_configuration)
+    configuration_changed = cached_configuration is not None
+    cached_configuration = Configuration(**read_configuration)
+    cached_configuration_stat = stat_key
+
+    if configuration_changed:
+        logging.info("The configuration has been changed. Reloaded it.")
+        _notify_configuration_listeners()
+
+    return Configuration(**cached_configuration.asdict())
+
+
+def validate_configuration_value(key: str, value) -> None:
+    if key not in Configuration.default_configuration:
+        raise ValueError(f"Unknown configuration key '{key}'")
+
+    # bool is a subclass of int, so it's told apart first
+    default_value = Configuration.default_configuration[key]
+    min_value = Configuration.min_values.get(key, 0)
+    if isinstance(default_value, bool):
+        valid = isinstance(value, bool)
+    elif key in Configuration.fractional_keys:
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool) and min_value <= value
+    else:
+        valid = isinstance(value, int) and not isinstance(value, bool) and min_value <= value
+    if not valid:
+        raise ValueError(f"Invalid value {value!r} for configuration key '{key}'")
+
+
+def invalidate_configuration() -> None:
+    global cached_configuration_stat
+    cached_configuration_stat = None
+
+
+def add_configuration_listener(listener: Callable[[Configuration], None]) -> None:
+    configuration_listeners.append(listener)
+
+
+def remove_configuration_listener(listener: Callable[[Configuration], None]) -> None:
+    configuration_listeners.remove(listener)
 
 
 def save_configuration(configuration):
@@ -51,3 +142,15 @@ def get_configuration_path():
 def update_configuration(new_configuration: Configuration) -> None:
     configuration_to_save = new_configuration.asdict()
     save_configuration(configuration_to_save)
+
+    # Reading it back updates the cache and notifies the listeners
+    configuration_was_cached = cached_configuration is not None
+    invalidate_configuration()
+    get_configuration()
+    if not configuration_was_cached:
+        _notify_configuration_listeners()
+
+
+def _notify_configuration_listeners() -> None:
+    for listener in list(configuration_listeners):
+        listener(Configuration(**cached_configuration.asdict()))
@@ -1,22 +1,95 @@
 import sqlite3
 import os
 import logging
+import threading
+import time
 from datetime import date
-from mtag.helper import filesystem_helper
+from typing import Optional
+from mtag.helper import archive_helper, backup_helper, compaction_helper, configuration_helper, filesystem_helper
+from mtag.helper import migration_helper
 
 
 latest_seen_backup_date = None
+# A backup which failed, or was being taken by another process, is tried again after this long
+BACKUP_RETRY_SECONDS = 600
+backup_attempt_date: Optional[date] = None
+next_backup_attempt_time = 0.0
+
+# Wait this long for another process, e.g. the watcher, to finish writing
+BUSY_TIMEOUT_MILLISECONDS = 5000
+# Checkpoint the write-ahead log this often, and truncate it once it has grown beyond the threshold
+CHECKPOINT_INTERVAL_SECONDS = 60
+WAL_TRUNCATE_THRESHOLD_BYTES = 16 * 1024 * 1024
+# The size the write-ahead log is truncated to after a checkpoint, if larger
+JOURNAL_SIZE_LIMIT_BYTES = 4 * 1024 * 1024
+
+# Copy this many pages per step when taking a backup, and let other connections in between the steps
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_SECONDS_BETWEEN_STEPS = 0.01
+
+backup_thread: Optional[threading.Thread] = None
+# Whether old entries are compacted and archived once a day, after the daily backup. Only the watcher
+# turns this on, so that e.g. opening the GUI or the web app never starts rewriting the database.
+maintenance_enabled = False
+maintained_date: Optional[date] = None
+# The remaining and total number of pages of the running backup
+backup_progress = (0, 0)
+
+checkpoint_thread: Optional[threading.Thread] = None
+checkpoint_stop_event = threading.Event()
+
+# Each thread gets its own connection, which is reused by every create_connection() on that thread
+thread_local_connections = threading.local()
+# The backup and update checks run once per process and date
+prepared_date: Optional[date] = None
+prepare_lock = threading.Lock()
 
 
 def create_connection() -> sqlite3.Connection:
-    userdata_path = filesystem_helper.get_userdata_path()
-    database_file_path = os.path.join(userdata_path, "mtag.db")
+    # The connection is not closed when used as a context manager ("with create_connection() as conn"),
+    # only committed, or rolled back on an exception, so it can be handed out again.
+    conn = getattr(thread_local_connections, "conn", None)
+    if conn is None:
+        conn = open_connection()
+        thread_local_connections.conn = conn
+
+    _prepare_if_needed(conn=conn)
+    return conn
+
+
+def close_connection() -> None:
+    conn = getattr(thread_local_connections, "conn", None)
+    if conn is None:
+        return
+
+    thread_local_connections.conn = None
+    conn.close()
+
+
+def get_database_path() -> str:
+    return os.path.join(filesystem_helper.get_userdata_path(), "mtag.db")
+
+
+def open_connection() -> sqlite3.Connection:
+    database_file_path = get_database_path()
     schema_script_needed = not os.path.exists(database_file_path)
 
-    conn = sqlite3.connect(database_file_path, detect_types=sqlite3.PARSE_DECLTYPES)
+    # URIs are accepted so that the archives can be attached read-only. The database path is no URI,
+    # since it doesn't start with "file:", and is opened as is.
+    conn = sqlite3.connect(database_file_path, detect_types=sqlite3.PARSE_DECLTYPES, uri=True)
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MILLISECONDS}")
     conn.execute("PRAGMA foreign_keys=ON")
 
+    # With a write-ahead log the readers (the GUIs) and the writer (the watcher) don't block each other.
+    # The journal mode is persistent, so this only changes anything the first time.
+    journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    if journal_mode != "wal":
+        logging.warning(f"Unable to switch to the WAL journal mode. Using '{journal_mode}'.")
+    # A commit in WAL mode is still durable against application crashes, but not necessarily power loss
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA journal_size_limit={JOURNAL_SIZE_LIMIT_BYTES}")
+
     if schema_script_needed:
         logging.info("No database found. Creating it.")
         schema_file_path = os.path.join(os.path.dirname(__file__), "schema.sql")
@@ -26,121 +99,194 @@ def create_connection() -> sqlite3.Connection:
 
         conn.executescript(schema_script)
 
-    _backup_if_needed(conn=conn)
-    filesystem_helper.purge_backups_if_needed()
-    _update_if_needed(conn=conn)
-
     return conn
 
 
-def _backup_if_needed(conn: sqlite3.Connection) -> None:
-    global latest_seen_backup_date
+def start_checkpoint_thread() -> None:
+    global checkpoint_thread
+    if checkpoint_thread is not None:
+        return
+
+    checkpoint_stop_event.clear()
+    checkpoint_thread = threading.Thread(target=_run_checkpoints, name="mtag-checkpoint", daemon=True)
+    checkpoint_thread.start()
+
+
+def stop_checkpoint_thread() -> None:
+    global checkpoint_thread
+    if checkpoint_thread is None:
+        return
+
+    checkpoint_stop_event.set()
+    checkpoint_thread.join()
+    checkpoint_thread = None
+
+
+def checkpoint(conn: sqlite3.Connection, truncate: bool = False) -> None:
+    # A passive checkpoint never waits for the readers. Truncating waits for them, but
+    # is needed now and then, since the log can't be restarted while it's being read.
+    wal_file_path = get_database_path() + "-wal"
+    wal_size = os.path.getsize(wal_file_path) if os.path.exists(wal_file_path) else 0
+    mode = "TRUNCATE" if truncate or WAL_TRUNCATE_THRESHOLD_BYTES <= wal_size else "PASSIVE"
+
+    busy, wal_pages, checkpointed_pages = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    logging.debug(f"{mode} checkpoint of a {wal_size} bytes log: {checkpointed_pages} of {wal_pages} pages"
+                  f" checkpointed{', blocked by a reader or writer' if busy else ''}")
+
+
+def _run_checkpoints() -> None:
+    conn = open_connection()
+    try:
+        stopping = False
+        while not stopping:
+            # Leave as small a log as possible behind when stopping
+            stopping = checkpoint_stop_event.wait(CHECKPOINT_INTERVAL_SECONDS)
+            try:
+                checkpoint(conn=conn, truncate=stopping)
+            except sqlite3.Error as ex:
+                logging.warning(f"Unable to checkpoint the database: {ex}")
+    finally:
+        conn.close()
+
+
+def _prepare_if_needed(conn: sqlite3.Connection) -> None:
+    global prepared_date
+    today = date.today()
+    if prepared_date == today:
+        backup_if_needed()
+        return
+
+    with prepare_lock:
+        if prepared_date == today:
+            return
+
+        prepare_database(conn=conn)
+        prepared_date = today
+
+
+def prepare_database(conn: sqlite3.Connection) -> None:
+    backup_if_needed()
+    migration_helper.update_if_needed(conn=conn)
+
+
+def backup_if_needed() -> None:
+    # Cheap once the backup of the day has been seen, so it's called often, to retry a failed backup
+    global latest_seen_backup_date, backup_thread, backup_attempt_date, next_backup_attempt_time
     today = date.today()
 
     # We've already seen a backup for the current date
     if latest_seen_backup_date == today:
         return
 
-    backup_filename = today.strftime("mtag_%Y-%m-%d.db")
-    backup_filepath = os.path.join(filesystem_helper.get_userdatabackup_path(),
-                                   backup_filename)
+    if backup_attempt_date == today and time.monotonic() < next_backup_attempt_time:
+        return
+    backup_attempt_date = today
+    next_backup_attempt_time = time.monotonic() + BACKUP_RETRY_SECONDS
 
-    latest_seen_backup_date = today
+    if backup_thread is not None and backup_thread.is_alive():
+        logging.info("A backup is already running")
+        return
 
-    if os.path.exists(backup_filepath):
-        logging.debug(f"Backup '{backup_filename}' exists. Nothing to do.")
+    backup_name = today.strftime("mtag_%Y-%m-%d")
+    if backup_helper.backup_exists(backup_name):
+        logging.debug(f"Backup '{backup_name}' exists. Nothing to do.")
+        latest_seen_backup_date = today
+        # E.g. taken by the GUI, before the watcher was started
+        if maintenance_enabled and maintained_date != today:
+            backup_thread = threading.Thread(target=_maintain_if_needed, name="mtag-maintenance", daemon=True)
+            backup_thread.start()
         return
 
-    logging.info("No backup for current date exists. Creating it.")
-    conn.execute(f"VACUUM INTO '{backup_filepath}'")
-
-
-def _update_if_needed(conn: sqlite3.Connection):
-    cursor = conn.execute("SELECT COUNT(*) as version_exist FROM sqlite_master WHERE type='table' AND name='version'")
-    version_table_exists = cursor.fetchone()["version_exist"] == 1
-    if not version_table_exists:
-        logging.info("Updating database to version 1")
-        cursor.execute("ALTER TABLE category ADD COLUMN c_url TEXT NOT NULL DEFAULT ''")
-        cursor.execute("CREATE TABLE version(v_version INTEGER PRIMARY KEY NOT NULL)")
-        cursor.execute("INSERT INTO version VALUES (1)")
-        conn.commit()
-        logging.info("Database updated to version 1")
-
-    cursor = conn.execute("SELECT MAX(v_version) AS current_version FROM version")
-    database_version = cursor.fetchone()["current_version"]
-    cursor.close()
-
-    if database_version < 2:
-        logging.info("Updating database to version 2")
-
-        old_isolation_level = conn.isolation_level
-        conn.isolation_level = "EXCLUSIVE"
-        cursor = conn.cursor()
-
-        # https://www.sqlite.org/lang_altertable.html
-        #  1. If foreign key constraints are enabled,
-        #     disable them using PRAGMA foreign_keys=OFF.
-        cursor.execute("PRAGMA foreign_keys=OFF")
-
-        # 2. Start a transaction
-        cursor.execute("BEGIN")
-
-        # 3.  Remember the format of all indexes, triggers, and views
-        #     associated with table X. This information will be needed in
-        #     step 8 below. One way to do this is to run a query like the
-        #     following: SELECT type, sql FROM sqlite_schema WHERE tbl_name='X'.
-
-        # N/A
-
-        # 4. Use CREATE TABLE to construct a new table "new_X" that is in
-        #    the desired revised format of table X. Make sure that the name
-        #    "new_X" does not collide with any existing table name, of course.
-        cursor.execute("""
-CREATE TABLE new_category (
-    c_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    c_name TEXT NOT NULL,
-    c_url TEXT NOT NULL DEFAULT '',
-    c_parent_id INTEGER DEFAULT NULL,
-    FOREIGN KEY (c_parent_id) REFERENCES new_category(c_id),
-    UNIQUE (c_name, c_parent_id)
-)""")
-
-        # 5. Transfer content from X into new_X using a statement like: INSERT INTO new_X SELECT ... FROM X.
-        cursor.execute("""
-INSERT INTO new_category(c_id, c_name, c_url)
- SELECT category.c_id, category.c_name, category.c_url FROM category""")
-
-        # 6. Drop the old table
-        cursor.execute("DROP TABLE category")
-
-        # 7. Change the name of new_X to X using: ALTER TABLE new_X RENAME TO X.
-        cursor.execute("ALTER TABLE new_category RENAME TO category")
-
-        # 8. Use CREATE INDEX, CREATE TRIGGER, and CREATE VIEW to reconstruct indexes,
-        #    triggers, and views associated with table X. Perhaps use the old format
-        #    of the triggers, indexes, and views saved from step 3 above as a guide,
-        #    making changes as appropriate for the alteration.
-
-        # N/A
-
-        # 9. If any views refer to table X in a way that is affected by the schema change,
-        #    then drop those views using DROP VIEW and recreate them with whatever changes
-        #    are necessary to accommodate the schema change using CREATE VIEW.
-
-        # N/A
-
-        # 10. If foreign key constraints were originally enabled then run
-        #     PRAGMA foreign_key_check to verify that the schema change did not break
-        #     any foreign key constraints.
-        cursor.execute("PRAGMA foreign_key_check")
-
-        # 11. Commit the transaction started in step 2.
-        cursor.execute("COMMIT")
-
-        # 12. If foreign keys constraints were originally enabled, reenable them now.
-        cursor.execute("PRAGMA foreign_keys=ON")
-        cursor.execute("INSERT INTO version VALUES (2)")
-        conn.commit()
-        conn.isolation_level = old_isolation_level
-        logging.info("Database updated to version 2")
+    logging.info("No backup for current date exists. Creating it in the background.")
+
+    # The snapshot to back up is taken right away, so that e.g. a database update which follows
+    # is not part of the backup. Reading the snapshot doesn't block the writers of the database.
+    source_conn = sqlite3.connect(get_database_path(), check_same_thread=False)
+    source_conn.isolation_level = None
+    source_conn.execute("BEGIN")
+    source_conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+    backup_thread = threading.Thread(target=_create_backup, args=(source_conn, today),
+                                     name="mtag-backup", daemon=True)
+    backup_thread.start()
+
+
+def _create_backup(source_conn: sqlite3.Connection, backup_date: date) -> None:
+    global latest_seen_backup_date
+    backup_name = backup_date.strftime("mtag_%Y-%m-%d")
+    # The snapshot is copied to a temporary database first, which is then split into pages for the backup store
+    temporary_filepath = os.path.join(filesystem_helper.get_userdatabackup_path(), backup_name + ".db.tmp")
+    try:
+        with backup_helper.lock() as locked:
+            if not locked:
+                logging.info("Another process is creating a backup. Checking for it again later.")
+                return
+
+            if os.path.exists(temporary_filepath):
+                os.remove(temporary_filepath)
+
+            backup_conn = sqlite3.connect(temporary_filepath)
+            try:
+                source_conn.backup(backup_conn, pages=BACKUP_PAGES_PER_STEP, progress=_report_backup_progress)
+                # Restored backups are then a single file, like the VACUUM INTO backups were
+                backup_conn.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                backup_conn.close()
+                # Release the snapshot as soon as it has been copied
+                source_conn.close()
+
+            backup_helper.store_backup(database_file_path=temporary_filepath, backup_name=backup_name)
+            os.remove(temporary_filepath)
+            logging.info(f"Created the backup '{backup_name}'")
+            # Only now, so that a backup which failed, or was left to another process, is tried again
+            latest_seen_backup_date = backup_date
+
+            configuration = configuration_helper.get_configuration()
+            backup_helper.purge_backups_if_needed(retention_count=configuration.backup_retention_count)
+
+        # Right after a backup is a good time to compact old entries and move old months out of the database
+        _maintain_if_needed()
+    except (sqlite3.Error, OSError, ValueError) as ex:
+        logging.error(f"Unable to create the backup '{backup_name}': {ex}")
+    finally:
+        source_conn.close()
+
+
+def _maintain_if_needed() -> None:
+    global maintained_date
+    today = date.today()
+    if not maintenance_enabled or maintained_date == today:
+        return
 
+    maintained_date = today
+    try:
+        _maintain_database(configuration=configuration_helper.get_configuration())
+    except (sqlite3.Error, OSError, ValueError) as ex:
+        logging.error(f"Unable to compact and archive the old entries: {ex}")
+
+
+def _maintain_database(configuration: configuration_helper.Configuration) -> None:
+    conn = open_connection()
+    try:
+        # The thread which started the backup may not have updated the database yet
+        migration_helper.update_if_needed(conn=conn)
+        # Compacted before being archived, so that the archives are compacted as well
+        compaction_helper.compact_old_entries(conn=conn, days_to_keep=configuration.compact_after_days,
+                                              min_entry_seconds=configuration.compact_min_entry_seconds,
+                                              max_gap_seconds=configuration.seconds_before_new_entry)
+        archived_months = archive_helper.archive_closed_months(conn=conn,
+                                                               months_to_keep=configuration.archive_after_months)
+    finally:
+        conn.close()
+
+    # The archives never change, so they are only backed up once
+    for month in archived_months:
+        backup_helper.store_backup(database_file_path=archive_helper.get_archive_path(month),
+                                   backup_name=backup_helper.ARCHIVE_BACKUP_PREFIX + month)
+
+
+def _report_backup_progress(_status: int, remaining: int, total: int) -> None:
+    global backup_progress
+    backup_progress = (remaining, total)
+    logging.debug(f"Backup progress: {total - remaining} of {total} pages copied")
+    time.sleep(BACKUP_SECONDS_BETWEEN_STEPS)
@@ -1,12 +1,12 @@
 import os
 import sys
 from typing import Optional
-import logging
 
 
 user_configuration_path: Optional[str] = None
 user_data_path: Optional[str] = None
 user_data_backup_path: Optional[str] = None
+user_data_archive_path: Optional[str] = None
 
 
 def is_windows():
@@ -68,19 +68,16 @@ def get_userdatabackup_path() -> str:
     return user_data_backup_path
 
 
-def purge_backups_if_needed() -> None:
-    backup_directory_contents = [f for f in os.listdir(get_userdatabackup_path())
-                                 if f.endswith(".db")]
+def get_userdataarchive_path() -> str:
+    global user_data_archive_path
+    if user_data_archive_path is not None:
+        return user_data_archive_path
 
-    MAX_BACKUPS_TO_KEEP = 3
-    if len(backup_directory_contents) <= MAX_BACKUPS_TO_KEEP:
-        return
+    user_data_archive_path = os.path.join(get_userdata_path(), "archive")
+    if not os.path.exists(user_data_archive_path):
+        os.mkdir(user_data_archive_path)
 
-    backup_directory_contents.sort()
-    global user_data_backup_path
-    for f in backup_directory_contents[:-MAX_BACKUPS_TO_KEEP]:
-        logging.info(f"Removing backup '{f}'")
-        os.remove(os.path.join(user_data_backup_path, f))
+    return user_data_archive_path
 
 
 def _get_mtag_path(base_path: str) -> str:
@@ -0,0 +1,27 @@
+from typing import Any, Dict, Optional
+
+from mtag.helper.cache_helper import LruCache
+
+# Process-wide map of the rows which the entries refer to, keyed by their table and id, so that
+# they are only read once and shared by every repository. Only the application paths, applications
+# and windows are kept, which are never changed once inserted. The categories can be changed, also
+# by another process, and are cached by the CategoryRepository along with the category version.
+IDENTITY_MAP_SIZE = 4096
+
+identity_map = LruCache(max_size=IDENTITY_MAP_SIZE)
+
+
+def get(table: str, db_id: int) -> Optional[Any]:
+    return identity_map.get((table, db_id))
+
+
+def put(table: str, db_id: int, entity: Any) -> None:
+    identity_map.put((table, db_id), entity)
+
+
+def clear() -> None:
+    identity_map.clear()
+
+
+def stats() -> Dict[str, int]:
+    return identity_map.stats()
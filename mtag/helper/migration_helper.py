@@ -0,0 +1,169 @@
+import logging
+import sqlite3
+from collections import namedtuple
+
+# A numbered step of the database schema. The steps are run in order, starting with
+# the one after the current version. Append new steps at the end and never change old ones.
+Migration = namedtuple("Migration", ["version", "description", "migrate"])
+
+
+def _add_category_url(conn: sqlite3.Connection) -> None:
+    conn.execute("ALTER TABLE category ADD COLUMN c_url TEXT NOT NULL DEFAULT ''")
+    conn.execute("CREATE TABLE version(v_version INTEGER PRIMARY KEY NOT NULL)")
+
+
+def _add_category_parent(conn: sqlite3.Connection) -> None:
+    # https://www.sqlite.org/lang_altertable.html
+    # The foreign keys are disabled, and the transaction started, by the runner.
+
+    # Create the new table in the desired format, with a name that doesn't collide with an existing table
+    conn.execute("""
+CREATE TABLE new_category (
+    c_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    c_name TEXT NOT NULL,
+    c_url TEXT NOT NULL DEFAULT '',
+    c_parent_id INTEGER DEFAULT NULL,
+    FOREIGN KEY (c_parent_id) REFERENCES new_category(c_id),
+    UNIQUE (c_name, c_parent_id)
+)""")
+
+    # Transfer the content, drop the old table and give the new one its name.
+    # There are no indexes, triggers or views of the table to recreate.
+    conn.execute("""
+INSERT INTO new_category(c_id, c_name, c_url)
+ SELECT category.c_id, category.c_name, category.c_url FROM category""")
+    conn.execute("DROP TABLE category")
+    conn.execute("ALTER TABLE new_category RENAME TO category")
+
+
+# The entries which are looked up by the day, with their start and end columns
+interval_tables = [("logged_entry", "le_start", "le_last_update"),
+                   ("tagged_entry", "te_start", "te_end"),
+                   ("activity_entry", "ae_start", "ae_last_update")]
+
+
+def _add_interval_bounds(conn: sqlite3.Connection) -> None:
+    # The longest entry of each table. An entry overlapping a period then starts at most
+    # this long before it, so the start index can be used for the lookup. It's kept up to
+    # date by the triggers and never lowered, which only makes the lookups a bit wider.
+    conn.execute("CREATE TABLE interval_bound ("
+                 " ib_table TEXT PRIMARY KEY NOT NULL,"
+                 " ib_max_duration INTEGER NOT NULL)")
+    for table, start_column, end_column in interval_tables:
+        conn.execute(f"INSERT INTO interval_bound(ib_table, ib_max_duration)"
+                     f" SELECT '{table}', COALESCE(MAX({end_column} - {start_column}), 0) FROM {table}")
+
+        for trigger_name, trigger_event in (("insert", "INSERT"),
+                                            ("update", f"UPDATE OF {start_column}, {end_column}")):
+            conn.execute(f"""
+CREATE TRIGGER {table}_interval_bound_{trigger_name} AFTER {trigger_event} ON {table}
+ WHEN NEW.{end_column} - NEW.{start_column} > (SELECT ib_max_duration FROM interval_bound WHERE ib_table='{table}')
+BEGIN
+ UPDATE interval_bound SET ib_max_duration=NEW.{end_column} - NEW.{start_column} WHERE ib_table='{table}';
+END""")
+
+
+def _add_archive(conn: sqlite3.Connection) -> None:
+    # The archived months, and the period their entries cover. See archive_helper.
+    conn.execute("CREATE TABLE archive ("
+                 " ar_month TEXT PRIMARY KEY NOT NULL,"
+                 " ar_min_start INTEGER NOT NULL,"
+                 " ar_max_end INTEGER NOT NULL)")
+
+
+def _add_logged_entry_compaction(conn: sqlite3.Connection) -> None:
+    # The compacted days of logged entries. See compaction_helper.
+    conn.execute("CREATE TABLE logged_entry_compaction ("
+                 " lec_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                 " lec_compacted_at INTEGER NOT NULL,"
+                 " lec_from INTEGER NOT NULL,"
+                 " lec_to INTEGER NOT NULL,"
+                 " lec_min_entry_seconds INTEGER NOT NULL,"
+                 " lec_entries_before INTEGER NOT NULL,"
+                 " lec_entries_after INTEGER NOT NULL,"
+                 " lec_titles_dropped INTEGER NOT NULL)")
+
+
+def _add_category_version(conn: sqlite3.Connection) -> None:
+    # Counts the changes of the categories, also those made by other processes,
+    # so that a cached category tree can tell whether it's still up to date
+    conn.execute("CREATE TABLE category_version (cv_version INTEGER NOT NULL)")
+    conn.execute("INSERT INTO category_version(cv_version) VALUES (0)")
+    for trigger_name, trigger_event in (("insert", "INSERT"), ("update", "UPDATE"), ("delete", "DELETE")):
+        conn.execute(f"""
+CREATE TRIGGER category_version_{trigger_name} AFTER {trigger_event} ON category
+BEGIN
+ UPDATE category_version SET cv_version=cv_version + 1;
+END""")
+
+
+migrations = [
+    Migration(version=1, description="Add the URL of categories", migrate=_add_category_url),
+    Migration(version=2, description="Add parents of categories", migrate=_add_category_parent),
+    Migration(version=3, description="Add bounds for looking up entries by date", migrate=_add_interval_bounds),
+    Migration(version=4, description="Add the archived months", migrate=_add_archive),
+    Migration(version=5, description="Add the compactions of logged entries", migrate=_add_logged_entry_compaction),
+    Migration(version=6, description="Add the version of the categories", migrate=_add_category_version),
+]
+
+
+def get_latest_version() -> int:
+    return migrations[-1].version
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    user_version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if user_version > 0:
+        return user_version
+
+    # Databases from before the user version was used only have the version table
+    version_table_exists = conn.execute("SELECT COUNT(*) FROM sqlite_master"
+                                        " WHERE type='table' AND name='version'").fetchone()[0] == 1
+    if not version_table_exists:
+        return 0
+
+    legacy_version = conn.execute("SELECT MAX(v_version) FROM version").fetchone()[0]
+    return legacy_version if legacy_version is not None else 0
+
+
+def update_if_needed(conn: sqlite3.Connection) -> None:
+    # The user version is read from the database header, so this is cheap when up to date
+    if get_latest_version() <= conn.execute("PRAGMA user_version").fetchone()[0]:
+        return
+
+    conn.commit()
+    old_isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    # Foreign keys can only be disabled outside of a transaction
+    conn.execute("PRAGMA foreign_keys=OFF")
+    try:
+        conn.execute("BEGIN EXCLUSIVE")
+        try:
+            # Another process may have updated the database while we waited for the lock
+            _run_pending_migrations(conn=conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.isolation_level = old_isolation_level
+
+
+def _run_pending_migrations(conn: sqlite3.Connection) -> None:
+    current_version = get_version(conn=conn)
+    for migration in migrations:
+        if migration.version <= current_version:
+            continue
+
+        logging.info(f"Updating database to version {migration.version}: {migration.description}")
+        migration.migrate(conn)
+        conn.execute("INSERT INTO version VALUES (?)", (migration.version,))
+
+    foreign_key_violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+    if len(foreign_key_violations) > 0:
+        raise sqlite3.IntegrityError(f"The database update violates foreign keys: {foreign_key_violations}")
+
+    conn.execute(f"PRAGMA user_version={get_latest_version()}")
+    if current_version < get_latest_version():
+        logging.info(f"Database updated to version {get_latest_version()}")
@@ -2,19 +2,19 @@ import sqlite3
 import datetime
 from typing import Optional, List
 
-from mtag.helper import datetime_helper
+from mtag.helper import archive_helper, datetime_helper
 from mtag.entity import ActivityEntry
 
 
 class ActivityEntryRepository:
     @staticmethod
-    def insert(conn: sqlite3.Connection, activity_entry: ActivityEntry) -> None:
-        conn.execute("INSERT INTO activity_entry(ae_start, ae_last_update, ae_active)"
-                     " VALUES (:start, :last_update, :active)",
-                     {"start": datetime_helper.datetime_to_timestamp(activity_entry.start),
-                      "last_update": datetime_helper.datetime_to_timestamp(activity_entry.stop),
-                      "active": 1 if activity_entry.active else 0})
-        conn.commit()
+    def insert(conn: sqlite3.Connection, activity_entry: ActivityEntry) -> int:
+        cursor = conn.execute("INSERT INTO activity_entry(ae_start, ae_last_update, ae_active)"
+                              " VALUES (:start, :last_update, :active)",
+                              {"start": datetime_helper.datetime_to_timestamp(activity_entry.start),
+                               "last_update": datetime_helper.datetime_to_timestamp(activity_entry.stop),
+                               "active": 1 if activity_entry.active else 0})
+        return cursor.lastrowid
 
     def get_latest_entry(self, conn: sqlite3.Connection) -> Optional[ActivityEntry]:
         cursor = conn.execute(
@@ -28,14 +28,10 @@ class ActivityEntryRepository:
     def get_all_by_date(self, conn: sqlite3.Connection, date: datetime.datetime) -> List[ActivityEntry]:
         from_datetime = datetime.datetime(year=date.year, month=date.month, day=date.day)
         to_datetime = from_datetime + datetime.timedelta(days=1)
-        cursor = conn.execute("SELECT * FROM activity_entry WHERE"
-                              " (:from_date <= ae_last_update AND ae_last_update < :to_date)"
-                              " OR"
-                              " (:from_date <= ae_start AND ae_start < :to_date)"
-                              " ORDER BY ae_start ASC",
-                              {"from_date": datetime_helper.datetime_to_timestamp(from_datetime),
-                               "to_date": datetime_helper.datetime_to_timestamp(to_datetime)})
-        db_activity_entries = cursor.fetchall()
+        # Also looks in the archives of the months which the day reaches back into
+        db_activity_entries = archive_helper.get_overlapping_rows(conn=conn, table="activity_entry",
+                                                                  start_column="ae_start", end_column="ae_last_update",
+                                                                  from_datetime=from_datetime, to_datetime=to_datetime)
 
         return [self._from_dbo(db_ae=db_ae) for db_ae in db_activity_entries]
 
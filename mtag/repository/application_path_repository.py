@@ -2,13 +2,13 @@ import sqlite3
 from typing import Optional
 
 from mtag.entity import ApplicationPath
+from mtag.helper import identity_map_helper
 
 
 class ApplicationPathRepository:
     @staticmethod
     def insert(conn: sqlite3.Connection, path: str) -> int:
         cursor = conn.execute("INSERT INTO application_path(ap_path) VALUES (:path)", {"path": path})
-        conn.commit()
         return cursor.lastrowid
 
     @staticmethod
@@ -22,9 +22,15 @@ class ApplicationPathRepository:
 
     @staticmethod
     def get(conn: sqlite3.Connection, db_id: int) -> Optional[ApplicationPath]:
+        application_path = identity_map_helper.get("application_path", db_id)
+        if application_path is not None:
+            return application_path
+
         cursor = conn.execute("SELECT * FROM application_path WHERE ap_id=:db_id", {"db_id": db_id})
         dbo = cursor.fetchone()
         if dbo is None:
             return None
 
-        return ApplicationPath(path=dbo["ap_path"], db_id=db_id)
+        application_path = ApplicationPath(path=dbo["ap_path"], db_id=db_id)
+        identity_map_helper.put("application_path", db_id, application_path)
+        return application_path
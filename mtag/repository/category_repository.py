@@ -2,6 +2,14 @@ import sqlite3
 from typing import Dict, List, Tuple, Optional
 
 from mtag.entity import Category
+from mtag.helper import archive_helper
+
+# The rows of the category tree, and the category version they were read at. See migration_helper.
+cached_tree_rows: Optional[List[sqlite3.Row]] = None
+cached_tree_version: Optional[int] = None
+# The categories read since the category version last changed. There are few, so they aren't evicted.
+cached_categories: Dict[int, Category] = {}
+cached_categories_version: Optional[int] = None
 
 
 class CategoryRepository:
@@ -60,12 +68,48 @@ class CategoryRepository:
         return [self._from_dbo(db_c) for db_c in db_categories]
 
     def get_all(self, conn: sqlite3.Connection) -> List[Tuple[Category, List[Category]]]:
-        return [(main, self.get_all_subs(conn=conn, db_id=main.db_id)) for main in self.get_all_mains(conn=conn)]
-
-    def get(self, conn: sqlite3.Connection, db_id: int) -> Category:
-        cursor = conn.execute("SELECT * FROM category WHERE c_id=:db_id", {"db_id": db_id})
-        db_c = cursor.fetchone()
-        return self._from_dbo(db_c)
+        global cached_tree_rows, cached_tree_version
+        version = self.get_version(conn=conn)
+        if cached_tree_rows is None or cached_tree_version != version:
+            # The main categories come first, so that the parents are known when reaching the sub categories
+            cursor = conn.execute("SELECT * FROM category ORDER BY c_parent_id IS NOT NULL, lower(c_name) ASC")
+            cached_tree_rows = cursor.fetchall()
+            cached_tree_version = version
+
+        # The categories are created anew each time, since the callers may change them
+        tree = {}
+        for db_c in cached_tree_rows:
+            category = self._from_dbo(db_c)
+            if category.parent_id is None:
+                tree[category.db_id] = (category, [])
+            elif category.parent_id in tree:
+                tree[category.parent_id][1].append(category)
+
+        return list(tree.values())
+
+    def get(self, conn: sqlite3.Connection, db_id: int, version: Optional[int] = None) -> Category:
+        # The cached categories are read again once the version has changed, so that changes made
+        # by other processes are seen as well. Pass the version when getting several.
+        global cached_categories_version
+        if version is None:
+            version = self.get_version(conn=conn)
+
+        if cached_categories_version != version:
+            cached_categories.clear()
+            cached_categories_version = version
+
+        category = cached_categories.get(db_id)
+        if category is None:
+            cursor = conn.execute("SELECT * FROM category WHERE c_id=:db_id", {"db_id": db_id})
+            db_c = cursor.fetchone()
+            category = self._from_dbo(db_c)
+            cached_categories[db_id] = category
+        return category
+
+    @staticmethod
+    def get_version(conn: sqlite3.Connection) -> int:
+        # Changed by the triggers on every change of the categories. See migration_helper.
+        return conn.execute("SELECT cv_version FROM category_version").fetchone()[0]
 
     def update(self, conn: sqlite3.Connection, category: Category) -> None:
         cursor = conn.execute("UPDATE category SET c_url=:url, c_name=:name, c_parent_id=:parent_id WHERE c_id=:db_id",
@@ -74,6 +118,11 @@ class CategoryRepository:
         cursor.close()
 
     def delete(self, conn: sqlite3.Connection, category: Category) -> None:
+        # Like the foreign key of the tagged entries in the main database, for those in the archives
+        if archive_helper.exists_in_archives(conn=conn, table="tagged_entry", column="te_category_id",
+                                             value=category.db_id):
+            raise sqlite3.IntegrityError(f"The category {category.db_id} is used by archived tagged entries")
+
         cursor = conn.execute("DELETE FROM category WHERE c_id=:db_id",
                               {"db_id": category.db_id})
         conn.commit()
@@ -2,24 +2,23 @@ import sqlite3
 import datetime
 from typing import Dict, List, Optional
 
-from mtag.helper import datetime_helper
-from mtag.entity import LoggedEntry, ApplicationWindow
+from mtag.helper import archive_helper, datetime_helper, identity_map_helper
+from mtag.entity import LoggedEntry, ApplicationWindow, Application, ApplicationPath
 from mtag.repository import ApplicationWindowRepository
 
 
 class LoggedEntryRepository:
     def __init__(self):
         self.application_window_repository = ApplicationWindowRepository()
-        self.aw_cache = {}
 
     @staticmethod
-    def insert(conn: sqlite3.Connection, logged_entry: LoggedEntry) -> None:
-        conn.execute("INSERT INTO logged_entry(le_application_window_id, le_start, le_last_update)"
-                     " VALUES (:application_window_id, :start, :last_update)",
-                     {"application_window_id": logged_entry.application_window.db_id,
-                      "start": datetime_helper.datetime_to_timestamp(logged_entry.start),
-                      "last_update": datetime_helper.datetime_to_timestamp(logged_entry.stop)})
-        conn.commit()
+    def insert(conn: sqlite3.Connection, logged_entry: LoggedEntry) -> int:
+        cursor = conn.execute("INSERT INTO logged_entry(le_application_window_id, le_start, le_last_update)"
+                              " VALUES (:application_window_id, :start, :last_update)",
+                              {"application_window_id": logged_entry.application_window.db_id,
+                               "start": datetime_helper.datetime_to_timestamp(logged_entry.start),
+                               "last_update": datetime_helper.datetime_to_timestamp(logged_entry.stop)})
+        return cursor.lastrowid
 
     def get_latest_entry(self, conn: sqlite3.Connection) -> Optional[LoggedEntry]:
         cursor = conn.execute(
@@ -33,28 +32,44 @@ class LoggedEntryRepository:
     def get_all_by_date(self, conn: sqlite3.Connection, date: datetime.datetime) -> List[LoggedEntry]:
         from_datetime = datetime.datetime(year=date.year, month=date.month, day=date.day)
         to_datetime = from_datetime + datetime.timedelta(days=1)
-        cursor = conn.execute("SELECT * FROM logged_entry WHERE"
-                              " (:from_date <= le_last_update AND le_last_update < :to_date)"
-                              " OR"
-                              " (:from_date <= le_start AND le_start < :to_date)"
-                              " ORDER BY le_start ASC",
-                              {"from_date": datetime_helper.datetime_to_timestamp(from_datetime),
-                               "to_date": datetime_helper.datetime_to_timestamp(to_datetime)})
-        db_logged_entries = cursor.fetchall()
+        # The windows, applications and paths are read in the same query as the entries.
+        # Also looks in the archives of the months which the day reaches back into.
+        db_logged_entries = archive_helper.get_overlapping_rows(
+                conn=conn, table="logged_entry", start_column="le_start", end_column="le_last_update",
+                from_datetime=from_datetime, to_datetime=to_datetime,
+                joins="INNER JOIN {schema}.application_window ON le_application_window_id=aw_id"
+                      " INNER JOIN {schema}.application ON aw_application_id=a_id"
+                      " INNER JOIN {schema}.application_path ON a_path_id=ap_id")
 
-        return [self._from_dbo(conn=conn, db_le=db_le) for db_le in db_logged_entries]
+        # The entries of the same window share its objects, which are kept in the identity map
+        logged_entries = []
+        for db_le in db_logged_entries:
+            application_window = identity_map_helper.get("application_window", db_le["aw_id"])
+            if application_window is None:
+                application = identity_map_helper.get("application", db_le["a_id"])
+                if application is None:
+                    application_path = identity_map_helper.get("application_path", db_le["ap_id"])
+                    if application_path is None:
+                        application_path = ApplicationPath(path=db_le["ap_path"], db_id=db_le["ap_id"])
+                        identity_map_helper.put("application_path", db_le["ap_id"], application_path)
+
+                    application = Application(name=db_le["a_name"], application_path=application_path,
+                                              db_id=db_le["a_id"])
+                    identity_map_helper.put("application", db_le["a_id"], application)
+
+                application_window = ApplicationWindow(title=db_le["aw_title"], application=application,
+                                                       db_id=db_le["aw_id"])
+                identity_map_helper.put("application_window", db_le["aw_id"], application_window)
+
+            logged_entries.append(LoggedEntry(start=datetime_helper.timestamp_to_datetime(db_le["le_start"]),
+                                              stop=datetime_helper.timestamp_to_datetime(db_le["le_last_update"]),
+                                              application_window=application_window, db_id=db_le["le_id"]))
+
+        return logged_entries
 
     def _from_dbo(self, conn: sqlite3.Connection, db_le: Dict) -> LoggedEntry:
-        application_window = self._get_application_window(conn, db_le["le_application_window_id"])
+        application_window = self.application_window_repository.get(conn, db_le["le_application_window_id"])
 
         return LoggedEntry(start=datetime_helper.timestamp_to_datetime(db_le["le_start"]),
                            stop=datetime_helper.timestamp_to_datetime(db_le["le_last_update"]),
                            application_window=application_window, db_id=db_le["le_id"])
-
-    def _get_application_window(self, conn: sqlite3.Connection, aw_id: int) -> ApplicationWindow:
-        if aw_id in self.aw_cache:
-            return self.aw_cache[aw_id]
-
-        application_window = self.application_window_repository.get(conn, aw_id)
-        self.aw_cache[aw_id] = application_window
-        return application_window
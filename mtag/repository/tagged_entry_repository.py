@@ -1,18 +1,19 @@
 import sqlite3
 import datetime
-from typing import Dict, List
+from typing import Iterator, List, Optional
 
-from mtag.helper import datetime_helper
-from mtag.entity import TaggedEntry, Category
+from mtag.helper import archive_helper, datetime_helper
+from mtag.entity import TaggedEntry
 from mtag.repository import CategoryRepository
 
 
 class TaggedEntryRepository:
     def __init__(self):
         self.category_repository = CategoryRepository()
-        self.category_cache = {}
 
     def insert(self, conn: sqlite3.Connection, tagged_entry: TaggedEntry) -> None:
+        # The archived neighbours can neither be merged with nor checked for overlaps
+        self.raise_if_archived(conn=conn, tagged_entry=tagged_entry)
         cursor = conn.execute("SELECT te_id, te_start"
                               " FROM tagged_entry"
                               " WHERE te_end=:new_te_start"
@@ -57,6 +58,7 @@ class TaggedEntryRepository:
         conn.commit()
 
     def update(self, conn: sqlite3.Connection, tagged_entry: TaggedEntry) -> None:
+        self.raise_if_archived(conn=conn, tagged_entry=tagged_entry, db_id=tagged_entry.db_id)
         conn.execute("UPDATE tagged_entry SET te_category_id=:te_category_id, te_start=:te_start, te_end=:te_end"
                      " WHERE te_id=:te_id",
                      {"te_start": datetime_helper.datetime_to_timestamp(tagged_entry.start),
@@ -68,56 +70,86 @@ class TaggedEntryRepository:
         conn.commit()
 
     def delete(self, conn: sqlite3.Connection, db_id: int) -> None:
+        self.raise_if_archived(conn=conn, db_id=db_id)
         conn.execute("DELETE FROM tagged_entry WHERE te_id=:db_id", {"db_id": db_id})
         conn.commit()
 
+    @staticmethod
+    def raise_if_archived(conn: sqlite3.Connection, tagged_entry: Optional[TaggedEntry] = None,
+                          db_id: Optional[int] = None) -> None:
+        # Also used to refuse a change before e.g. creating its category
+        if tagged_entry is not None and archive_helper.is_archived_period(conn=conn, from_datetime=tagged_entry.start,
+                                                                          to_datetime=tagged_entry.stop):
+            raise archive_helper.ArchivedMonthError("The tagged entry is within an archived month")
+
+        if db_id is not None and archive_helper.is_archived_entry(conn=conn, table="tagged_entry",
+                                                                  id_column="te_id", db_id=db_id):
+            raise archive_helper.ArchivedMonthError(f"The tagged entry {db_id} is in an archived month")
+
     def get_all_by_date(self, conn: sqlite3.Connection, date: datetime.datetime) -> List[TaggedEntry]:
         from_datetime = datetime.datetime(year=date.year, month=date.month, day=date.day)
         to_datetime = from_datetime + datetime.timedelta(days=1)
-        cursor = conn.execute("SELECT * FROM tagged_entry WHERE"
-                              " (:from_date <= te_start AND te_start < :to_date)"
-                              " OR"
-                              " (:from_date <= te_end AND te_end < :to_date)"
-                              " ORDER BY te_start ASC",
-                              {"from_date": datetime_helper.datetime_to_timestamp(from_datetime),
-                               "to_date": datetime_helper.datetime_to_timestamp(to_datetime)})
-        db_tagged_entries = cursor.fetchall()
+        # Also looks in the archives of the months which the day reaches back into
+        db_tagged_entries = archive_helper.get_overlapping_rows(conn=conn, table="tagged_entry",
+                                                                start_column="te_start", end_column="te_end",
+                                                                from_datetime=from_datetime, to_datetime=to_datetime)
 
-        return [self._from_dbo(conn=conn, db_te=db_te) for db_te in db_tagged_entries]
+        category_version = self.category_repository.get_version(conn=conn)
+        return [self._from_dbo(conn=conn, db_te=db_te, category_version=category_version)
+                for db_te in db_tagged_entries]
 
     def total_time_by_category_by_name(self, conn: sqlite3.Connection, main_name: str, sub_name: str) -> int:
+        return sum(self._total_time_by_category_by_name(conn=conn, schema=schema, main_name=main_name,
+                                                        sub_name=sub_name)
+                   for schema in self._get_schemas(conn=conn))
+
+    def total_time_by_category_by_id(self, conn: sqlite3.Connection, category_id: id) -> int:
+        return sum(self._total_time_by_category_by_id(conn=conn, schema=schema, category_id=category_id)
+                   for schema in self._get_schemas(conn=conn))
+
+    @staticmethod
+    def _get_schemas(conn: sqlite3.Connection) -> Iterator[str]:
+        # The tagged entries of the archived months are looked up as well, one archive at a time
+        yield "main"
+        yield from archive_helper.get_archive_schemas(conn=conn)
+
+    @staticmethod
+    def _total_time_by_category_by_name(conn: sqlite3.Connection, schema: str, main_name: str, sub_name: str) -> int:
+        # The categories are always those of the main database
         query = "SELECT SUM(te_end - te_start) AS total_time"
-        query += " FROM tagged_entry"
+        query += f" FROM {schema}.tagged_entry AS tagged_entry"
         params = {"main_name": main_name}
 
         if sub_name is not None:
-            query += " INNER JOIN category sub ON tagged_entry.te_category_id = sub.c_id"
-            query += " INNER JOIN category main ON sub.c_parent_id = main.c_id"
+            query += " INNER JOIN main.category sub ON tagged_entry.te_category_id = sub.c_id"
+            query += " INNER JOIN main.category main_category ON sub.c_parent_id = main_category.c_id"
             query += " WHERE sub.c_name=:sub_name"
-            query += " AND main.c_name=:main_name"
+            query += " AND main_category.c_name=:main_name"
             params["sub_name"] = sub_name
         else:
-            query += " INNER JOIN category main ON tagged_entry.te_category_id = main.c_id"
-            query += " WHERE main.c_name=:main_name"
+            query += " INNER JOIN main.category main_category ON tagged_entry.te_category_id = main_category.c_id"
+            query += " WHERE main_category.c_name=:main_name"
 
         cursor = conn.execute(query, params)
         row = cursor.fetchone()
         total_seconds = row["total_time"]
         return 0 if total_seconds is None else total_seconds
 
-    def total_time_by_category_by_id(self, conn: sqlite3.Connection, category_id: id) -> int:
+    @staticmethod
+    def _total_time_by_category_by_id(conn: sqlite3.Connection, schema: str, category_id: id) -> int:
         cursor = conn.execute("SELECT SUM(te_end - te_start) AS total_time"
-                              " FROM tagged_entry"
-                              " WHERE tagged_entry.te_category_id=:id",
+                              f" FROM {schema}.tagged_entry"
+                              " WHERE te_category_id=:id",
                               {"id": category_id})
         row = cursor.fetchone()
         total_seconds = row["total_time"]
         return 0 if total_seconds is None else total_seconds
 
-    def _from_dbo(self, conn: sqlite3.Connection, db_te: dict) -> TaggedEntry:
-        category = self._get_category(conn=conn, c_id=db_te["te_category_id"])
+    def _from_dbo(self, conn: sqlite3.Connection, db_te: dict, category_version: int) -> TaggedEntry:
+        category = self.category_repository.get(conn=conn, db_id=db_te["te_category_id"], version=category_version)
         if category.parent_id is not None:
-            main_category = self._get_category(conn=conn, c_id=category.parent_id)
+            main_category = self.category_repository.get(conn=conn, db_id=category.parent_id,
+                                                         version=category_version)
             category_str = f"{main_category.name} >> {category.name}"
         else:
             category_str = category.name
@@ -126,11 +158,3 @@ class TaggedEntryRepository:
                            category=category,
                            category_str=category_str,
                            db_id=db_te["te_id"])
-
-    def _get_category(self, conn: sqlite3.Connection, c_id: int) -> Category:
-        if c_id in self.category_cache:
-            return self.category_cache[c_id]
-
-        category = self.category_repository.get(conn=conn, db_id=c_id)
-        self.category_cache[c_id] = category
-        return category
@@ -0,0 +1,113 @@
+import logging
+import os
+import subprocess
+import time
+from typing import Optional
+
+LOGIND_BUS_NAME = "org.freedesktop.login1"
+LOGIND_PATH = "/org/freedesktop/login1"
+LOGIND_MANAGER_INTERFACE = "org.freedesktop.login1.Manager"
+LOGIND_SESSION_INTERFACE = "org.freedesktop.login1.Session"
+DBUS_TIMEOUT_MILLISECONDS = 1000
+# Once D-Bus has failed, loginctl is used until it's retried. The wait doubles with every failure in a row.
+DBUS_MIN_RETRY_SECONDS = 60
+DBUS_MAX_RETRY_SECONDS = 3600
+
+
+class LockStateProvider:
+    # The session bus is only used when testing against a mocked logind service
+    def __init__(self, use_session_bus: bool = False):
+        self.use_session_bus = use_session_bus
+        self.session_id: Optional[str] = None
+        self.session_proxy = None
+        self.main_context = None
+        # Without PyGObject, D-Bus is never used
+        self.dbus_unavailable = False
+        self.dbus_retry_time = 0.0
+        self.dbus_retry_seconds = DBUS_MIN_RETRY_SECONDS
+
+    def get_locked_state(self) -> bool:
+        if self.session_id is None:
+            self.session_id = get_session_id()
+
+        if self.session_proxy is None and not self.dbus_unavailable and self.dbus_retry_time <= time.monotonic():
+            self._connect()
+
+        if self.session_proxy is not None:
+            try:
+                locked_state = self._get_locked_state_from_dbus()
+                self.dbus_retry_seconds = DBUS_MIN_RETRY_SECONDS
+                return locked_state
+            except Exception as ex:
+                self._back_off(reason=f"Unable to get the lock state over D-Bus: {ex}")
+
+        return get_locked_state_from_loginctl(self.session_id)
+
+    def _back_off(self, reason: str) -> None:
+        logging.warning(f"{reason}. Using loginctl for the next {self.dbus_retry_seconds} seconds.")
+        self.session_proxy = None
+        self.dbus_retry_time = time.monotonic() + self.dbus_retry_seconds
+        self.dbus_retry_seconds = min(self.dbus_retry_seconds * 2, DBUS_MAX_RETRY_SECONDS)
+
+    def _connect(self) -> None:
+        try:
+            import gi
+            gi.require_version("Gio", "2.0")
+            from gi.repository import Gio, GLib
+        except (ImportError, ValueError) as ex:
+            logging.info(f"PyGObject is not available, falling back to loginctl: {ex}")
+            self.dbus_unavailable = True
+            return
+
+        try:
+            bus_type = Gio.BusType.SESSION if self.use_session_bus else Gio.BusType.SYSTEM
+            bus = Gio.bus_get_sync(bus_type, None)
+            session_path = bus.call_sync(LOGIND_BUS_NAME, LOGIND_PATH, LOGIND_MANAGER_INTERFACE, "GetSession",
+                                         GLib.Variant("(s)", (self.session_id,)), GLib.VariantType("(o)"),
+                                         Gio.DBusCallFlags.NONE, DBUS_TIMEOUT_MILLISECONDS, None).unpack()[0]
+
+            # The proxy keeps its cached properties up to date through the
+            # PropertiesChanged signal, which is dispatched by the main context.
+            self.main_context = GLib.MainContext.default()
+            self.session_proxy = Gio.DBusProxy.new_sync(bus, Gio.DBusProxyFlags.NONE, None, LOGIND_BUS_NAME,
+                                                        session_path, LOGIND_SESSION_INTERFACE, None)
+            logging.info(f"Subscribed to the lock state of session {session_path}")
+        except Exception as ex:
+            self._back_off(reason=f"Unable to connect to logind over D-Bus: {ex}")
+
+    def _get_locked_state_from_dbus(self) -> bool:
+        # Dispatch any received PropertiesChanged signals without blocking
+        while self.main_context.iteration(False):
+            pass
+
+        locked_hint = self.session_proxy.get_cached_property("LockedHint")
+        if locked_hint is None:
+            raise ValueError("LockedHint is not available")
+
+        return locked_hint.unpack()
+
+
+def get_session_id() -> str:
+    session_id = os.environ.get("XDG_SESSION_ID")
+    if session_id is not None:
+        return session_id
+
+    whoiam = subprocess.run(["whoami"], stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+    session_id = subprocess.run(["loginctl", "show-user", "-pSessions", "--value", whoiam],
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+    logging.debug(f"{whoiam} => {session_id}")
+    return session_id
+
+
+def get_locked_state_from_loginctl(session_id: str) -> bool:
+    locked_hint = subprocess.run(["loginctl", "show-session", "-pLockedHint", "--value", session_id],
+                                 stdout=subprocess.PIPE).stdout.strip()
+    if locked_hint.lower() == b"no":
+        logging.debug("Not locked")
+        return False
+    elif locked_hint.lower() == b"yes":
+        logging.debug("Locked")
+        return True
+    else:
+        logging.debug(f"Unknown lock hint: {locked_hint}")
+        return False
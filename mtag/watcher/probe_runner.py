@@ -0,0 +1,56 @@
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Any, Callable, Dict
+
+
+class ProbeRunner:
+    def __init__(self, max_workers: int = 4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mtag-probe")
+        self.running: Dict[str, Future] = {}
+        self.last_values: Dict[str, Any] = {}
+
+    # Run the probes concurrently and wait at most timeout_seconds for them. A probe which is
+    # too slow, or fails, gets the last value it returned, or its default value if there is none.
+    def run(self, probes: Dict[str, Callable[[], Any]], defaults: Dict[str, Any],
+            timeout_seconds: float) -> Dict[str, Any]:
+        for name, probe in probes.items():
+            running_probe = self.running.get(name)
+            if running_probe is not None:
+                if not running_probe.done():
+                    logging.warning(f"The probe '{name}' is still running since an earlier tick")
+                    continue
+                self._remember_result(name=name, future=running_probe)
+
+            self.running[name] = self.executor.submit(probe)
+
+        deadline = time.monotonic() + timeout_seconds
+        results = {}
+        for name in probes:
+            future = self.running[name]
+            try:
+                future.result(timeout=max(deadline - time.monotonic(), 0))
+            except TimeoutError:
+                logging.warning(f"The probe '{name}' timed out. Using its last known value.")
+            except Exception:
+                # Logged when the result is remembered below
+                pass
+
+            if future.done():
+                self._remember_result(name=name, future=future)
+                del self.running[name]
+
+            results[name] = self.last_values.get(name, defaults[name])
+
+        return results
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+
+    def _remember_result(self, name: str, future: Future) -> None:
+        exception = future.exception()
+        if exception is not None:
+            logging.error(f"The probe '{name}' failed. Using its last known value: {exception}")
+            return
+
+        self.last_values[name] = future.result()
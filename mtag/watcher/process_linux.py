@@ -0,0 +1,59 @@
+import logging
+import os
+from collections import namedtuple
+from typing import Dict, Optional
+
+# The start time tells a reused PID apart from the process we cached
+CachedProcess = namedtuple("CachedProcess", ["start_time", "command_line"])
+
+
+class ProcessCache:
+    def __init__(self):
+        self.processes: Dict[int, CachedProcess] = {}
+
+    def get_command_line(self, pid: int) -> Optional[str]:
+        start_time = get_start_time(pid)
+        if start_time is None:
+            self.processes.pop(pid, None)
+            return None
+
+        cached_process = self.processes.get(pid)
+        if cached_process is not None and cached_process.start_time == start_time:
+            return cached_process.command_line
+
+        # A new process. Take the opportunity to forget the ones which have exited.
+        self._evict_exited_processes()
+
+        command_line = read_command_line(pid)
+        if command_line is not None:
+            self.processes[pid] = CachedProcess(start_time=start_time, command_line=command_line)
+        return command_line
+
+    def _evict_exited_processes(self) -> None:
+        for pid in [pid for pid in self.processes if not os.path.exists(f"/proc/{pid}")]:
+            logging.debug(f"Process {pid} has exited, evicting it from the cache")
+            del self.processes[pid]
+
+
+def get_start_time(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+
+    # The command name in the second field may contain spaces and parentheses.
+    # The start time is the 22nd field, i.e. the 20th after the command name.
+    fields = stat[stat.rfind(b")") + 2:].split()
+    return int(fields[19]) if len(fields) > 19 else None
+
+
+def read_command_line(pid: int) -> Optional[str]:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as cmdline_file:
+            command_line = cmdline_file.read()
+    except OSError as ex:
+        logging.debug(f"Unable to read the command line of {pid}: {ex}")
+        return None
+
+    return command_line.decode("utf-8", errors="replace").replace("\0", " ").strip()
@@ -1,18 +1,35 @@
 import datetime
 import logging
+import sqlite3
+from collections import namedtuple
 from typing import Optional
 
 from mtag.entity import LoggedEntry, Application, ApplicationWindow, ApplicationPath, ActivityEntry
-from mtag.helper import database_helper, datetime_helper, configuration_helper
+from mtag.helper import configuration_helper, identity_map_helper
+from mtag.helper.cache_helper import LruCache
 from mtag.repository import ApplicationRepository, ApplicationPathRepository
 from mtag.repository import LoggedEntryRepository, ApplicationWindowRepository
 from mtag.repository import ActivityEntryRepository
+from mtag.watcher.watcher_session import WatcherSession, OpenEntry
+from mtag.watcher.watcher_statistics import statistics
 
 
-def register(window_title: Optional[str], application_name: Optional[str],
+# The focused window as seen by a watcher backend
+WindowInformation = namedtuple("WindowInformation", ["title", "application_name", "application_path"])
+
+# Process-wide interning of the rows looked up on every tick.
+# The focused window rarely changes between ticks, so these are nearly always hits.
+application_path_cache = LruCache(max_size=configuration_helper.Configuration.default_configuration["watcher_cache_size"])
+application_cache = LruCache(max_size=application_path_cache.max_size)
+application_window_cache = LruCache(max_size=application_path_cache.max_size)
+
+
+def register(session: WatcherSession, window_title: Optional[str], application_name: Optional[str],
              application_path: Optional[str], idle_period: Optional[int],
-             locked_state: bool = False) -> None:
-    configuration = configuration_helper.get_configuration()
+             locked_state: bool = False, window_changed: bool = False) -> None:
+    # window_changed tells that the backend was woken by a change of the window, which happened just now
+    with statistics.phase("configuration"):
+        configuration = configuration_helper.get_configuration()
 
     window_title_to_use = window_title if window_title is not None else "N/A"
     application_name_to_use = application_name if application_name is not None else "N/A"
@@ -24,152 +41,233 @@ def register(window_title: Optional[str], application_name: Optional[str],
     logging.info(application_path_to_use)
     logging.info(f"{application_name_to_use} -> {window_title_to_use}")
 
-    # Application path
-    application_path = insert_if_needed_and_get_application_path(application_path=application_path_to_use)
+    resize_caches(configuration.watcher_cache_size)
+
+    try:
+        with statistics.phase("database"), \
+                session.tick(flush_interval_seconds=configuration.watcher_flush_interval_seconds) as db_connection:
+            # Application path
+            application_path = insert_if_needed_and_get_application_path(db_connection=db_connection,
+                                                                         application_path=application_path_to_use)
+
+            # Application
+            application = insert_if_needed_and_get_application(db_connection=db_connection,
+                                                               application_name=application_name_to_use,
+                                                               application_path=application_path)
+
+            # Application window
+            application_window = insert_if_needed_and_get_application_window(db_connection=db_connection,
+                                                                             application=application,
+                                                                             window_title=window_title_to_use)
+
+            datetime_now = session.now()
+
+            # Logged entry
+            register_logged_entry(session=session, db_connection=db_connection, configuration=configuration,
+                                  application_window=application_window, datetime_now=datetime_now,
+                                  window_changed=window_changed)
+
+            # Activity entry
+            register_activity_entry(session=session, db_connection=db_connection, configuration=configuration,
+                                    idle_period=idle_period_to_use, locked_state=locked_state,
+                                    datetime_now=datetime_now)
+    except Exception:
+        # Rows inserted during the failed tick were rolled back. Do not keep them around.
+        clear_caches()
+        raise
+
+    logging.debug(f"Cache statistics: path={application_path_cache.stats()}"
+                  f" application={application_cache.stats()}"
+                  f" window={application_window_cache.stats()}")
+
+
+def register_activity_entry(session: WatcherSession, db_connection: sqlite3.Connection,
+                            configuration: configuration_helper.Configuration, idle_period: int,
+                            locked_state: bool, datetime_now: datetime.datetime):
+    activity_entry_repository = ActivityEntryRepository()
+    was_active = not locked_state and idle_period < configuration.inactive_after_idle_seconds
+    max_delta_period = datetime.timedelta(seconds=configuration.seconds_before_new_entry)
+
+    # Only read the latest entry from the database at startup or after a gap,
+    # since some other process might have written to the database in between.
+    # Pending extensions are written first so that the database is up to date.
+    last_activity_entry = session.open_activity_entry
+    if last_activity_entry is None or max_delta_period < datetime_now - last_activity_entry.stop:
+        session.write_pending_updates()
+        last_activity_entry = _get_latest_open_activity_entry(conn=db_connection,
+                                                              activity_entry_repository=activity_entry_repository)
+
+    if last_activity_entry is None:
+        logging.info("No existing activity entry, creating a new one")
+        new_update = datetime_now + datetime.timedelta(seconds=1)
+        activity_entry = ActivityEntry(start=datetime_now, stop=new_update, active=was_active)
+        db_id = activity_entry_repository.insert(conn=db_connection, activity_entry=activity_entry)
+        session.open_activity_entry = OpenEntry(db_id=db_id, key=was_active, stop=new_update)
+    elif max_delta_period < datetime_now - last_activity_entry.stop:
+        logging.info("Too long since last update. Create a new entry.")
+
+        new_update = datetime_now + datetime.timedelta(seconds=1)
+        activity_entry = ActivityEntry(start=datetime_now, stop=new_update, active=was_active)
+        db_id = activity_entry_repository.insert(db_connection, activity_entry)
+        session.open_activity_entry = OpenEntry(db_id=db_id, key=was_active, stop=new_update)
+    elif last_activity_entry.key == was_active:
+        logging.info("Still same activity level. Update existing entry")
+
+        session.extend_entry(table="activity_entry", db_id=last_activity_entry.db_id, stop=datetime_now)
+        session.open_activity_entry = last_activity_entry._replace(stop=datetime_now)
+    else:
+        logging.info("Not the same activity level. Insert new activity entry")
+
+        activity_entry = ActivityEntry(start=last_activity_entry.stop, stop=datetime_now, active=was_active)
+        db_id = activity_entry_repository.insert(db_connection, activity_entry)
+        session.open_activity_entry = OpenEntry(db_id=db_id, key=was_active, stop=datetime_now)
+
+
+def register_logged_entry(session: WatcherSession, db_connection: sqlite3.Connection,
+                          configuration: configuration_helper.Configuration,
+                          application_window: ApplicationWindow, datetime_now: datetime.datetime,
+                          window_changed: bool = False):
+    logged_entry_repository = LoggedEntryRepository()
+    max_delta_period = datetime.timedelta(seconds=configuration.seconds_before_new_entry)
+
+    # Only read the latest entry from the database at startup or after a gap,
+    # since some other process might have written to the database in between.
+    # Pending extensions are written first so that the database is up to date.
+    last_logged_entry = session.open_logged_entry
+    if last_logged_entry is None or max_delta_period < datetime_now - last_logged_entry.stop:
+        session.write_pending_updates()
+        last_logged_entry = _get_latest_open_logged_entry(conn=db_connection,
+                                                          logged_entry_repository=logged_entry_repository)
+
+    if last_logged_entry is None:
+        logging.info("No existing logged entry, creating a new one")
+        new_update = datetime_now + datetime.timedelta(seconds=1)
+        logged_entry = LoggedEntry(start=datetime_now,
+                                   stop=new_update,
+                                   application_window=application_window)
+        db_id = logged_entry_repository.insert(conn=db_connection, logged_entry=logged_entry)
+        session.open_logged_entry = OpenEntry(db_id=db_id, key=application_window.db_id, stop=new_update)
+    elif max_delta_period < datetime_now - last_logged_entry.stop:
+        logging.info("Too long since last update. Create a new entry.")
+
+        new_update = datetime_now + datetime.timedelta(seconds=1)
+        logged_entry = LoggedEntry(start=datetime_now, stop=new_update, application_window=application_window)
+        db_id = logged_entry_repository.insert(db_connection, logged_entry)
+        session.open_logged_entry = OpenEntry(db_id=db_id, key=application_window.db_id, stop=new_update)
+    elif last_logged_entry.key == application_window.db_id:
+        logging.info("Still same window. Update existing logged entry")
+
+        session.extend_entry(table="logged_entry", db_id=last_logged_entry.db_id, stop=datetime_now)
+        session.open_logged_entry = last_logged_entry._replace(stop=datetime_now)
+    else:
+        logging.info("Not the same window. Insert new logged entry")
+
+        # The window changed at some point since the previous tick, unless the backend was woken by the change.
+        # Then the previous window was focused until now, and the new entry starts now.
+        new_start = last_logged_entry.stop
+        new_update = datetime_now
+        if window_changed and last_logged_entry.stop < datetime_now:
+            session.extend_entry(table="logged_entry", db_id=last_logged_entry.db_id, stop=datetime_now)
+            new_start = datetime_now
+            new_update = datetime_now + datetime.timedelta(seconds=1)
 
-    # Application
-    application = insert_if_needed_and_get_application(application_name=application_name_to_use,
-                                                       application_path=application_path)
+        logged_entry = LoggedEntry(start=new_start, stop=new_update, application_window=application_window)
+        db_id = logged_entry_repository.insert(db_connection, logged_entry)
+        session.open_logged_entry = OpenEntry(db_id=db_id, key=application_window.db_id, stop=new_update)
 
-    # Application window
-    application_window = insert_if_needed_and_get_application_window(application=application,
-                                                                     window_title=window_title_to_use)
 
-    datetime_now = datetime.datetime.now()
+def _get_latest_open_activity_entry(conn: sqlite3.Connection,
+                                    activity_entry_repository: ActivityEntryRepository) -> Optional[OpenEntry]:
+    logging.debug("Reading the latest activity entry from the database")
+    activity_entry = activity_entry_repository.get_latest_entry(conn=conn)
+    if activity_entry is None:
+        return None
 
-    # Logged entry
-    register_logged_entry(application_window=application_window, datetime_now=datetime_now)
+    return OpenEntry(db_id=activity_entry.db_id, key=activity_entry.active, stop=activity_entry.stop)
 
-    # Activity entry
-    register_activity_entry(idle_period=idle_period_to_use, locked_state=locked_state, datetime_now=datetime_now)
 
+def _get_latest_open_logged_entry(conn: sqlite3.Connection,
+                                  logged_entry_repository: LoggedEntryRepository) -> Optional[OpenEntry]:
+    logging.debug("Reading the latest logged entry from the database")
+    logged_entry = logged_entry_repository.get_latest_entry(conn=conn)
+    if logged_entry is None:
+        return None
 
-def register_activity_entry(idle_period: int, locked_state: bool, datetime_now: datetime.datetime):
-    configuration = configuration_helper.get_configuration()
-    activity_entry_repository = ActivityEntryRepository()
-    was_active = not locked_state and idle_period < configuration.inactive_after_idle_seconds
+    return OpenEntry(db_id=logged_entry.db_id, key=logged_entry.application_window.db_id, stop=logged_entry.stop)
 
-    with database_helper.create_connection() as db_connection:
-        last_activity_entry = activity_entry_repository.get_latest_entry(conn=db_connection)
-        if last_activity_entry is None:
-            logging.info("No existing activity entry, creating a new one")
-            new_update = datetime_now + datetime.timedelta(seconds=1)
-            activity_entry = ActivityEntry(start=datetime_now, stop=new_update, active=was_active)
-            activity_entry_repository.insert(conn=db_connection, activity_entry=activity_entry)
-        else:
-            max_delta_seconds = configuration.seconds_before_new_entry
-            max_delta_period = datetime.timedelta(seconds=max_delta_seconds)
 
-            old_end = last_activity_entry.stop
-            if max_delta_period < datetime_now - old_end:
-                logging.info("Too long since last update. Create a new entry.")
+def insert_if_needed_and_get_application_window(db_connection: sqlite3.Connection, application: Application, window_title: str) -> ApplicationWindow:
+    cache_key = (application.db_id, window_title)
+    application_window = application_window_cache.get(cache_key)
+    if application_window is not None:
+        return application_window
 
-                new_update = datetime_now + datetime.timedelta(seconds=1)
-                activity_entry = ActivityEntry(start=datetime_now, stop=new_update, active=was_active)
-                activity_entry_repository.insert(db_connection, activity_entry)
-            elif last_activity_entry.active == was_active:
-                logging.info("Still same activity level. Update existing entry")
+    application_window_repository = ApplicationWindowRepository()
+    application_window = application_window_repository.get_by_title_and_application_id(conn=db_connection,
+                                                                                       title=window_title,
+                                                                                       application_id=application.db_id)
 
-                db_connection.execute("UPDATE activity_entry SET ae_last_update=:new_update WHERE ae_id=:id",
-                                      {"id": last_activity_entry.db_id,
-                                       "new_update": datetime_helper.datetime_to_timestamp(datetime_now)})
-            else:
-                logging.info("Not the same activity level. Insert new activity entry")
+    # We couldn't find an existing entry in the database. Insert a new one.
+    if application_window is None:
+        logging.info("Adding new application window")
+        application_window = ApplicationWindow(title=window_title, application=application)
+        db_id = application_window_repository.insert(conn=db_connection, application_window=application_window)
+        application_window.db_id = db_id
 
-                activity_entry = ActivityEntry(start=last_activity_entry.stop, stop=datetime_now, active=was_active)
-                activity_entry_repository.insert(db_connection, activity_entry)
+    logging.debug(f"application_window_id = {application_window.db_id}")
+    application_window_cache.put(cache_key, application_window)
+    return application_window
 
-        db_connection.commit()
 
+def insert_if_needed_and_get_application(db_connection: sqlite3.Connection, application_name: str, application_path: ApplicationPath) -> Application:
+    cache_key = (application_name, application_path.db_id)
+    application = application_cache.get(cache_key)
+    if application is not None:
+        return application
 
-def register_logged_entry(application_window: ApplicationWindow, datetime_now: datetime.datetime):
-    logged_entry_repository = LoggedEntryRepository()
+    application_repository = ApplicationRepository()
+    application = application_repository.get_by_name_and_path_id(conn=db_connection,
+                                                                 name=application_name,
+                                                                 path_id=application_path.db_id)
 
-    with database_helper.create_connection() as db_connection:
-        last_logged_entry = logged_entry_repository.get_latest_entry(conn=db_connection)
-        if last_logged_entry is None:
-            logging.info("No existing logged entry, creating a new one")
-            new_update = datetime_now + datetime.timedelta(seconds=1)
-            logged_entry = LoggedEntry(start=datetime_now,
-                                       stop=new_update,
-                                       application_window=application_window)
-            logged_entry_repository.insert(conn=db_connection, logged_entry=logged_entry)
-        else:
-            configuration = configuration_helper.get_configuration()
-            max_delta_seconds = configuration.seconds_before_new_entry
-            max_delta_period = datetime.timedelta(seconds=max_delta_seconds)
-
-            old_end = last_logged_entry.stop
-            if max_delta_period < datetime_now - old_end:
-                logging.info("Too long since last update. Create a new entry.")
-
-                new_update = datetime_now + datetime.timedelta(seconds=1)
-                logged_entry = LoggedEntry(start=datetime_now, stop=new_update, application_window=application_window)
-                logged_entry_repository.insert(db_connection, logged_entry)
-            elif last_logged_entry.application_window.db_id == application_window.db_id:
-                logging.info("Still same window. Update existing logged entry")
-
-                db_connection.execute("UPDATE logged_entry SET le_last_update=:new_update WHERE le_id=:id",
-                                      {"id": last_logged_entry.db_id,
-                                       "new_update": datetime_helper.datetime_to_timestamp(datetime_now)})
-            else:
-                logging.info("Not the same window. Insert new logged entry")
-
-                logged_entry = LoggedEntry(start=last_logged_entry.stop, stop=datetime_now,
-                                           application_window=application_window)
-                logged_entry_repository.insert(db_connection, logged_entry)
-
-        db_connection.commit()
-
-
-def insert_if_needed_and_get_application_window(application: Application, window_title: str) -> ApplicationWindow:
-    with database_helper.create_connection() as db_connection:
-        application_window_repository = ApplicationWindowRepository()
-        application_window = application_window_repository.get_by_title_and_application_id(conn=db_connection,
-                                                                                           title=window_title,
-                                                                                           application_id=application.db_id)
-
-        # We couldn't find an existing entry in the database. Insert a new one.
-        if application_window is None:
-            logging.info("Adding new application window")
-            application_window = ApplicationWindow(title=window_title, application=application)
-            db_id = application_window_repository.insert(conn=db_connection, application_window=application_window)
-            application_window.db_id = db_id
+    # We couldn't find an existing entry in the database. Insert a new one.
+    if application is None:
+        logging.info("Adding new application")
+        application_id = application_repository.insert(conn=db_connection,
+                                                       name=application_name,
+                                                       application_path=application_path)
+        application = Application(name=application_name, application_path=application_path, db_id=application_id)
 
-    logging.debug(f"application_window_id = {application_window.db_id}")
-    return application_window
+    logging.debug(f"application_id = {application.db_id}")
+    application_cache.put(cache_key, application)
+    return application
 
 
-def insert_if_needed_and_get_application(application_name: str, application_path: ApplicationPath) -> Application:
-    with database_helper.create_connection() as db_connection:
-        application_repository = ApplicationRepository()
-        application = application_repository.get_by_name_and_path_id(conn=db_connection,
-                                                                     name=application_name,
-                                                                     path_id=application_path.db_id)
+def insert_if_needed_and_get_application_path(db_connection: sqlite3.Connection, application_path: str) -> ApplicationPath:
+    cache_key = str(application_path)
+    ap = application_path_cache.get(cache_key)
+    if ap is not None:
+        return ap
 
-        # We couldn't find an existing entry in the database. Insert a new one.
-        if application is None:
-            logging.info("Adding new application")
-            application_id = application_repository.insert(conn=db_connection,
-                                                           name=application_name,
-                                                           application_path=application_path)
-            application = application_repository.get(db_connection, application_id)
+    application_path_repository = ApplicationPathRepository()
+    ap = application_path_repository.get_by_path(conn=db_connection, path=cache_key)
 
-    logging.debug(f"application_id = {application.db_id}")
-    return application
+    # We couldn't find an existing entry in the database. Insert a new one.
+    if ap is None:
+        logging.info("Adding new application path")
+        application_path_id = application_path_repository.insert(db_connection, cache_key)
+        ap = ApplicationPath(path=cache_key, db_id=application_path_id)
+
+    application_path_cache.put(cache_key, ap)
+    return ap
 
 
-def insert_if_needed_and_get_application_path(application_path: str) -> ApplicationPath:
-    with database_helper.create_connection() as db_connection:
-        application_path_repository = ApplicationPathRepository()
-        ap = application_path_repository.get_by_path(conn=db_connection, path=str(application_path))
+def resize_caches(max_size: int) -> None:
+    for cache in (application_path_cache, application_cache, application_window_cache):
+        cache.resize(max_size)
 
-        # We couldn't find an existing entry in the database. Insert a new one.
-        if ap is None:
-            logging.info("Adding new application path")
-            application_path_id = application_path_repository.insert(db_connection, str(application_path))
-        else:
-            application_path_id = ap.db_id
-        application_path = application_path_repository.get(conn=db_connection, db_id=application_path_id)
 
-    return application_path
+def clear_caches() -> None:
+    for cache in (application_path_cache, application_cache, application_window_cache):
+        cache.clear()
+    identity_map_helper.clear()
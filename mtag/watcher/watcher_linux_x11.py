@@ -1,10 +1,36 @@
 import ctypes.util
 import logging
 import os
-import re
-import subprocess
+import select
+import time
+from typing import Dict, List, Optional, Union
 
+from mtag.helper import configuration_helper
 from . import watcher_helper
+from .lock_state_linux import LockStateProvider
+from .probe_runner import ProbeRunner
+from .process_linux import ProcessCache
+from .watcher_helper import WindowInformation
+from .watcher_scheduler import Sample
+from .watcher_session import WatcherSession
+from .watcher_statistics import statistics
+
+
+class XPropertyEvent(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_int),
+                ('serial', ctypes.c_ulong),
+                ('send_event', ctypes.c_int),
+                ('display', ctypes.c_void_p),
+                ('window', ctypes.c_ulong),
+                ('atom', ctypes.c_ulong),
+                ('time', ctypes.c_ulong),
+                ('state', ctypes.c_int)]
+
+
+class XEvent(ctypes.Union):
+    _fields_ = [('type', ctypes.c_int),
+                ('xproperty', XPropertyEvent),
+                ('pad', ctypes.c_long * 24)]  # the size of the XEvent union
 
 
 class XScreenSaverInfo(ctypes.Structure):
@@ -16,123 +42,348 @@ class XScreenSaverInfo(ctypes.Structure):
                 ('event_mask', ctypes.c_ulong)]  # events
 
 
-xlib_str = ctypes.util.find_library('X11')
-xlib = ctypes.cdll.LoadLibrary(xlib_str)
+# The default error handlers exit the process, e.g. when the active window
+# is destroyed while we are reading its properties. Log the errors instead.
+XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+XIOErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p)
+XIOErrorExitHandler = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_void_p)
 
-xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
-xlib.XOpenDisplay.restypes = ctypes.c_void_p
-dpy = xlib.XOpenDisplay(os.environ["DISPLAY"].encode("utf-8"))
+SUCCESS = 0
+ANY_PROPERTY_TYPE = 0
+# The longest property value to read, in 32 bit units
+MAX_PROPERTY_LENGTH = 1024
 
-root = xlib.XDefaultRootWindow(dpy)
-xss_str = ctypes.util.find_library('Xss')
-xss = ctypes.cdll.LoadLibrary(xss_str)
-logging.debug("Loaded XSS")
-xss.XScreenSaverAllocInfo.restype = ctypes.POINTER(XScreenSaverInfo)
-xss_info = xss.XScreenSaverAllocInfo()
+# Changes of the active window and its title wake us up. This is only
+# the longest time between two samples, used to sample the idle time.
+SAMPLE_INTERVAL_SECONDS = 5
+NO_EVENT_MASK = 0
+PROPERTY_CHANGE_MASK = 1 << 22
+PROPERTY_NOTIFY = 28
+# Don't sample more often than this, as the entries have a resolution of one second
+MIN_SECONDS_BETWEEN_SAMPLES = 1
 
+# Loaded by the first X11Watcher that is opened
+xlib = None
+xss = None
 
-def get_idle_time():
-    global xss, dpy, xss_info
-    xss.XScreenSaverQueryInfo(dpy, root, xss_info)
-    idle_seconds = xss_info.contents.idle // 1000
-    return idle_seconds
 
+def _handle_x_error(_display, _error_event) -> int:
+    logging.debug("An X error occurred. Ignoring it.")
+    return 0
 
-whoiam = subprocess.run(["whoami"], stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
-session_id = subprocess.run(["loginctl", "show-user", "-pSessions", "--value", whoiam],
-                            stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
 
-logging.debug(f"{whoiam} => {session_id}")
+def _handle_x_io_error(_display) -> int:
+    logging.error("The connection to the X server was lost")
+    return 0
 
 
-def get_locked_state():
-    global session_id
-    locked_hint = subprocess.run(["loginctl", "show-session", "-pLockedHint", "--value", session_id],
-                                 stdout=subprocess.PIPE).stdout.strip()
-    if locked_hint.lower() == b"no":
-        logging.debug("Not locked")
-        return False
-    elif locked_hint.lower() == b"yes":
-        logging.debug("Locked")
-        return True
-    else:
-        logging.debug("Unknown lock hint:", locked_hint)
-        return False
+x_error_handler = XErrorHandler(_handle_x_error)
+x_io_error_handler = XIOErrorHandler(_handle_x_io_error)
 
 
-# Ensure that we get the value on the right. As a double quote might be escaped
-# inside of the left hand side, ensure that we match the correct double quote characters.
-wm_class_name_pattern = re.compile(r'[^\\]",\s*"\s*(.*)\s*"$')
+def _load_libraries() -> None:
+    global xlib, xss
+    if xlib is not None:
+        return
 
+    loaded_xlib = ctypes.cdll.LoadLibrary(ctypes.util.find_library('X11'))
 
-def watch() -> None:
-    logging.info("== STARTED ==")
+    # The display is used from the probe threads, so Xlib has to lock it.
+    # This must be the first Xlib call.
+    loaded_xlib.XInitThreads()
 
-    active_window_id_information = subprocess.run(["xprop", "-root", "_NET_ACTIVE_WINDOW"],
-                                                  stdout=subprocess.PIPE, universal_newlines=True,
-                                                  encoding="UTF-8").stdout
-    logging.debug(active_window_id_information)
+    loaded_xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    loaded_xlib.XOpenDisplay.restype = ctypes.c_void_p
+    loaded_xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+    loaded_xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+    loaded_xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+    loaded_xlib.XInternAtom.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+    loaded_xlib.XInternAtom.restype = ctypes.c_ulong
+    loaded_xlib.XGetWindowProperty.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong,
+                                               ctypes.c_long, ctypes.c_long, ctypes.c_int, ctypes.c_ulong,
+                                               ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_int),
+                                               ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_ulong),
+                                               ctypes.POINTER(ctypes.POINTER(ctypes.c_ubyte))]
+    loaded_xlib.XGetWindowProperty.restype = ctypes.c_int
+    loaded_xlib.XFree.argtypes = [ctypes.c_void_p]
+    loaded_xlib.XSelectInput.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_long]
+    loaded_xlib.XFlush.argtypes = [ctypes.c_void_p]
+    loaded_xlib.XPending.argtypes = [ctypes.c_void_p]
+    loaded_xlib.XNextEvent.argtypes = [ctypes.c_void_p, ctypes.POINTER(XEvent)]
+    loaded_xlib.XConnectionNumber.argtypes = [ctypes.c_void_p]
+    loaded_xlib.XSetErrorHandler(x_error_handler)
+    loaded_xlib.XSetIOErrorHandler(x_io_error_handler)
+    # Only in libX11 1.7 and later. Without it a lost connection still exits the process.
+    if hasattr(loaded_xlib, "XSetIOErrorExitHandler"):
+        loaded_xlib.XSetIOErrorExitHandler.argtypes = [ctypes.c_void_p, XIOErrorExitHandler, ctypes.c_void_p]
 
-    active_window_id = active_window_id_information[active_window_id_information.rfind(" ") + 1:].strip()
-    logging.debug(active_window_id)
-    idle_seconds = get_idle_time()
+    loaded_xss = ctypes.cdll.LoadLibrary(ctypes.util.find_library('Xss'))
+    logging.debug("Loaded XSS")
+    loaded_xss.XScreenSaverAllocInfo.restype = ctypes.POINTER(XScreenSaverInfo)
+    loaded_xss.XScreenSaverQueryInfo.argtypes = [ctypes.c_void_p, ctypes.c_ulong,
+                                                 ctypes.POINTER(XScreenSaverInfo)]
 
-    locked_state = get_locked_state()
+    xlib = loaded_xlib
+    xss = loaded_xss
 
-    # If the window handle id is 0, then make a logged entry with default values
-    if active_window_id == "0x0":
-        logging.info("No active window.")
-        watcher_helper.register(window_title=None,
-                                application_name=None,
-                                application_path=None,
-                                idle_period=idle_seconds,
-                                locked_state=locked_state)
-        return
 
-    active_window_x11_information = subprocess.run(["xprop", "-id", active_window_id,
-                                                    "_NET_WM_PID", "WM_CLASS", "WM_NAME", "_NET_WM_NAME"],
-                                                   stdout=subprocess.PIPE, universal_newlines=True,
-                                                   encoding="UTF-8").stdout.strip()
-    logging.debug(active_window_x11_information)
-
-    application_pid = None
-    application_name = None
-    active_window_title = None
-    for line in active_window_x11_information.splitlines():
-        if line.startswith("_NET_WM_PID"):
-            application_pid = line[line.find("=") + 2:]
-            logging.debug(application_pid)
-        elif line.startswith("_NET_WM_NAME"):
-            active_window_title = line[line.find("=") + 2:].strip('"')
-            logging.debug(active_window_title)
-        elif line.startswith("WM_NAME"):
-            # Do not parse this if we already got a value
-            if active_window_title is not None:
-                logging.debug("Application window title already set")
+class X11Watcher:
+    SAMPLE_INTERVAL_SECONDS = SAMPLE_INTERVAL_SECONDS
+
+    def __init__(self):
+        self.dpy: Optional[int] = None
+        self.root = 0
+        self.xss_info = None
+        self.atoms: Dict[str, int] = {}
+        self.focused_window = 0
+        self.connection_lost = False
+        # When the latest sample was taken, and whether the window changed since then
+        self.latest_sample_time = 0.0
+        self.window_changed = False
+        # Called by Xlib, instead of exiting, once the connection is lost
+        self.x_io_error_exit_handler = XIOErrorExitHandler(self._handle_lost_connection)
+        self.lock_state_provider = LockStateProvider()
+        self.process_cache = ProcessCache()
+        self.probe_runner: Optional[ProbeRunner] = None
+        self.no_window_information = WindowInformation(title=None, application_name=None, application_path=None)
+
+    def open(self) -> None:
+        _load_libraries()
+
+        display_name = os.environ.get("DISPLAY")
+        dpy = xlib.XOpenDisplay(display_name.encode("utf-8") if display_name is not None else None)
+        if not dpy:
+            raise ConnectionError(f"Unable to open the display {display_name}")
+
+        if hasattr(xlib, "XSetIOErrorExitHandler"):
+            xlib.XSetIOErrorExitHandler(dpy, self.x_io_error_exit_handler, None)
+
+        self.dpy = dpy
+        self.connection_lost = False
+        self.root = xlib.XDefaultRootWindow(dpy)
+        if self.xss_info is None:
+            self.xss_info = xss.XScreenSaverAllocInfo()
+        # Atoms and event selections belong to the connection
+        self.atoms.clear()
+        self.focused_window = 0
+        xlib.XSelectInput(dpy, self.root, PROPERTY_CHANGE_MASK)
+        xlib.XFlush(dpy)
+        self.probe_runner = ProbeRunner()
+        logging.info(f"Opened the display {display_name}")
+
+    def close(self) -> None:
+        if self.probe_runner is not None:
+            self.probe_runner.shutdown()
+            self.probe_runner = None
+
+        if self.dpy is None:
+            return
+
+        # A lost connection can't be closed. Xlib has already given up on it.
+        if not self.connection_lost:
+            xlib.XCloseDisplay(self.dpy)
+        self.dpy = None
+
+    def is_open(self) -> bool:
+        return self.dpy is not None and not self.connection_lost
+
+    def reconnect_if_needed(self) -> None:
+        if self.is_open():
+            return
+
+        logging.info("Connecting to the X server" if self.dpy is None else "Reconnecting to the X server")
+        self.close()
+        self.open()
+
+    def _handle_lost_connection(self, _display, _user_data) -> None:
+        self.connection_lost = True
+
+    def get_atom(self, name: str) -> int:
+        if name not in self.atoms:
+            self.atoms[name] = xlib.XInternAtom(self.dpy, name.encode("utf-8"), False)
+        return self.atoms[name]
+
+    def get_window_property(self, window: int, property_name: str) -> Optional[Union[bytes, List[int]]]:
+        actual_type = ctypes.c_ulong()
+        actual_format = ctypes.c_int()
+        item_count = ctypes.c_ulong()
+        bytes_after = ctypes.c_ulong()
+        property_value = ctypes.POINTER(ctypes.c_ubyte)()
+
+        status = xlib.XGetWindowProperty(self.dpy, window, self.get_atom(property_name), 0, MAX_PROPERTY_LENGTH,
+                                         False, ANY_PROPERTY_TYPE, ctypes.byref(actual_type),
+                                         ctypes.byref(actual_format), ctypes.byref(item_count),
+                                         ctypes.byref(bytes_after), ctypes.byref(property_value))
+        if status != SUCCESS or actual_type.value == 0:
+            return None
+
+        try:
+            # Format 32 properties are returned as an array of C longs, whatever their size
+            if actual_format.value == 32:
+                return list(ctypes.cast(property_value, ctypes.POINTER(ctypes.c_ulong))[:item_count.value])
+            elif actual_format.value == 8:
+                return ctypes.string_at(property_value, item_count.value)
+            else:
+                logging.debug(f"Unsupported format {actual_format.value} of {property_name}")
+                return None
+        finally:
+            xlib.XFree(property_value)
+
+    def get_active_window(self) -> int:
+        active_window = self.get_window_property(self.root, "_NET_ACTIVE_WINDOW")
+        return active_window[0] if active_window else 0
+
+    def get_window_pid(self, window: int) -> Optional[int]:
+        pid = self.get_window_property(window, "_NET_WM_PID")
+        return pid[0] if pid else None
+
+    def get_window_class_name(self, window: int) -> Optional[str]:
+        # WM_CLASS holds two NUL terminated strings, the instance name and the class name.
+        # We are interested in the class name.
+        wm_class = self.get_window_property(window, "WM_CLASS")
+        if not isinstance(wm_class, bytes):
+            return None
+
+        wm_class_parts = wm_class.split(b"\0")
+        if len(wm_class_parts) < 2:
+            logging.debug("Unable to extract the class name from WM_CLASS.")
+            return None
+
+        return wm_class_parts[1].decode("utf-8", errors="replace")
+
+    def get_window_title(self, window: int) -> Optional[str]:
+        net_wm_name = self.get_window_property(window, "_NET_WM_NAME")
+        if isinstance(net_wm_name, bytes):
+            return net_wm_name.decode("utf-8", errors="replace")
+
+        # Fall back to the legacy title, which is in Latin-1 unless it's compound text
+        wm_name = self.get_window_property(window, "WM_NAME")
+        if isinstance(wm_name, bytes):
+            return wm_name.decode("latin-1")
+
+        return None
+
+    def select_property_changes(self, window: int) -> None:
+        if window == self.focused_window:
+            return
+
+        # Only listen to the root window (for the active window) and the focused window (for its title)
+        if self.focused_window != 0:
+            xlib.XSelectInput(self.dpy, self.focused_window, NO_EVENT_MASK)
+        if window != 0:
+            xlib.XSelectInput(self.dpy, window, PROPERTY_CHANGE_MASK)
+        xlib.XFlush(self.dpy)
+        self.focused_window = window
+
+    def _handle_pending_events(self) -> bool:
+        changed = False
+        event = XEvent()
+        while not self.connection_lost and xlib.XPending(self.dpy) > 0:
+            xlib.XNextEvent(self.dpy, ctypes.byref(event))
+            if event.type != PROPERTY_NOTIFY:
                 continue
-            application_window_title = line[line.find("=") + 2:].strip('"')
-            logging.debug(application_window_title)
-        elif line.startswith("WM_CLASS"):
-            global wm_class_name_pattern
-            pattern_matches = wm_class_name_pattern.findall(line)
-            if len(pattern_matches) > 0:
-                application_name = pattern_matches[0]
+
+            atom = event.xproperty.atom
+            if event.xproperty.window == self.root:
+                changed = changed or atom == self.get_atom("_NET_ACTIVE_WINDOW")
             else:
-                logging.debug("Unable to extract the right hand side WM_CLASS value.")
-
-    logging.debug(application_pid)
-
-    application_path = None
-    if application_pid.isdigit() and application_pid != 0:
-        logging.debug(f"We have an application id: {application_pid}")
-        application_path = subprocess.run(["cat", f"/proc/{int(application_pid)}/cmdline"],
-                                          stdout=subprocess.PIPE, universal_newlines=True,
-                                          encoding="UTF-8").stdout
-        application_path = application_path.replace("\0", " ")
-        application_path = application_path.strip()
-
-    watcher_helper.register(window_title=active_window_title,
-                            application_name=application_name,
-                            application_path=application_path,
-                            idle_period=idle_seconds,
-                            locked_state=locked_state)
+                changed = changed or atom in (self.get_atom("_NET_WM_NAME"), self.get_atom("WM_NAME"))
+
+        return changed
+
+    # Wait until the active window or its title changes, or until the timeout has passed
+    def wait_for_change(self, timeout: float) -> bool:
+        if not self.is_open():
+            # Reconnected on the next tick
+            time.sleep(timeout)
+            return False
+
+        deadline = time.monotonic() + timeout
+        connection_fd = xlib.XConnectionNumber(self.dpy)
+        while True:
+            if self._handle_pending_events():
+                # Sample right away, unless the previous sample was taken less than a second ago,
+                # e.g. during a burst of changes. Then sample once the second has passed.
+                settle_seconds = self.latest_sample_time + MIN_SECONDS_BETWEEN_SAMPLES - time.monotonic()
+                if 0 < settle_seconds:
+                    time.sleep(settle_seconds)
+                    self._handle_pending_events()
+                self.window_changed = True
+                return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.connection_lost:
+                return False
+
+            select.select([connection_fd], [], [], remaining)
+
+    def get_idle_time(self) -> int:
+        if not self.is_open():
+            return 0
+
+        xss.XScreenSaverQueryInfo(self.dpy, self.root, self.xss_info)
+        idle_seconds = self.xss_info.contents.idle // 1000
+        return idle_seconds
+
+    def get_locked_state(self) -> bool:
+        return self.lock_state_provider.get_locked_state()
+
+    def get_window_information(self) -> WindowInformation:
+        with statistics.phase("active_window"):
+            active_window = self.get_active_window()
+            logging.debug(active_window)
+            self.select_property_changes(active_window)
+
+        # If the window handle id is 0, then make a logged entry with default values
+        if active_window == 0:
+            logging.info("No active window.")
+            return self.no_window_information
+
+        with statistics.phase("window_properties"):
+            application_pid = self.get_window_pid(active_window)
+            application_name = self.get_window_class_name(active_window)
+            active_window_title = self.get_window_title(active_window)
+            logging.debug(f"{application_pid} {application_name} {active_window_title}")
+
+        application_path = None
+        if application_pid is not None and application_pid > 0:
+            logging.debug(f"We have an application id: {application_pid}")
+            with statistics.phase("command_line"):
+                application_path = self.process_cache.get_command_line(application_pid)
+
+        return WindowInformation(title=active_window_title,
+                                 application_name=application_name,
+                                 application_path=application_path)
+
+    def watch(self, session: WatcherSession) -> Sample:
+        logging.info("== STARTED ==")
+        self.reconnect_if_needed()
+        self.latest_sample_time = time.monotonic()
+        window_changed = self.window_changed
+        self.window_changed = False
+
+        # Sample everything concurrently, so that e.g. a slow loginctl doesn't stall the tick
+        configuration = configuration_helper.get_configuration()
+        probe_results = self.probe_runner.run(
+            probes={"idle_seconds": statistics.timed("idle_time", self.get_idle_time),
+                    "locked": statistics.timed("lock_state", self.get_locked_state),
+                    "window": self.get_window_information},
+            defaults={"idle_seconds": 0, "locked": False, "window": self.no_window_information},
+            timeout_seconds=configuration.watcher_probe_timeout_seconds)
+        idle_seconds = probe_results["idle_seconds"]
+        locked_state = probe_results["locked"]
+        window_information = probe_results["window"]
+
+        if self.connection_lost:
+            # What we sampled is not to be trusted. Reconnect and sample again on the next tick.
+            raise ConnectionError("The connection to the X server was lost during the tick")
+
+        watcher_helper.register(session=session,
+                                window_title=window_information.title,
+                                application_name=window_information.application_name,
+                                application_path=window_information.application_path,
+                                idle_period=idle_seconds,
+                                locked_state=locked_state,
+                                window_changed=window_changed)
+
+        return Sample(idle_seconds=idle_seconds, locked=locked_state)
@@ -0,0 +1,172 @@
+import datetime
+import json
+import random
+import time
+from collections import namedtuple
+from typing import Iterable, Iterator, Optional
+
+from mtag.watcher import watcher_helper
+from mtag.watcher.watcher_scheduler import Sample
+from mtag.watcher.watcher_session import WatcherSession
+from mtag.watcher.watcher_statistics import statistics
+
+SAMPLE_INTERVAL_SECONDS = 2
+
+# One line of a trace. The window is sampled every SAMPLE_INTERVAL_SECONDS until the next event.
+TraceEvent = namedtuple("TraceEvent", ["timestamp", "application_name", "window_title", "idle_seconds", "locked"])
+ReplayResult = namedtuple("ReplayResult", ["ticks", "simulated_seconds", "elapsed_seconds"])
+
+# Used when generating a trace
+GENERATED_APPLICATIONS = {
+    "firefox": ["Inbox - Mail", "News - Mozilla Firefox", "Documentation - Mozilla Firefox"],
+    "code": ["watcher_helper.py - mtag", "README.md - mtag", "schema.sql - mtag"],
+    "gnome-terminal": ["Terminal", "python3 start_watcher"],
+    "slack": ["general", "random", "Direct message"],
+}
+WORKDAY_START_HOUR = 8
+WORKDAY_HOURS = 9
+
+
+class ReplayClock:
+    def __init__(self, start: datetime.datetime):
+        self.current = start
+
+    def now(self) -> datetime.datetime:
+        return self.current
+
+    def set(self, current: datetime.datetime) -> None:
+        self.current = current
+
+
+def read_trace(trace_path: str) -> Iterator[TraceEvent]:
+    # A JSON object per line, e.g.
+    # {"timestamp": "2020-01-01T08:00:00", "application": "code", "title": "README.md", "idle": 0, "locked": false}
+    with open(trace_path, "r") as trace_file:
+        for line in trace_file:
+            if line.strip() == "":
+                continue
+
+            event = json.loads(line)
+            yield TraceEvent(timestamp=datetime.datetime.fromisoformat(event["timestamp"]),
+                             application_name=event.get("application"),
+                             window_title=event.get("title"),
+                             idle_seconds=event.get("idle", 0),
+                             locked=event.get("locked", False))
+
+
+def write_trace(trace_path: str, events: Iterable[TraceEvent]) -> None:
+    with open(trace_path, "w") as trace_file:
+        for event in events:
+            trace_file.write(json.dumps({"timestamp": event.timestamp.isoformat(),
+                                         "application": event.application_name,
+                                         "title": event.window_title,
+                                         "idle": event.idle_seconds,
+                                         "locked": event.locked}) + "\n")
+
+
+def generate_trace(start_date: datetime.date, days: int, seed: int = 0) -> Iterator[TraceEvent]:
+    # Workdays of switching between windows every few seconds to minutes,
+    # with the occasional break where the screen is locked.
+    rng = random.Random(seed)
+    applications = list(GENERATED_APPLICATIONS)
+    for day in range(days):
+        current = datetime.datetime.combine(start_date + datetime.timedelta(days=day),
+                                            datetime.time(hour=WORKDAY_START_HOUR))
+        end_of_day = current + datetime.timedelta(hours=WORKDAY_HOURS)
+        while current < end_of_day:
+            if rng.random() < 0.01:
+                yield TraceEvent(timestamp=current, application_name=None, window_title=None,
+                                 idle_seconds=0, locked=True)
+                current += datetime.timedelta(minutes=rng.randint(5, 60))
+                continue
+
+            application_name = rng.choice(applications)
+            yield TraceEvent(timestamp=current, application_name=application_name,
+                             window_title=rng.choice(GENERATED_APPLICATIONS[application_name]),
+                             idle_seconds=0, locked=False)
+            current += datetime.timedelta(seconds=rng.randint(SAMPLE_INTERVAL_SECONDS, 600))
+
+        # Leave the computer idle over night
+        yield TraceEvent(timestamp=end_of_day, application_name="N/A", window_title="N/A",
+                         idle_seconds=1, locked=False)
+
+
+class ReplayWatcher:
+    # With a speed of None the trace is replayed as fast as possible,
+    # otherwise e.g. 60 replays a minute of the trace every second.
+    # The clock starts at the first event and is meant to be given to the WatcherSession.
+    def __init__(self, events: Iterable[TraceEvent], speed: Optional[float] = None,
+                 max_gap_seconds: int = 3600):
+        self.events = iter(events)
+        self.speed = speed
+        self.max_gap_seconds = max_gap_seconds
+        self.current_event: Optional[TraceEvent] = None
+        self.next_event: Optional[TraceEvent] = next(self.events, None)
+        self.clock = ReplayClock(start=self.next_event.timestamp if self.next_event is not None
+                                 else datetime.datetime.now())
+
+    def watch(self, session: WatcherSession) -> Optional[Sample]:
+        if self.current_event is None or (self.next_event is not None
+                                          and self.next_event.timestamp <= self._get_next_tick()):
+            if self.next_event is None:
+                return None
+            self.current_event = self.next_event
+            self.next_event = next(self.events, None)
+            self.clock.set(self.current_event.timestamp)
+        else:
+            self.clock.set(self._get_next_tick())
+
+        # The idle time keeps on growing with the clock until the next event, unless the user is active
+        idle_seconds = self.current_event.idle_seconds
+        if 0 < idle_seconds:
+            idle_seconds += int((self.clock.now() - self.current_event.timestamp).total_seconds())
+
+        locked = self.current_event.locked
+        if locked:
+            watcher_helper.register(session=session, window_title=None, application_name=None,
+                                    application_path=None, idle_period=idle_seconds, locked_state=True)
+        else:
+            watcher_helper.register(session=session, window_title=self.current_event.window_title,
+                                    application_name=self.current_event.application_name,
+                                    application_path=self.current_event.application_name,
+                                    idle_period=idle_seconds, locked_state=False)
+        return Sample(idle_seconds=idle_seconds, locked=locked)
+
+    def is_done(self) -> bool:
+        return self.current_event is not None and self.next_event is None
+
+    def run(self, session: WatcherSession) -> ReplayResult:
+        ticks = 0
+        start = time.perf_counter()
+        first_timestamp: Optional[datetime.datetime] = None
+        while not self.is_done():
+            previous_time = self.clock.now()
+            with statistics.tick():
+                sample = self.watch(session)
+            if sample is None:
+                break
+
+            ticks += 1
+            if first_timestamp is None:
+                first_timestamp = self.clock.now()
+            if self.speed is not None:
+                time.sleep(max((self.clock.now() - previous_time).total_seconds(), 0) / self.speed)
+
+        elapsed_seconds = time.perf_counter() - start
+        simulated_seconds = (self.clock.now() - first_timestamp).total_seconds() if first_timestamp else 0
+        return ReplayResult(ticks=ticks, simulated_seconds=simulated_seconds, elapsed_seconds=elapsed_seconds)
+
+    def _get_next_tick(self) -> datetime.datetime:
+        next_tick = self.clock.now() + datetime.timedelta(seconds=SAMPLE_INTERVAL_SECONDS)
+
+        # Skip long gaps, such as nights, rather than ticking through them
+        if self.next_event is not None \
+                and self.max_gap_seconds < (self.next_event.timestamp - self.clock.now()).total_seconds():
+            return self.next_event.timestamp
+        return next_tick
+
+
+def format_result(result: ReplayResult) -> str:
+    ticks_per_second = result.ticks / result.elapsed_seconds if 0 < result.elapsed_seconds else 0
+    return (f"Replayed {result.ticks} ticks covering {datetime.timedelta(seconds=result.simulated_seconds)}"
+            f" in {result.elapsed_seconds:.2f} seconds ({ticks_per_second:.1f} ticks/second)")
@@ -0,0 +1,88 @@
+import logging
+import time
+from collections import namedtuple
+from typing import Callable, Optional
+
+from mtag.helper import configuration_helper
+
+# What a watcher backend observed during a tick
+Sample = namedtuple("Sample", ["idle_seconds", "locked"])
+
+# Entries have a resolution of one second, so never tick more often than this
+MIN_SECONDS_BETWEEN_TICKS = 1
+# How often to check if the user is back while backing off
+RESUME_CHECK_SECONDS = 1
+# Leave some margin before a new entry would be created, for the tick itself
+MARGIN_BEFORE_NEW_ENTRY_SECONDS = 2
+
+
+class WatcherScheduler:
+    def __init__(self, sample_interval_seconds: float,
+                 wait_for_change: Callable[[float], bool],
+                 get_idle_seconds: Callable[[], int]):
+        self.sample_interval_seconds = sample_interval_seconds
+        self.wait_for_change = wait_for_change
+        self.get_idle_seconds = get_idle_seconds
+        self.overrun_count = 0
+
+    def run(self, tick: Callable[[], Optional[Sample]]) -> None:
+        while True:
+            tick_start = time.monotonic()
+            sample = tick()
+            tick_end = time.monotonic()
+
+            # The deadline is based on when the tick started, so the time spent ticking doesn't add up
+            interval = self.get_interval(sample=sample)
+            deadline = tick_start + interval
+            if deadline < tick_end:
+                self.overrun_count += 1
+                logging.warning(f"The tick took {tick_end - tick_start:.3f} seconds and overran"
+                                f" its interval of {interval:.3f} seconds by {tick_end - deadline:.3f} seconds")
+
+            deadline = max(deadline, tick_start + MIN_SECONDS_BETWEEN_TICKS)
+            if self.is_backing_off(sample=sample):
+                self._wait_while_inactive(deadline=deadline, sample=sample, sample_time=tick_end)
+            else:
+                self._wait(deadline=deadline)
+
+    def get_interval(self, sample: Optional[Sample]) -> float:
+        configuration = configuration_helper.get_configuration()
+
+        # Sample at least twice within the time before a new entry is created
+        active_interval = min(self.sample_interval_seconds, configuration.seconds_before_new_entry / 2)
+        if not self.is_backing_off(sample=sample):
+            return active_interval
+
+        inactive_interval = min(configuration.watcher_inactive_sample_interval_seconds,
+                                configuration.seconds_before_new_entry - MARGIN_BEFORE_NEW_ENTRY_SECONDS)
+        return max(active_interval, inactive_interval)
+
+    @staticmethod
+    def is_backing_off(sample: Optional[Sample]) -> bool:
+        if sample is None:
+            return False
+
+        configuration = configuration_helper.get_configuration()
+        return sample.locked or configuration.inactive_after_idle_seconds <= sample.idle_seconds
+
+    def _wait(self, deadline: float) -> None:
+        remaining = deadline - time.monotonic()
+        while 0 < remaining:
+            if self.wait_for_change(remaining):
+                return
+            remaining = deadline - time.monotonic()
+
+    def _wait_while_inactive(self, deadline: float, sample: Sample, sample_time: float) -> None:
+        remaining = deadline - time.monotonic()
+        while 0 < remaining:
+            if self.wait_for_change(min(remaining, RESUME_CHECK_SECONDS)):
+                return
+
+            # If there has been no input the idle time keeps on growing with the clock.
+            # If it's lower than that, the user is back and we sample right away.
+            expected_idle_seconds = sample.idle_seconds + time.monotonic() - sample_time
+            if self.get_idle_seconds() + 1 < expected_idle_seconds:
+                logging.info("Activity resumed")
+                return
+
+            remaining = deadline - time.monotonic()
@@ -0,0 +1,192 @@
+import datetime
+import logging
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, TextIO
+
+from mtag.helper import database_helper, datetime_helper, filesystem_helper
+from mtag.watcher.watcher_statistics import statistics
+
+
+# The entry currently being extended. The key is the window id for logged
+# entries and the activity state for activity entries.
+OpenEntry = namedtuple("OpenEntry", ["db_id", "key", "stop"])
+
+# An extension of an entry which hasn't been written to the database yet
+PendingUpdate = namedtuple("PendingUpdate", ["db_id", "stop"])
+
+entry_columns = {
+    "logged_entry": ("le_id", "le_last_update"),
+    "activity_entry": ("ae_id", "ae_last_update")
+}
+
+
+class WatcherSession:
+    # The clock can be replaced, e.g. to replay a trace faster than real time. It's only used for the
+    # timestamps of the entries, the flush interval is real time, however fast the clock runs.
+    def __init__(self, clock: Callable[[], datetime.datetime] = datetime.datetime.now):
+        self.clock = clock
+        self.conn: Optional[sqlite3.Connection] = None
+        self.prepared_date: Optional[datetime.date] = None
+        self.open_logged_entry: Optional[OpenEntry] = None
+        self.open_activity_entry: Optional[OpenEntry] = None
+        self.flush_interval_seconds = 0
+        self.pending_updates: Dict[str, PendingUpdate] = {}
+        self.latest_flush = time.monotonic()
+        self.journal: Optional[TextIO] = None
+
+    def open(self) -> None:
+        logging.info("Opening the watcher session")
+        self.conn = database_helper.open_connection()
+        self.conn.set_trace_callback(statistics.count_round_trip)
+        self._prepare_if_needed()
+        self._replay_journal()
+        self.journal = open(get_journal_path(), "a", encoding="utf-8")
+
+    def close(self) -> None:
+        if self.conn is None:
+            return
+
+        logging.info("Closing the watcher session")
+        self.flush()
+        self.conn.close()
+        self.conn = None
+        self.prepared_date = None
+        self.reset_open_entries()
+
+        # Not opened yet if opening the session failed
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def now(self) -> datetime.datetime:
+        return self.clock()
+
+    def reset_open_entries(self) -> None:
+        self.open_logged_entry = None
+        self.open_activity_entry = None
+
+    @contextmanager
+    def tick(self, flush_interval_seconds: int = 0) -> Iterator[sqlite3.Connection]:
+        if self.conn is None:
+            self.open()
+        else:
+            self._prepare_if_needed()
+
+        self.flush_interval_seconds = flush_interval_seconds
+
+        # Everything registered during a tick is written in a single transaction
+        try:
+            with self.conn:
+                yield self.conn
+                flush_needed = self._is_flush_needed()
+                if flush_needed:
+                    self.write_pending_updates()
+        except Exception:
+            # The open entries might have been changed by the rolled back transaction
+            self.reset_open_entries()
+            raise
+
+        if flush_needed:
+            self._clear_pending_updates()
+
+    def extend_entry(self, table: str, db_id: int, stop: datetime.datetime) -> None:
+        if self.flush_interval_seconds <= 0:
+            _update_last_update(conn=self.conn, table=table, db_id=db_id,
+                                new_update=datetime_helper.datetime_to_timestamp(stop))
+            return
+
+        # Keep the extension in memory until the next flush. Write it to the journal so that it can be
+        # replayed if the watcher dies before flushing it. The journal isn't synced to the disk, so like
+        # the database with synchronous=NORMAL, up to a flush interval of extensions is lost on power loss.
+        pending_update = PendingUpdate(db_id=db_id, stop=stop)
+        self.pending_updates[table] = pending_update
+        self.journal.write(f"{table} {db_id} {datetime_helper.datetime_to_timestamp(stop)}\n")
+        self.journal.flush()
+
+    def flush(self) -> None:
+        with self.conn:
+            self.write_pending_updates()
+        self._clear_pending_updates()
+
+    def write_pending_updates(self) -> None:
+        for table, pending_update in self.pending_updates.items():
+            logging.debug(f"Flushing pending update of {table} {pending_update.db_id}")
+            _update_last_update(conn=self.conn, table=table, db_id=pending_update.db_id,
+                                new_update=datetime_helper.datetime_to_timestamp(pending_update.stop))
+
+    def _clear_pending_updates(self) -> None:
+        # Only called once the pending updates have been committed
+        self.pending_updates.clear()
+        self.latest_flush = time.monotonic()
+        if self.journal is not None:
+            self.journal.truncate(0)
+
+    def _is_flush_needed(self) -> bool:
+        if len(self.pending_updates) == 0:
+            return False
+
+        if self.flush_interval_seconds <= time.monotonic() - self.latest_flush:
+            return True
+
+        # The window or activity state changed, so the old entry is closed
+        open_entries = {"logged_entry": self.open_logged_entry, "activity_entry": self.open_activity_entry}
+        return any(open_entries[table] is None or open_entries[table].db_id != pending_update.db_id
+                   for table, pending_update in self.pending_updates.items())
+
+    def _replay_journal(self) -> None:
+        journal_path = get_journal_path()
+        if not os.path.exists(journal_path):
+            return
+
+        latest_updates = {}
+        with open(journal_path, "r", encoding="utf-8") as journal:
+            for line in journal:
+                parts = line.split()
+                if len(parts) != 3 or parts[0] not in entry_columns:
+                    logging.warning(f"Skipping malformed journal line: {line!r}")
+                    continue
+
+                table, db_id, new_update = parts[0], int(parts[1]), int(parts[2])
+                latest_updates[(table, db_id)] = max(new_update, latest_updates.get((table, db_id), new_update))
+
+        if len(latest_updates) > 0:
+            logging.info(f"Replaying {len(latest_updates)} unflushed updates from the journal")
+
+        with self.conn:
+            for (table, db_id), new_update in latest_updates.items():
+                try:
+                    _update_last_update(conn=self.conn, table=table, db_id=db_id, new_update=new_update)
+                except sqlite3.IntegrityError as ex:
+                    logging.warning(f"Unable to replay the update of {table} {db_id}: {ex}")
+
+        os.remove(journal_path)
+
+    def _prepare_if_needed(self) -> None:
+        today = self.clock().date()
+        if self.prepared_date == today:
+            # A backup which failed, or was left to another process, is tried again
+            database_helper.backup_if_needed()
+            return
+
+        # Run the backup and migration checks at startup and at day rollover
+        logging.info(f"Preparing the database for {today}")
+        with statistics.phase("database_preparation"):
+            database_helper.prepare_database(conn=self.conn)
+        self.prepared_date = today
+
+
+def _update_last_update(conn: sqlite3.Connection, table: str, db_id: int, new_update: int) -> None:
+    id_column, last_update_column = entry_columns[table]
+
+    # Never move the end of an entry backwards, e.g. when replaying an old journal
+    conn.execute(f"UPDATE {table} SET {last_update_column}=:new_update"
+                 f" WHERE {id_column}=:id AND {last_update_column}<:new_update",
+                 {"id": db_id, "new_update": new_update})
+
+
+def get_journal_path() -> str:
+    return os.path.join(filesystem_helper.get_userdata_path(), "watcher.journal")
@@ -0,0 +1,124 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List
+
+from mtag.helper import configuration_helper, filesystem_helper
+
+# Upper bounds of the buckets. Anything larger ends up in the last, unbounded, bucket.
+LATENCY_BUCKETS_MILLISECONDS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+ROUND_TRIP_BUCKETS = [0, 1, 2, 3, 4, 5, 10, 20, 50]
+DUMP_INTERVAL_SECONDS = 60
+
+
+class Histogram:
+    def __init__(self, bucket_bounds: List[float]):
+        self.bucket_bounds = bucket_bounds
+        self.counts = [0] * (len(bucket_bounds) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bucket_bounds, value)] += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def asdict(self) -> Dict:
+        count = sum(self.counts)
+        return {"count": count,
+                "mean": self.total / count if count > 0 else 0,
+                "max": self.max,
+                "buckets": {**{f"<={b}": c for b, c in zip(self.bucket_bounds, self.counts)},
+                            "inf": self.counts[-1]}}
+
+
+class WatcherStatistics:
+    def __init__(self):
+        self.enabled = False
+        self.started = time.time()
+        self.tick_count = 0
+        self.phases: Dict[str, Histogram] = {}
+        # Probes record their phases from the threads of the probe runner, even after they have timed out
+        self.phases_lock = threading.Lock()
+        self.round_trips = Histogram(ROUND_TRIP_BUCKETS)
+        self.current_round_trips = 0
+        self.latest_dump = time.monotonic()
+
+    @contextmanager
+    def tick(self) -> Iterator[None]:
+        self.enabled = configuration_helper.get_configuration().watcher_statistics_enabled
+        if not self.enabled:
+            yield
+            return
+
+        self.current_round_trips = 0
+        try:
+            with self.phase("tick"):
+                yield
+        finally:
+            self.tick_count += 1
+            self.round_trips.record(self.current_round_trips)
+            self.dump_if_needed()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_milliseconds = (time.perf_counter() - phase_start) * 1000
+            with self.phases_lock:
+                if name not in self.phases:
+                    self.phases[name] = Histogram(LATENCY_BUCKETS_MILLISECONDS)
+                self.phases[name].record(elapsed_milliseconds)
+
+    def timed(self, name: str, function: Callable[[], Any]) -> Callable[[], Any]:
+        def timed_function():
+            with self.phase(name):
+                return function()
+        return timed_function
+
+    # Used as the trace callback of the watcher's connection, called for every statement
+    def count_round_trip(self, _statement: str) -> None:
+        self.current_round_trips += 1
+
+    def dump_if_needed(self) -> None:
+        if time.monotonic() - self.latest_dump < DUMP_INTERVAL_SECONDS:
+            return
+
+        self.latest_dump = time.monotonic()
+        try:
+            self.dump()
+        except OSError as ex:
+            logging.warning(f"Unable to write the watcher statistics: {ex}")
+
+    def dump(self) -> None:
+        with self.phases_lock:
+            phases = {name: h.asdict() for name, h in self.phases.items()}
+        statistics = {"started": self.started,
+                      "updated": time.time(),
+                      "ticks": self.tick_count,
+                      "phases_milliseconds": phases,
+                      "round_trips_per_tick": self.round_trips.asdict()}
+
+        # Write to a temporary file first, so that readers never see a partial file
+        statistics_path = get_statistics_path()
+        temporary_path = statistics_path + ".tmp"
+        with open(temporary_path, "w") as statistics_file:
+            json.dump(statistics, fp=statistics_file, indent=2)
+        os.replace(temporary_path, statistics_path)
+
+
+def get_statistics_path() -> str:
+    return os.path.join(filesystem_helper.get_userdata_path(), "watcher_statistics.json")
+
+
+statistics = WatcherStatistics()
@@ -3,10 +3,17 @@ from collections import namedtuple
 from ctypes import *
 import subprocess
 import logging
+import time
 from ctypes import cast
 from ctypes.wintypes import HANDLE, MAX_PATH, DWORD
 
+from mtag.helper import configuration_helper
 from . import watcher_helper
+from .probe_runner import ProbeRunner
+from .watcher_helper import WindowInformation
+from .watcher_scheduler import Sample
+from .watcher_session import WatcherSession
+from .watcher_statistics import statistics
 
 
 class LASTINPUTINFO(Structure):
@@ -53,26 +60,27 @@ def get_locked_state():
 
 
 PROCESS_QUERY_INFORMATION = 0x0400
+no_window_information = WindowInformation(title=None, application_name=None, application_path=None)
+probe_runner = ProbeRunner()
+SAMPLE_INTERVAL_SECONDS = 2
 
 
-def watch():
-    logging.info("== STARTED ==")
+# There are no change notifications to wait for, so just poll
+def wait_for_change(timeout: float) -> bool:
+    time.sleep(timeout)
+    return False
+
+
+def close() -> None:
+    probe_runner.shutdown()
 
+
+def get_window_information() -> WindowInformation:
     pid_param = c_ulong()
-    idle_period = get_idle_duration()
-    locked_state = get_locked_state()
     application_path = None
     application_name = None
     active_window_title = None
 
-    if locked_state:
-        watcher_helper.register(window_title=active_window_title,
-                                application_name=application_name,
-                                application_path=application_path,
-                                idle_period=idle_period,
-                                locked_state=locked_state)
-        return
-
     try:
         # Get foreground window handle
         window_handle = windll.user32.GetForegroundWindow()
@@ -144,8 +152,30 @@ def watch():
     except Exception as ex:
         logging.error(f"An unhandled error occurred in the Windows watcher: {ex}")
 
-    watcher_helper.register(window_title=active_window_title,
-                            application_name=application_name,
-                            application_path=application_path,
+    return WindowInformation(title=active_window_title,
+                             application_name=application_name,
+                             application_path=application_path)
+
+
+def watch(session: WatcherSession) -> Sample:
+    logging.info("== STARTED ==")
+
+    # Sample everything concurrently, so that e.g. a slow tasklist doesn't stall the tick
+    configuration = configuration_helper.get_configuration()
+    probe_results = probe_runner.run(probes={"idle_seconds": statistics.timed("idle_time", get_idle_duration),
+                                             "locked": statistics.timed("lock_state", get_locked_state),
+                                             "window": statistics.timed("window", get_window_information)},
+                                     defaults={"idle_seconds": 0, "locked": False, "window": no_window_information},
+                                     timeout_seconds=configuration.watcher_probe_timeout_seconds)
+    idle_period = probe_results["idle_seconds"]
+    locked_state = probe_results["locked"]
+    window_information = probe_results["window"] if not locked_state else no_window_information
+
+    watcher_helper.register(session=session,
+                            window_title=window_information.title,
+                            application_name=window_information.application_name,
+                            application_path=window_information.application_path,
                             idle_period=idle_period,
                             locked_state=locked_state)
+
+    return Sample(idle_seconds=idle_period, locked=locked_state)
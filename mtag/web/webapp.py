@@ -5,9 +5,11 @@ import os
 from http.server import BaseHTTPRequestHandler
 from pathlib import Path
 from urllib.parse import parse_qs
+from typing import Optional
 
 from ..entity import Category, LoggedEntry, ApplicationWindow, Application, TaggedEntry, ActivityEntry
-from ..helper import database_helper
+from ..helper import configuration_helper, database_helper
+from ..helper.archive_helper import ArchivedMonthError
 from ..helper.statistics_helper import get_total_category_tagged_time_by_id, get_total_category_tagged_time
 from ..repository import CategoryRepository, LoggedEntryRepository, TaggedEntryRepository, ActivityEntryRepository
 
@@ -52,8 +54,12 @@ class RequestHandler(BaseHTTPRequestHandler):
         self.send_response(404)
         self.end_headers()
 
-    def _set_bad_request_response(self) -> None:
-        self.send_response(400)
+    def _set_bad_request_response(self, message: Optional[str] = None) -> None:
+        self.send_response(400, message)
+        self.end_headers()
+
+    def _set_conflict_response(self, message: str) -> None:
+        self.send_response(409, message)
         self.end_headers()
 
     def do_GET(self):
@@ -115,6 +121,8 @@ class RequestHandler(BaseHTTPRequestHandler):
             json["seconds"] = get_total_category_tagged_time_by_id(category.db_id)
             json["has_subs"] = len(subs) > 0
             self._set_json_response(json)
+        elif self.path == "/configuration":
+            self._set_json_response(configuration_helper.get_configuration().asdict())
         else:
             self._set_not_found_response()
 
@@ -142,12 +150,19 @@ class RequestHandler(BaseHTTPRequestHandler):
                 stop=datetime.fromisoformat(data["stop"]),
                 category=None)
             with database_helper.create_connection() as conn:
-                category_repository = CategoryRepository()
-                tagged_entry.category = category_repository.insert(
-                    conn=conn,
-                    main_name=data["main"],
-                    sub_name=data["sub"])
-                TaggedEntryRepository().insert(conn=conn, tagged_entry=tagged_entry)
+                tagged_entry_repository = TaggedEntryRepository()
+                try:
+                    # Refused before creating the category, which would otherwise be left unused
+                    tagged_entry_repository.raise_if_archived(conn=conn, tagged_entry=tagged_entry)
+                    category_repository = CategoryRepository()
+                    tagged_entry.category = category_repository.insert(
+                        conn=conn,
+                        main_name=data["main"],
+                        sub_name=data["sub"])
+                    tagged_entry_repository.insert(conn=conn, tagged_entry=tagged_entry)
+                except ArchivedMonthError as ex:
+                    self._set_conflict_response(str(ex))
+                    return
                 self._set_ok_without_content()
         elif self.path == "/category/edit":
             content_length = int(self.headers['Content-Length'])
@@ -178,6 +193,28 @@ class RequestHandler(BaseHTTPRequestHandler):
             self.send_response(200)
             self.send_header("Content-Type", "text/html")
             self.end_headers()
+        elif self.path == "/configuration/edit":
+            content_length = int(self.headers['Content-Length'])
+            body = self.rfile.read(content_length)
+            data = json.loads(body.decode("utf-8"))
+
+            # Nothing is changed unless every value is valid
+            try:
+                if not isinstance(data, dict):
+                    raise ValueError("Expected an object of configuration values")
+                for k, v in data.items():
+                    configuration_helper.validate_configuration_value(key=k, value=v)
+            except ValueError as e:
+                self._set_bad_request_response(str(e))
+                return
+
+            configuration = configuration_helper.get_configuration()
+            for k, v in data.items():
+                setattr(configuration, k, v)
+
+            # Saving notifies the listeners, and the watcher reloads the changed file
+            configuration_helper.update_configuration(configuration)
+            self._set_ok_without_content()
         else:
             self._set_not_found_response()
 
@@ -191,7 +228,11 @@ class RequestHandler(BaseHTTPRequestHandler):
 
             print("Deleting tagged entry with ID:", db_id)
             with database_helper.create_connection() as conn:
-                TaggedEntryRepository().delete(conn=conn, db_id=db_id)
+                try:
+                    TaggedEntryRepository().delete(conn=conn, db_id=db_id)
+                except ArchivedMonthError as ex:
+                    self._set_conflict_response(str(ex))
+                    return
             self._set_ok_without_content()
         elif self.path.startswith("/category/"):
             db_id = self.path[len("/category/"):]
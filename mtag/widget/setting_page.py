@@ -4,7 +4,7 @@ from mtag.helper import configuration_helper
 from mtag.helper.configuration_helper import Configuration
 
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk
+from gi.repository import GLib, Gtk
 
 
 class SettingPage(Gtk.Bin):
@@ -54,8 +54,18 @@ class SettingPage(Gtk.Bin):
 
         self.add(grid)
 
+        # Show changes made elsewhere, e.g. through the web settings page
+        configuration_helper.add_configuration_listener(self._on_configuration_changed)
+        self.connect("destroy", lambda *_: configuration_helper.remove_configuration_listener(self._on_configuration_changed))
+
     def update_page(self):
         configuration = configuration_helper.get_configuration()
+        self._show_configuration(configuration)
+
+    def _on_configuration_changed(self, configuration: Configuration):
+        GLib.idle_add(self._show_configuration, configuration)
+
+    def _show_configuration(self, configuration: Configuration):
         self.seconds_before_new_entry.set_value(configuration.seconds_before_new_entry)
         self.inactive_after_idle_sec.set_value(configuration.inactive_after_idle_seconds)
         self.log_application_path_switch.set_active(configuration.log_application_path)
@@ -64,7 +74,8 @@ class SettingPage(Gtk.Bin):
         sec_before_new_entry = int(self.seconds_before_new_entry.get_value())
         inactive_after_idle_sec = int(self.inactive_after_idle_sec.get_value())
         log_app_path = self.log_application_path_switch.get_active()
-        configuration = Configuration(inactive_after_idle_seconds=inactive_after_idle_sec,
-                                      seconds_before_new_entry=sec_before_new_entry,
-                                      log_application_path=log_app_path)
+        configuration = configuration_helper.get_configuration()
+        configuration.inactive_after_idle_seconds = inactive_after_idle_sec
+        configuration.seconds_before_new_entry = sec_before_new_entry
+        configuration.log_application_path = log_app_path
         configuration_helper.update_configuration(configuration)
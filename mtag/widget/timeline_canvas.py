@@ -10,7 +10,8 @@ from mtag import entity
 from mtag.entity import TaggedEntry, LoggedEntry, ActivityEntry
 from mtag.helper import color_helper, database_helper
 from mtag.helper.timeline_helper import TimelineHelper
-from mtag.repository import CategoryRepository
+from mtag.helper.archive_helper import ArchivedMonthError
+from mtag.repository import CategoryRepository, TaggedEntryRepository
 from mtag.widget import CategoryChoiceDialog, TimelineContextPopover
 
 
@@ -143,9 +144,15 @@ class TimelineCanvas(Gtk.DrawingArea):
                               timeline_side_padding=self.timeline_side_padding)
 
     def _do_context_menu_delete(self, _: TimelineContextPopover, te: entity.TaggedEntry) -> None:
+        if self._is_archived(te=te, db_id=te.db_id):
+            return
+
         self.emit("tagged-entry-deleted", te)
 
     def _do_context_menu_edit_category(self, _: TimelineContextPopover, te: entity.TaggedEntry):
+        if self._is_archived(te=te, db_id=te.db_id):
+            return
+
         dialog = CategoryChoiceDialog(window=self.parent, tagged_entry=te)
         r = dialog.run()
         (main_category, sub_category) = dialog.get_chosen_category_value()
@@ -522,6 +529,11 @@ class TimelineCanvas(Gtk.DrawingArea):
             self.current_tagged_entry = None
             return
 
+        if self._is_archived(te=tagged_entry_to_create):
+            self.current_tagged_entry = None
+            self.queue_draw()
+            return
+
         # Choose category
         dialog = CategoryChoiceDialog(window=self.parent, tagged_entry=tagged_entry_to_create)
         r = dialog.run()
@@ -539,6 +551,21 @@ class TimelineCanvas(Gtk.DrawingArea):
 
         self.queue_draw()
 
+    def _is_archived(self, te: entity.TaggedEntry, db_id: Optional[int] = None) -> bool:
+        # The tagged entries of archived months can't be changed. Tell so before choosing a category.
+        try:
+            with database_helper.create_connection() as conn:
+                TaggedEntryRepository.raise_if_archived(conn=conn, tagged_entry=te, db_id=db_id)
+        except ArchivedMonthError as ex:
+            dialog = Gtk.MessageDialog(transient_for=self.parent, modal=True, message_type=Gtk.MessageType.INFO,
+                                       buttons=Gtk.ButtonsType.OK, text="The month has been archived")
+            dialog.format_secondary_text(str(ex))
+            dialog.run()
+            dialog.destroy()
+            return True
+
+        return False
+
     def find_visible_logged_entry_by_x_position(self, x: float) -> Optional[TimelineEntry]:
         number_of_visible_logged_entries = len(self.visible_logged_entries)
         if number_of_visible_logged_entries == 0:
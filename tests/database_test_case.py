@@ -0,0 +1,87 @@
+import datetime
+import tempfile
+import unittest
+
+from mtag.entity import ApplicationPath, Application, ApplicationWindow, LoggedEntry, TaggedEntry
+from mtag.helper import configuration_helper, database_helper, filesystem_helper, identity_map_helper
+from mtag.helper import migration_helper
+from mtag.repository import ApplicationPathRepository, ApplicationRepository, ApplicationWindowRepository
+from mtag.repository import CategoryRepository, LoggedEntryRepository, TaggedEntryRepository
+from mtag.repository import category_repository
+from mtag.watcher import watcher_helper
+
+
+class DatabaseTestCase(unittest.TestCase):
+    # A database and configuration of their own in a temporary path, without the daily backup and maintenance
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self._reset_process_state()
+        filesystem_helper.user_data_path = self.temporary_directory.name
+        filesystem_helper.user_configuration_path = self.temporary_directory.name
+        database_helper.latest_seen_backup_date = datetime.date.today()
+        database_helper.prepared_date = datetime.date.today()
+
+        self.conn = database_helper.open_connection()
+        migration_helper.update_if_needed(conn=self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        self._reset_process_state()
+        self.temporary_directory.cleanup()
+
+    @staticmethod
+    def _reset_process_state() -> None:
+        filesystem_helper.user_configuration_path = None
+        filesystem_helper.user_data_path = None
+        filesystem_helper.user_data_backup_path = None
+        filesystem_helper.user_data_archive_path = None
+        configuration_helper.cached_configuration = None
+        configuration_helper.cached_configuration_stat = None
+        database_helper.latest_seen_backup_date = None
+        database_helper.prepared_date = None
+        database_helper.backup_attempt_date = None
+        database_helper.maintenance_enabled = False
+        database_helper.maintained_date = None
+        watcher_helper.clear_caches()
+        identity_map_helper.clear()
+        category_repository.cached_tree_rows = None
+        category_repository.cached_tree_version = None
+        category_repository.cached_categories.clear()
+        category_repository.cached_categories_version = None
+
+    def insert_logged_entry(self, start: datetime.datetime, stop: datetime.datetime,
+                            window_title: str = "README.md", application_name: str = "code") -> LoggedEntry:
+        # The entries of the same application and window share their rows
+        application_path = ApplicationPathRepository.get_by_path(conn=self.conn, path=f"/usr/bin/{application_name}")
+        if application_path is None:
+            path_id = ApplicationPathRepository.insert(conn=self.conn, path=f"/usr/bin/{application_name}")
+            application_path = ApplicationPath(path=f"/usr/bin/{application_name}", db_id=path_id)
+
+        application = ApplicationRepository().get_by_name_and_path_id(conn=self.conn, name=application_name,
+                                                                       path_id=application_path.db_id)
+        if application is None:
+            application_id = ApplicationRepository().insert(conn=self.conn, name=application_name,
+                                                            application_path=application_path)
+            application = Application(name=application_name, application_path=application_path, db_id=application_id)
+
+        application_window = ApplicationWindowRepository().get_by_title_and_application_id(
+                conn=self.conn, title=window_title, application_id=application.db_id)
+        if application_window is None:
+            application_window = ApplicationWindow(title=window_title, application=application)
+            application_window.db_id = ApplicationWindowRepository().insert(conn=self.conn,
+                                                                            application_window=application_window)
+
+        logged_entry = LoggedEntry(start=start, stop=stop, application_window=application_window)
+        logged_entry.db_id = LoggedEntryRepository.insert(conn=self.conn, logged_entry=logged_entry)
+        self.conn.commit()
+        return logged_entry
+
+    def insert_tagged_entry(self, start: datetime.datetime, stop: datetime.datetime,
+                            main_name: str = "Work", sub_name: str = None) -> TaggedEntry:
+        category = CategoryRepository().insert(conn=self.conn, main_name=main_name, sub_name=sub_name)
+        TaggedEntryRepository().insert(conn=self.conn, tagged_entry=TaggedEntry(start=start, stop=stop,
+                                                                                 category=category))
+        return [te for te in self.get_tagged_entries(start) if te.start <= start and stop <= te.stop][0]
+
+    def get_tagged_entries(self, date: datetime.datetime):
+        return TaggedEntryRepository().get_all_by_date(conn=self.conn, date=date)
@@ -0,0 +1,107 @@
+import datetime
+import os
+import sqlite3
+import unittest
+from unittest import mock
+
+from mtag.helper import archive_helper
+from mtag.repository import LoggedEntryRepository
+from tests.database_test_case import DatabaseTestCase
+
+
+class ArchiveHelperTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.insert_logged_entry(start=datetime.datetime(2020, 1, 15, 8), stop=datetime.datetime(2020, 1, 15, 9))
+        self.insert_tagged_entry(start=datetime.datetime(2020, 1, 15, 8), stop=datetime.datetime(2020, 1, 15, 9))
+        self.insert_tagged_entry(start=datetime.datetime(2020, 2, 3, 8), stop=datetime.datetime(2020, 2, 3, 9))
+
+    def _archive_january(self) -> None:
+        archive_helper.archive_month(conn=self.conn, month="2020-01", month_start=datetime.datetime(2020, 1, 1),
+                                     month_end=datetime.datetime(2020, 2, 1))
+
+    def _count_main_rows(self, table: str) -> int:
+        return self.conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+
+    def test_archived_entries_are_moved_to_the_archive(self):
+        self._archive_january()
+
+        self.assertEqual(0, self._count_main_rows("logged_entry"))
+        self.assertEqual(1, self._count_main_rows("tagged_entry"))
+        self.assertEqual(1, len(LoggedEntryRepository().get_all_by_date(conn=self.conn,
+                                                                        date=datetime.datetime(2020, 1, 15))))
+        self.assertEqual(1, len(self.get_tagged_entries(datetime.datetime(2020, 1, 15))))
+        self.assertEqual(1, len(self.get_tagged_entries(datetime.datetime(2020, 2, 3))))
+
+    def test_archives_are_attached_read_only(self):
+        self._archive_january()
+
+        schema = next(archive_helper.get_archive_schemas(conn=self.conn))
+        with self.assertRaises(sqlite3.OperationalError):
+            self.conn.execute(f"DELETE FROM {schema}.tagged_entry")
+        self.assertEqual(1, len(self.get_tagged_entries(datetime.datetime(2020, 1, 15))))
+
+    def test_failed_archiving_leaves_the_month_in_the_main_database(self):
+        with mock.patch.object(archive_helper, "_copy_referenced_rows", side_effect=sqlite3.OperationalError):
+            with self.assertRaises(sqlite3.OperationalError):
+                self._archive_january()
+
+        self.assertEqual(1, self._count_main_rows("logged_entry"))
+        self.assertEqual(2, self._count_main_rows("tagged_entry"))
+        self.assertEqual(0, self._count_main_rows("archive"))
+        self.assertFalse(os.path.exists(archive_helper.get_archive_path("2020-01")))
+
+        # The month is archived by the next attempt
+        self._archive_january()
+        self.assertEqual(0, self._count_main_rows("logged_entry"))
+
+    def test_archive_is_named_when_attached_after_an_interrupted_archiving(self):
+        with mock.patch.object(archive_helper, "_finish_archive"):
+            self._archive_january()
+        self.assertFalse(os.path.exists(archive_helper.get_archive_path("2020-01")))
+
+        self.assertEqual(1, len(self.get_tagged_entries(datetime.datetime(2020, 1, 15))))
+        self.assertTrue(os.path.exists(archive_helper.get_archive_path("2020-01")))
+
+    def test_entries_written_while_archiving_are_not_lost(self):
+        writer_conn = sqlite3.connect(self.conn.execute("PRAGMA database_list").fetchone()["file"], timeout=0)
+        original_copy_referenced_rows = archive_helper._copy_referenced_rows
+
+        def copy_referenced_rows_while_writing(conn, period):
+            # The month is locked for writing while it's being archived
+            with self.assertRaises(sqlite3.OperationalError):
+                writer_conn.execute("INSERT INTO tagged_entry(te_category_id, te_start, te_end)"
+                                    " SELECT c_id, :start, :end FROM category",
+                                    {"start": 1579590000, "end": 1579593600})
+            original_copy_referenced_rows(conn=conn, period=period)
+
+        with mock.patch.object(archive_helper, "_copy_referenced_rows", copy_referenced_rows_while_writing):
+            self._archive_january()
+        writer_conn.close()
+
+        self.assertEqual(1, len(self.get_tagged_entries(datetime.datetime(2020, 1, 15))))
+
+
+class ArchiveHelperManyArchivesTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.months = [datetime.datetime(2019, month, 1) for month in range(1, 13)]
+        for month_start in self.months:
+            self.insert_tagged_entry(start=month_start.replace(day=10, hour=8),
+                                     stop=month_start.replace(day=10, hour=9))
+            archive_helper.archive_month(conn=self.conn, month=month_start.strftime("%Y-%m"), month_start=month_start,
+                                         month_end=archive_helper._add_months(month_start, 1))
+
+    def test_period_of_more_archives_than_can_be_attached_at_once(self):
+        self.assertLess(archive_helper.MAX_ATTACHED_ARCHIVES, len(self.months))
+
+        rows = archive_helper.get_overlapping_rows(conn=self.conn, table="tagged_entry", start_column="te_start",
+                                                   end_column="te_end", from_datetime=datetime.datetime(2019, 1, 1),
+                                                   to_datetime=datetime.datetime(2020, 1, 1))
+
+        self.assertEqual([month_start.replace(day=10, hour=8) for month_start in self.months],
+                         [datetime.datetime.fromtimestamp(row["te_start"]) for row in rows])
+
+
+if __name__ == "__main__":
+    unittest.main()
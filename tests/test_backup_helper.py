@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from mtag.helper import backup_helper, filesystem_helper
+
+
+class BackupHelperTest(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        filesystem_helper.user_data_path = self.temporary_directory.name
+        filesystem_helper.user_data_backup_path = None
+        self.database_file_path = os.path.join(self.temporary_directory.name, "source.db")
+        self.restored_file_path = os.path.join(self.temporary_directory.name, "restored.db")
+
+    def tearDown(self):
+        filesystem_helper.user_data_path = None
+        filesystem_helper.user_data_backup_path = None
+        self.temporary_directory.cleanup()
+
+    def _write_database(self, values: range) -> None:
+        conn = sqlite3.connect(self.database_file_path)
+        conn.execute("CREATE TABLE IF NOT EXISTS t (value TEXT NOT NULL)")
+        conn.executemany("INSERT INTO t VALUES (?)", [(f"value {v} " * 20,) for v in values])
+        conn.commit()
+        conn.close()
+
+    def _count_restored_values(self) -> int:
+        conn = sqlite3.connect(self.restored_file_path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_restore_after_retrying_an_interrupted_backup(self):
+        self._write_database(range(2000))
+        backup_helper.store_backup(database_file_path=self.database_file_path, backup_name="mtag_2020-01-01")
+
+        # The backup was interrupted after storing its pack, but before writing its manifest
+        os.remove(backup_helper._get_manifest_path("mtag_2020-01-01"))
+
+        self._write_database(range(2000, 4000))
+        backup_helper.store_backup(database_file_path=self.database_file_path, backup_name="mtag_2020-01-01")
+
+        backup_helper.restore_backup(backup_name="mtag_2020-01-01", output_file_path=self.restored_file_path)
+        self.assertEqual(4000, self._count_restored_values())
+
+    def test_purge_keeps_the_pages_of_the_remaining_backups(self):
+        for day in range(1, 5):
+            self._write_database(range(day * 1000, day * 1000 + 500))
+            backup_helper.store_backup(database_file_path=self.database_file_path,
+                                       backup_name=f"mtag_2020-01-0{day}")
+
+        backup_helper.purge_backups_if_needed(retention_count=2)
+
+        self.assertEqual(["mtag_2020-01-03", "mtag_2020-01-04"], backup_helper.get_backup_names())
+        backup_helper.restore_backup(backup_name="mtag_2020-01-04", output_file_path=self.restored_file_path)
+        self.assertEqual(2000, self._count_restored_values())
+
+
+    def test_purge_keeps_the_latest_backup_with_a_retention_count_of_0(self):
+        for day in range(1, 4):
+            self._write_database(range(day * 1000, day * 1000 + 500))
+            backup_helper.store_backup(database_file_path=self.database_file_path,
+                                       backup_name=f"mtag_2020-01-0{day}")
+
+        backup_helper.purge_backups_if_needed(retention_count=0)
+
+        self.assertEqual(["mtag_2020-01-03"], backup_helper.get_backup_names())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import datetime
+import sqlite3
+import unittest
+
+from mtag.helper import archive_helper, identity_map_helper
+from mtag.repository import CategoryRepository, TaggedEntryRepository
+from tests.database_test_case import DatabaseTestCase
+
+
+class CategoryRepositoryArchiveTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.archived_entry = self.insert_tagged_entry(start=datetime.datetime(2020, 1, 15, 8),
+                                                       stop=datetime.datetime(2020, 1, 15, 9), main_name="Archived")
+        self.insert_tagged_entry(start=datetime.datetime(2020, 2, 3, 8), stop=datetime.datetime(2020, 2, 3, 9),
+                                 main_name="Kept")
+        archive_helper.archive_month(conn=self.conn, month="2020-01", month_start=datetime.datetime(2020, 1, 1),
+                                     month_end=datetime.datetime(2020, 2, 1))
+
+    def test_delete_of_a_category_used_by_archived_entries_is_refused(self):
+        category = CategoryRepository().get(conn=self.conn, db_id=self.archived_entry.category.db_id)
+        with self.assertRaises(sqlite3.IntegrityError):
+            CategoryRepository().delete(conn=self.conn, category=category)
+
+        tagged_entries = self.get_tagged_entries(datetime.datetime(2020, 1, 15))
+        self.assertEqual(["Archived"], [te.category_str for te in tagged_entries])
+        self.assertEqual(3600, TaggedEntryRepository().total_time_by_category_by_name(conn=self.conn,
+                                                                                      main_name="Archived",
+                                                                                      sub_name=None))
+
+    def test_delete_of_an_unused_category_is_allowed(self):
+        unused_category = CategoryRepository().insert(conn=self.conn, main_name="Unused", sub_name=None)
+        CategoryRepository().delete(conn=self.conn, category=unused_category)
+
+        self.assertEqual(["Archived", "Kept"], [main.name for main, _ in CategoryRepository().get_all(conn=self.conn)])
+
+
+class CategoryRepositoryCacheTest(DatabaseTestCase):
+    def test_category_changed_by_another_process_is_seen(self):
+        tagged_entry = self.insert_tagged_entry(start=datetime.datetime(2020, 1, 15, 8),
+                                                stop=datetime.datetime(2020, 1, 15, 9), main_name="Work")
+        self.assertEqual(["Work"], [te.category_str for te in self.get_tagged_entries(datetime.datetime(2020, 1, 15))])
+
+        other_process_conn = sqlite3.connect(self.conn.execute("PRAGMA database_list").fetchone()["file"])
+        other_process_conn.execute("UPDATE category SET c_name='Play' WHERE c_id=?", (tagged_entry.category.db_id,))
+        other_process_conn.commit()
+        other_process_conn.close()
+
+        self.assertEqual(["Play"], [te.category_str for te in self.get_tagged_entries(datetime.datetime(2020, 1, 15))])
+        self.assertEqual("Play", CategoryRepository().get(conn=self.conn, db_id=tagged_entry.category.db_id).name)
+        self.assertEqual(["Play"], [main.name for main, _ in CategoryRepository().get_all(conn=self.conn)])
+
+
+    def test_category_is_read_once_per_category_version(self):
+        category = CategoryRepository().insert(conn=self.conn, main_name="Work", sub_name=None)
+        self.assertIs(CategoryRepository().get(conn=self.conn, db_id=category.db_id),
+                      CategoryRepository().get(conn=self.conn, db_id=category.db_id))
+
+        CategoryRepository().insert(conn=self.conn, main_name="Play", sub_name=None)
+        self.assertIsNot(category, CategoryRepository().get(conn=self.conn, db_id=category.db_id))
+
+    def test_categories_are_kept_out_of_the_identity_map(self):
+        category = CategoryRepository().insert(conn=self.conn, main_name="Work", sub_name=None)
+        CategoryRepository().get(conn=self.conn, db_id=category.db_id)
+
+        self.assertIsNone(identity_map_helper.get("category", category.db_id))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import datetime
+import unittest
+
+from mtag.entity import ActivityEntry
+from mtag.helper import compaction_helper
+from mtag.repository import ActivityEntryRepository, LoggedEntryRepository
+from tests.database_test_case import DatabaseTestCase
+
+MIN_ENTRY_SECONDS = 60
+MAX_GAP_SECONDS = 10
+
+
+class CompactionHelperTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.day = datetime.datetime(2020, 1, 15)
+
+    def _at(self, hour: int, minute: int, second: int = 0) -> datetime.datetime:
+        return self.day.replace(hour=hour, minute=minute, second=second)
+
+    def _compact_day(self) -> compaction_helper.Compaction:
+        return compaction_helper.compact_period(conn=self.conn, from_datetime=self.day,
+                                                to_datetime=self.day + datetime.timedelta(days=1),
+                                                min_entry_seconds=MIN_ENTRY_SECONDS, max_gap_seconds=MAX_GAP_SECONDS)
+
+    def _get_logged_entries(self):
+        return [(le.start, le.stop, le.application_window.title)
+                for le in LoggedEntryRepository().get_all_by_date(conn=self.conn, date=self.day)]
+
+    def test_short_entries_are_moved_to_the_no_title_window(self):
+        self.insert_logged_entry(start=self._at(8, 0), stop=self._at(8, 0, 30), window_title="a.md")
+        self.insert_logged_entry(start=self._at(9, 0), stop=self._at(9, 5), window_title="b.md")
+
+        compaction = self._compact_day()
+
+        self.assertEqual([(self._at(8, 0), self._at(8, 0, 30), compaction_helper.NO_TITLE),
+                          (self._at(9, 0), self._at(9, 5), "b.md")], self._get_logged_entries())
+        self.assertEqual(1, compaction.titles_dropped)
+        no_title_application = self.conn.execute("SELECT aw_application_id FROM application_window"
+                                                 " WHERE aw_title=?", (compaction_helper.NO_TITLE,)).fetchone()[0]
+        titled_application = self.conn.execute("SELECT aw_application_id FROM application_window"
+                                               " WHERE aw_title='a.md'").fetchone()[0]
+        self.assertEqual(titled_application, no_title_application)
+
+    def test_entries_within_the_gap_are_merged(self):
+        self.insert_logged_entry(start=self._at(8, 0), stop=self._at(8, 5))
+        self.insert_logged_entry(start=self._at(8, 5, 10), stop=self._at(8, 10))
+        self.insert_logged_entry(start=self._at(8, 10, 5), stop=self._at(8, 15))
+
+        compaction = self._compact_day()
+
+        # The kept entry takes the last update of the removed ones, which are unique
+        self.assertEqual([(self._at(8, 0), self._at(8, 15), "README.md")], self._get_logged_entries())
+        self.assertEqual((3, 1), (compaction.entries_before, compaction.entries_after))
+
+    def test_entries_beyond_the_gap_are_kept(self):
+        self.insert_logged_entry(start=self._at(8, 0), stop=self._at(8, 5))
+        self.insert_logged_entry(start=self._at(8, 5, 11), stop=self._at(8, 10))
+
+        compaction = self._compact_day()
+
+        self.assertEqual([(self._at(8, 0), self._at(8, 5), "README.md"),
+                          (self._at(8, 5, 11), self._at(8, 10), "README.md")], self._get_logged_entries())
+        self.assertEqual((2, 2), (compaction.entries_before, compaction.entries_after))
+
+    def test_entries_of_other_windows_are_not_merged(self):
+        self.insert_logged_entry(start=self._at(8, 0), stop=self._at(8, 5), window_title="a.md")
+        self.insert_logged_entry(start=self._at(8, 5, 1), stop=self._at(8, 10), window_title="b.md")
+        self.insert_logged_entry(start=self._at(8, 10, 1), stop=self._at(8, 15), window_title="a.md")
+
+        self._compact_day()
+
+        self.assertEqual(["a.md", "b.md", "a.md"], [title for _, _, title in self._get_logged_entries()])
+
+    def test_short_entries_of_an_application_are_merged_after_losing_their_titles(self):
+        self.insert_logged_entry(start=self._at(8, 0), stop=self._at(8, 0, 20), window_title="a.md")
+        self.insert_logged_entry(start=self._at(8, 0, 21), stop=self._at(8, 0, 40), window_title="b.md")
+        self.insert_logged_entry(start=self._at(8, 0, 41), stop=self._at(8, 1), window_title="c.md",
+                                 application_name="firefox")
+
+        self._compact_day()
+
+        self.assertEqual([(self._at(8, 0), self._at(8, 0, 40), compaction_helper.NO_TITLE),
+                          (self._at(8, 0, 41), self._at(8, 1), compaction_helper.NO_TITLE)],
+                         self._get_logged_entries())
+
+    def test_tagged_and_activity_entries_are_left_as_they_are(self):
+        self.insert_logged_entry(start=self._at(8, 0), stop=self._at(8, 0, 30))
+        self.insert_logged_entry(start=self._at(8, 0, 31), stop=self._at(8, 5))
+        self.insert_tagged_entry(start=self._at(8, 0, 10), stop=self._at(8, 0, 20))
+        ActivityEntryRepository.insert(conn=self.conn, activity_entry=ActivityEntry(start=self._at(8, 0),
+                                                                                    stop=self._at(8, 0, 30),
+                                                                                    active=True))
+        self.conn.commit()
+
+        self._compact_day()
+
+        self.assertEqual([(self._at(8, 0, 10), self._at(8, 0, 20), "Work")],
+                         [(te.start, te.stop, te.category_str) for te in self.get_tagged_entries(self.day)])
+        self.assertEqual([(self._at(8, 0), self._at(8, 0, 30), True)],
+                         [(ae.start, ae.stop, ae.active)
+                          for ae in ActivityEntryRepository().get_all_by_date(conn=self.conn, date=self.day)])
+
+
+class CompactOldEntriesTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+
+    def _insert_day(self, days_ago: int) -> None:
+        day = self.today - datetime.timedelta(days=days_ago)
+        # Merged into one entry when compacted
+        self.insert_logged_entry(start=day.replace(hour=8), stop=day.replace(hour=8, minute=30))
+        self.insert_logged_entry(start=day.replace(hour=8, minute=30, second=5), stop=day.replace(hour=9))
+
+    def _compact_old_entries(self, days_to_keep: int = 5):
+        return compaction_helper.compact_old_entries(conn=self.conn, days_to_keep=days_to_keep,
+                                                     min_entry_seconds=MIN_ENTRY_SECONDS,
+                                                     max_gap_seconds=MAX_GAP_SECONDS)
+
+    def _count_logged_entries(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM logged_entry").fetchone()[0]
+
+    def test_only_the_days_before_the_kept_ones_are_compacted(self):
+        self._insert_day(days_ago=10)
+        self._insert_day(days_ago=5)
+
+        compactions = self._compact_old_entries()
+
+        self.assertEqual(1, len(compactions))
+        self.assertEqual(3, self._count_logged_entries())
+
+    def test_compaction_is_disabled_by_keeping_zero_days(self):
+        self._insert_day(days_ago=10)
+
+        self.assertEqual([], self._compact_old_entries(days_to_keep=0))
+        self.assertEqual(2, self._count_logged_entries())
+
+    def test_compaction_resumes_after_the_compacted_days(self):
+        self._insert_day(days_ago=10)
+        self._insert_day(days_ago=9)
+        self.assertEqual(2, len(self._compact_old_entries()))
+
+        self.assertEqual([], self._compact_old_entries())
+
+        self._insert_day(days_ago=8)
+        compactions = self._compact_old_entries()
+        self.assertEqual([self.today - datetime.timedelta(days=8)],
+                         [datetime.datetime.fromtimestamp(c.from_timestamp) for c in compactions])
+        self.assertEqual(3, self.conn.execute("SELECT COUNT(*) FROM logged_entry_compaction").fetchone()[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import datetime
+import sqlite3
+import unittest
+from unittest import mock
+
+from mtag.helper import backup_helper, compaction_helper, database_helper
+from tests.database_test_case import DatabaseTestCase
+
+
+class DatabaseHelperMaintenanceTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.backup_name = datetime.date.today().strftime("mtag_%Y-%m-%d")
+        self.maintain_database = mock.patch.object(database_helper, "_maintain_database").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _backup_if_needed(self) -> None:
+        # As on the first connection of the day
+        database_helper.latest_seen_backup_date = None
+        database_helper.backup_attempt_date = None
+        database_helper.backup_if_needed()
+        if database_helper.backup_thread is not None:
+            database_helper.backup_thread.join()
+
+    def test_other_processes_only_take_the_backup(self):
+        self._backup_if_needed()
+
+        self.assertTrue(backup_helper.backup_exists(self.backup_name))
+        self.maintain_database.assert_not_called()
+
+    def test_watcher_maintains_the_database_once_a_day_after_the_backup(self):
+        database_helper.maintenance_enabled = True
+
+        self._backup_if_needed()
+        self._backup_if_needed()
+
+        self.assertTrue(backup_helper.backup_exists(self.backup_name))
+        self.maintain_database.assert_called_once()
+
+    def test_watcher_maintains_the_database_when_another_process_took_the_backup(self):
+        self._backup_if_needed()
+        database_helper.maintenance_enabled = True
+
+        self._backup_if_needed()
+
+        self.maintain_database.assert_called_once()
+
+    def test_backup_left_to_another_process_is_checked_again_later(self):
+        with mock.patch.object(backup_helper, "lock") as lock:
+            lock.return_value.__enter__.return_value = False
+            self._backup_if_needed()
+        self.assertFalse(backup_helper.backup_exists(self.backup_name))
+
+        # Not on every connection, but once the retry time has passed
+        database_helper.backup_if_needed()
+        self.assertIsNone(database_helper.latest_seen_backup_date)
+        database_helper.next_backup_attempt_time = 0.0
+        database_helper.backup_if_needed()
+        database_helper.backup_thread.join()
+
+        self.assertTrue(backup_helper.backup_exists(self.backup_name))
+        self.assertEqual(datetime.date.today(), database_helper.latest_seen_backup_date)
+
+    def test_failed_maintenance_closes_its_connection(self):
+        mock.patch.stopall()
+        database_helper.maintenance_enabled = True
+        connections = []
+
+        def open_connection():
+            connections.append(sqlite3.connect(database_helper.get_database_path()))
+            return connections[-1]
+
+        with mock.patch.object(database_helper, "open_connection", open_connection), \
+                mock.patch.object(compaction_helper, "compact_old_entries",
+                                  side_effect=sqlite3.OperationalError("database is locked")), \
+                self.assertLogs(level="ERROR"):
+            self._backup_if_needed()
+
+        self.assertEqual(1, len(connections))
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connections[0].execute("SELECT 1")
+
+
+if __name__ == "__main__":
+    unittest.main()
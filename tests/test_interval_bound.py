@@ -0,0 +1,82 @@
+import datetime
+import unittest
+
+from mtag.helper import archive_helper, datetime_helper
+from mtag.repository import LoggedEntryRepository
+from tests.database_test_case import DatabaseTestCase
+
+
+class IntervalBoundTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.day = datetime.datetime(2020, 1, 15)
+
+    def _at(self, days: int = 0, hours: int = 0) -> datetime.datetime:
+        return self.day + datetime.timedelta(days=days, hours=hours)
+
+    def _get_max_duration(self, table: str) -> int:
+        return self.conn.execute("SELECT ib_max_duration FROM interval_bound WHERE ib_table=?", (table,)).fetchone()[0]
+
+    def _get_logged_entry_starts(self, from_datetime: datetime.datetime, to_datetime: datetime.datetime):
+        return [datetime_helper.timestamp_to_datetime(row["le_start"])
+                for row in archive_helper.get_overlapping_rows(conn=self.conn, table="logged_entry",
+                                                               start_column="le_start",
+                                                               end_column="le_last_update",
+                                                               from_datetime=from_datetime, to_datetime=to_datetime)]
+
+    def test_bound_follows_the_longest_entry(self):
+        self.assertEqual(0, self._get_max_duration("logged_entry"))
+
+        logged_entry = self.insert_logged_entry(start=self._at(hours=8), stop=self._at(hours=9))
+        self.assertEqual(3600, self._get_max_duration("logged_entry"))
+
+        # Extending an entry, as the watcher does, raises it as well
+        self.conn.execute("UPDATE logged_entry SET le_last_update=? WHERE le_id=?",
+                          (datetime_helper.datetime_to_timestamp(self._at(hours=11)), logged_entry.db_id))
+        self.assertEqual(3 * 3600, self._get_max_duration("logged_entry"))
+
+        # But it's never lowered, which only makes the lookups a bit wider
+        self.insert_logged_entry(start=self._at(hours=12), stop=self._at(hours=13))
+        self.conn.execute("DELETE FROM logged_entry WHERE le_id=?", (logged_entry.db_id,))
+        self.assertEqual(3 * 3600, self._get_max_duration("logged_entry"))
+
+    def test_each_table_has_a_bound_of_its_own(self):
+        self.insert_tagged_entry(start=self._at(hours=8), stop=self._at(hours=10))
+
+        self.assertEqual(2 * 3600, self._get_max_duration("tagged_entry"))
+        self.assertEqual(0, self._get_max_duration("logged_entry"))
+        self.assertEqual(0, self._get_max_duration("activity_entry"))
+
+    def test_entry_starting_days_before_is_found(self):
+        self.insert_logged_entry(start=self._at(days=-3, hours=22), stop=self._at(hours=1))
+        self.insert_logged_entry(start=self._at(hours=8), stop=self._at(hours=9))
+
+        self.assertEqual([self._at(days=-3, hours=22), self._at(hours=8)],
+                         self._get_logged_entry_starts(self._at(), self._at(days=1)))
+        self.assertEqual([self._at(days=-3, hours=22), self._at(hours=8)],
+                         [le.start for le in LoggedEntryRepository().get_all_by_date(conn=self.conn, date=self.day)])
+
+    def test_only_entries_overlapping_the_period_are_found(self):
+        for start, stop in [(self._at(days=-1, hours=8), self._at(days=-1, hours=9)),
+                            (self._at(days=-1, hours=23), self._at()),
+                            (self._at(hours=12), self._at(hours=13)),
+                            (self._at(days=1), self._at(days=1, hours=1))]:
+            self.insert_logged_entry(start=start, stop=stop)
+
+        # An entry ending as the period starts touches it, one starting as it ends doesn't
+        self.assertEqual([self._at(days=-1, hours=23), self._at(hours=12)],
+                         self._get_logged_entry_starts(self._at(), self._at(days=1)))
+
+    def test_lookup_uses_the_start_index(self):
+        plan = self.conn.execute("EXPLAIN QUERY PLAN SELECT * FROM logged_entry WHERE"
+                                 " :from_date - (SELECT ib_max_duration FROM interval_bound"
+                                 "               WHERE ib_table='logged_entry') <= le_start"
+                                 " AND le_start < :to_date AND :from_date <= le_last_update",
+                                 {"from_date": 0, "to_date": 1}).fetchall()
+
+        self.assertIn("USING INDEX", plan[0]["detail"])
+        self.assertIn("le_start>? AND le_start<?", plan[0]["detail"])
+
+
+if __name__ == "__main__":
+    unittest.main()
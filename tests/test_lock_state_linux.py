@@ -0,0 +1,137 @@
+import shutil
+import subprocess
+import time
+import unittest
+from unittest import mock
+
+from mtag.watcher import lock_state_linux
+from mtag.watcher.lock_state_linux import LockStateProvider
+
+try:
+    import dbus
+    import dbusmock
+    import gi
+    gi.require_version("Gio", "2.0")
+    from gi.repository import Gio
+    dbusmock_available = shutil.which("dbus-daemon") is not None
+except (ImportError, ValueError):
+    dbusmock_available = False
+
+SESSION_ID = "c1"
+SESSION_PATH = "/org/freedesktop/login1/session/c1"
+
+
+class FakeSessionProxy:
+    def __init__(self, locked_hint):
+        self.locked_hint = locked_hint
+
+    def get_cached_property(self, _name: str):
+        return self.locked_hint
+
+
+class FakeMainContext:
+    @staticmethod
+    def iteration(_may_block: bool) -> bool:
+        return False
+
+
+class LockStateProviderBackOffTest(unittest.TestCase):
+    def setUp(self):
+        self.provider = LockStateProvider()
+        self.provider.session_id = SESSION_ID
+        self.connect_count = 0
+        self.locked_hint = None
+        self.now = 1000.0
+
+        mock.patch.object(LockStateProvider, "_connect", self._connect).start()
+        mock.patch.object(lock_state_linux, "get_locked_state_from_loginctl", return_value=True).start()
+        mock.patch.object(lock_state_linux.time, "monotonic", lambda: self.now).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _connect(self) -> None:
+        self.connect_count += 1
+        self.provider.main_context = FakeMainContext()
+        self.provider.session_proxy = FakeSessionProxy(locked_hint=self.locked_hint)
+
+    def test_missing_locked_hint_falls_back_to_loginctl_without_reconnecting(self):
+        for _ in range(5):
+            self.assertTrue(self.provider.get_locked_state())
+
+        self.assertEqual(1, self.connect_count)
+
+    def test_dbus_is_retried_once_the_back_off_has_passed(self):
+        self.provider.get_locked_state()
+
+        self.now += lock_state_linux.DBUS_MIN_RETRY_SECONDS
+        self.provider.get_locked_state()
+        self.assertEqual(2, self.connect_count)
+
+        # The wait doubles after failing again
+        self.now += lock_state_linux.DBUS_MIN_RETRY_SECONDS
+        self.provider.get_locked_state()
+        self.assertEqual(2, self.connect_count)
+        self.now += lock_state_linux.DBUS_MIN_RETRY_SECONDS
+        self.provider.get_locked_state()
+        self.assertEqual(3, self.connect_count)
+
+    def test_dbus_is_used_once_the_locked_hint_is_available(self):
+        self.provider.get_locked_state()
+
+        self.locked_hint = mock.Mock(unpack=lambda: False)
+        self.now += lock_state_linux.DBUS_MIN_RETRY_SECONDS
+        self.assertFalse(self.provider.get_locked_state())
+        self.assertEqual(lock_state_linux.DBUS_MIN_RETRY_SECONDS, self.provider.dbus_retry_seconds)
+
+
+@unittest.skipUnless(dbusmock_available, "python-dbusmock, PyGObject and dbus-daemon are needed")
+class LockStateProviderDBusTest(dbusmock.DBusTestCase if dbusmock_available else unittest.TestCase):
+    # Against a mocked logind service on the session bus
+    @classmethod
+    def setUpClass(cls):
+        cls.start_session_bus()
+        cls.dbus_con = cls.get_dbus(system_bus=False)
+
+    def setUp(self):
+        self.logind_mock = self.spawn_server(lock_state_linux.LOGIND_BUS_NAME, lock_state_linux.LOGIND_PATH,
+                                             lock_state_linux.LOGIND_MANAGER_INTERFACE, system_bus=False,
+                                             stdout=subprocess.DEVNULL)
+        self.addCleanup(self.logind_mock.wait)
+        self.addCleanup(self.logind_mock.terminate)
+
+        manager = dbus.Interface(self.dbus_con.get_object(lock_state_linux.LOGIND_BUS_NAME,
+                                                          lock_state_linux.LOGIND_PATH), dbusmock.MOCK_IFACE)
+        manager.AddMethod(lock_state_linux.LOGIND_MANAGER_INTERFACE, "GetSession", "s", "o",
+                          f"ret = dbus.ObjectPath('{SESSION_PATH}')")
+        manager.AddObject(SESSION_PATH, lock_state_linux.LOGIND_SESSION_INTERFACE, {"LockedHint": False}, [])
+
+        self.provider = LockStateProvider(use_session_bus=True)
+        self.provider.session_id = SESSION_ID
+
+    def _set_locked_hint(self, locked_hint: bool) -> None:
+        session = self.dbus_con.get_object(lock_state_linux.LOGIND_BUS_NAME, SESSION_PATH)
+        session.Set(lock_state_linux.LOGIND_SESSION_INTERFACE, "LockedHint", locked_hint,
+                    dbus_interface=dbus.PROPERTIES_IFACE)
+
+    def _wait_for_locked_state(self, locked_state: bool) -> bool:
+        # The change is seen once its PropertiesChanged signal has arrived
+        deadline = time.monotonic() + 5
+        while self.provider.get_locked_state() != locked_state and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self.provider.get_locked_state()
+
+    def test_locked_state_follows_the_locked_hint(self):
+        with mock.patch.object(lock_state_linux, "get_locked_state_from_loginctl") as get_locked_state_from_loginctl:
+            self.assertFalse(self.provider.get_locked_state())
+
+            self._set_locked_hint(True)
+            self.assertTrue(self._wait_for_locked_state(True))
+
+            self._set_locked_hint(False)
+            self.assertFalse(self._wait_for_locked_state(False))
+
+        get_locked_state_from_loginctl.assert_not_called()
+        self.assertIsInstance(self.provider.session_proxy, Gio.DBusProxy)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import datetime
+import unittest
+
+from mtag.helper import archive_helper, identity_map_helper
+from mtag.repository import LoggedEntryRepository
+from tests.database_test_case import DatabaseTestCase
+
+
+class LoggedEntryRepositoryJoinedLoadTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.day = datetime.datetime(2020, 2, 3)
+
+    def _insert_day(self, day: datetime.datetime, entry_count: int) -> None:
+        for i in range(entry_count):
+            start = day.replace(hour=8) + datetime.timedelta(minutes=i)
+            self.insert_logged_entry(start=start, stop=start + datetime.timedelta(seconds=30),
+                                     window_title=("README.md", "schema.sql")[i % 2],
+                                     application_name=("code", "firefox")[i % 3 == 0])
+        # Loaded as the GUI would, without the objects of the inserts
+        identity_map_helper.clear()
+
+    def _count_statements(self, day: datetime.datetime) -> int:
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        try:
+            LoggedEntryRepository().get_all_by_date(conn=self.conn, date=day)
+        finally:
+            self.conn.set_trace_callback(None)
+        return len(statements)
+
+    def test_entries_are_loaded_with_their_windows_applications_and_paths(self):
+        self._insert_day(self.day, entry_count=4)
+
+        logged_entries = LoggedEntryRepository().get_all_by_date(conn=self.conn, date=self.day)
+
+        self.assertEqual([("firefox", "/usr/bin/firefox", "README.md"), ("code", "/usr/bin/code", "schema.sql"),
+                          ("code", "/usr/bin/code", "README.md"), ("firefox", "/usr/bin/firefox", "schema.sql")],
+                         [(le.application_window.application.name,
+                           le.application_window.application.application_path.path,
+                           le.application_window.title) for le in logged_entries])
+
+    def test_entries_of_the_same_window_share_its_objects(self):
+        self._insert_day(self.day, entry_count=12)
+
+        logged_entries = LoggedEntryRepository().get_all_by_date(conn=self.conn, date=self.day)
+        logged_entries_again = LoggedEntryRepository().get_all_by_date(conn=self.conn, date=self.day)
+
+        windows = {id(le.application_window) for le in logged_entries}
+        self.assertEqual(4, len(windows))
+        self.assertEqual(2, len({id(le.application_window.application) for le in logged_entries}))
+        self.assertEqual(windows, {id(le.application_window) for le in logged_entries_again})
+
+    def test_query_count_doesnt_grow_with_the_entries(self):
+        other_day = self.day + datetime.timedelta(days=1)
+        self._insert_day(self.day, entry_count=2)
+        self._insert_day(other_day, entry_count=50)
+
+        self.assertEqual(self._count_statements(self.day), self._count_statements(other_day))
+
+    def test_archived_entries_are_joined_within_their_archive(self):
+        archived_day = datetime.datetime(2020, 1, 31)
+        self.insert_logged_entry(start=archived_day.replace(hour=23), stop=self.day.replace(hour=1),
+                                 window_title="Inbox", application_name="thunderbird")
+        self._insert_day(self.day, entry_count=2)
+        archive_helper.archive_month(conn=self.conn, month="2020-01", month_start=datetime.datetime(2020, 1, 1),
+                                     month_end=datetime.datetime(2020, 2, 1))
+        identity_map_helper.clear()
+
+        logged_entries = LoggedEntryRepository().get_all_by_date(conn=self.conn, date=self.day)
+
+        self.assertEqual([(archived_day.replace(hour=23), "thunderbird", "Inbox"),
+                          (self.day.replace(hour=8), "firefox", "README.md"),
+                          (self.day.replace(hour=8, minute=1), "code", "schema.sql")],
+                         [(le.start, le.application_window.application.name, le.application_window.title)
+                          for le in logged_entries])
+
+
+if __name__ == "__main__":
+    unittest.main()
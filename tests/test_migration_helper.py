@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import unittest
+from unittest import mock
+
+from mtag.helper import migration_helper
+from mtag.helper.migration_helper import Migration
+
+
+def _fail(_conn: sqlite3.Connection) -> None:
+    raise sqlite3.OperationalError("Unable to migrate")
+
+
+class MigrationHelperTest(unittest.TestCase):
+    # Starts out with the schema of a new database, which is version 0
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.addCleanup(self.conn.close)
+        schema_path = os.path.join(os.path.dirname(migration_helper.__file__), "schema.sql")
+        with open(schema_path, "rt") as schema_file:
+            self.conn.executescript(schema_file.read())
+        self.conn.execute("PRAGMA foreign_keys=ON")
+
+    def _get_user_version(self) -> int:
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def _get_tables(self):
+        return {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+    def test_new_database_is_updated_to_the_latest_version(self):
+        self.assertEqual(0, migration_helper.get_version(conn=self.conn))
+
+        migration_helper.update_if_needed(conn=self.conn)
+
+        self.assertEqual(migration_helper.get_latest_version(), self._get_user_version())
+        self.assertEqual(migration_helper.get_latest_version(), migration_helper.get_version(conn=self.conn))
+        self.assertEqual([m.version for m in migration_helper.migrations],
+                         [row[0] for row in self.conn.execute("SELECT v_version FROM version ORDER BY v_version")])
+        self.assertLessEqual({"interval_bound", "archive", "logged_entry_compaction", "category_version"},
+                             self._get_tables())
+        # Restored once the update is done
+        self.assertEqual(1, self.conn.execute("PRAGMA foreign_keys").fetchone()[0])
+
+    def test_legacy_database_continues_from_its_version_table(self):
+        for migration in migration_helper.migrations[:2]:
+            migration.migrate(self.conn)
+            self.conn.execute("INSERT INTO version VALUES (?)", (migration.version,))
+        self.conn.execute("INSERT INTO category(c_name, c_url) VALUES ('Work', 'https://example.com')")
+        self.conn.commit()
+        self.assertEqual(2, migration_helper.get_version(conn=self.conn))
+
+        migration_helper.update_if_needed(conn=self.conn)
+
+        self.assertEqual(migration_helper.get_latest_version(), self._get_user_version())
+        self.assertEqual([("Work", "https://example.com", None)],
+                         self.conn.execute("SELECT c_name, c_url, c_parent_id FROM category").fetchall())
+
+    def test_up_to_date_database_is_left_as_is(self):
+        migration_helper.update_if_needed(conn=self.conn)
+
+        with mock.patch.object(migration_helper, "_run_pending_migrations") as run_pending_migrations:
+            migration_helper.update_if_needed(conn=self.conn)
+
+        run_pending_migrations.assert_not_called()
+
+    def test_failing_migration_rolls_back_every_step(self):
+        latest_version = migration_helper.get_latest_version()
+        failing_migrations = migration_helper.migrations + [Migration(version=latest_version + 1,
+                                                                      description="Fail", migrate=_fail)]
+        tables_before = self._get_tables()
+
+        with mock.patch.object(migration_helper, "migrations", failing_migrations):
+            with self.assertRaisesRegex(sqlite3.OperationalError, "Unable to migrate"):
+                migration_helper.update_if_needed(conn=self.conn)
+
+        self.assertEqual(0, self._get_user_version())
+        self.assertEqual(tables_before, self._get_tables())
+        self.assertEqual(1, self.conn.execute("PRAGMA foreign_keys").fetchone()[0])
+
+    def test_migration_violating_foreign_keys_is_rolled_back(self):
+        migration_helper.update_if_needed(conn=self.conn)
+        latest_version = migration_helper.get_latest_version()
+
+        def add_dangling_tagged_entry(conn: sqlite3.Connection) -> None:
+            conn.execute("INSERT INTO tagged_entry(te_category_id, te_start, te_end) VALUES (42, 0, 1)")
+
+        with mock.patch.object(migration_helper, "migrations", migration_helper.migrations + [
+                Migration(version=latest_version + 1, description="Dangle", migrate=add_dangling_tagged_entry)]):
+            with self.assertRaises(sqlite3.IntegrityError):
+                migration_helper.update_if_needed(conn=self.conn)
+
+        self.assertEqual(latest_version, self._get_user_version())
+        self.assertEqual(0, self.conn.execute("SELECT COUNT(*) FROM tagged_entry").fetchone()[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import threading
+import time
+import unittest
+
+from mtag.watcher.probe_runner import ProbeRunner
+
+TIMEOUT_SECONDS = 0.2
+DEFAULTS = {"idle_seconds": 0, "locked": False}
+
+
+class ProbeRunnerTest(unittest.TestCase):
+    def setUp(self):
+        self.runner = ProbeRunner()
+        self.release_probe = threading.Event()
+        self.addCleanup(self.runner.shutdown)
+        self.addCleanup(self.release_probe.set)
+        self.locked_calls = 0
+
+    def _run(self, locked_probe) -> dict:
+        return self.runner.run(probes={"idle_seconds": lambda: 42, "locked": locked_probe}, defaults=DEFAULTS,
+                               timeout_seconds=TIMEOUT_SECONDS)
+
+    def _blocking_locked_probe(self) -> bool:
+        self.locked_calls += 1
+        self.release_probe.wait()
+        return True
+
+    def _failing_probe(self) -> bool:
+        self.locked_calls += 1
+        raise OSError("loginctl not found")
+
+    def _wait_until_done(self, name: str) -> None:
+        while not self.runner.running[name].done():
+            time.sleep(0.01)
+
+    def test_probes_return_their_values(self):
+        self.assertEqual({"idle_seconds": 42, "locked": True}, self._run(lambda: True))
+
+    def test_slow_probe_gets_its_default_within_the_timeout(self):
+        run_start = time.monotonic()
+        results = self._run(self._blocking_locked_probe)
+
+        self.assertLess(time.monotonic() - run_start, TIMEOUT_SECONDS + 0.5)
+        self.assertEqual({"idle_seconds": 42, "locked": False}, results)
+
+    def test_slow_probe_gets_its_last_known_value(self):
+        self._run(lambda: True)
+
+        self.assertEqual({"idle_seconds": 42, "locked": True}, self._run(self._blocking_locked_probe))
+
+    def test_slow_probe_is_not_started_again_while_running(self):
+        self._run(self._blocking_locked_probe)
+        self._run(self._blocking_locked_probe)
+        self.assertEqual(1, self.locked_calls)
+
+        # Its result becomes the last known value once it has finished
+        self.release_probe.set()
+        self._wait_until_done("locked")
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual({"idle_seconds": 42, "locked": True}, self._run(self._failing_probe))
+        self.assertEqual(2, self.locked_calls)
+
+    def test_failing_probe_gets_its_last_known_value(self):
+        self.assertEqual({"idle_seconds": 42, "locked": False}, self._run(self._failing_probe))
+        self._run(lambda: True)
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual({"idle_seconds": 42, "locked": True}, self._run(self._failing_probe))
+
+
+if __name__ == "__main__":
+    unittest.main()
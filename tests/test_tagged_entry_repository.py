@@ -0,0 +1,76 @@
+import datetime
+import unittest
+
+from mtag.entity import TaggedEntry
+from mtag.helper import archive_helper
+from mtag.repository import CategoryRepository, TaggedEntryRepository
+from tests.database_test_case import DatabaseTestCase
+
+
+class TaggedEntryRepositoryArchiveTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.archived_entry = self.insert_tagged_entry(start=datetime.datetime(2020, 1, 31, 23),
+                                                       stop=datetime.datetime(2020, 2, 1, 1))
+        self.kept_entry = self.insert_tagged_entry(start=datetime.datetime(2020, 2, 3, 8),
+                                                   stop=datetime.datetime(2020, 2, 3, 9))
+        archive_helper.archive_month(conn=self.conn, month="2020-01", month_start=datetime.datetime(2020, 1, 1),
+                                     month_end=datetime.datetime(2020, 2, 1))
+        self.category = CategoryRepository().get(conn=self.conn, db_id=self.archived_entry.category.db_id)
+
+    def test_insert_on_an_archived_day_is_refused(self):
+        tagged_entry = TaggedEntry(start=datetime.datetime(2020, 1, 15, 8), stop=datetime.datetime(2020, 1, 15, 9),
+                                   category=self.category)
+        with self.assertRaises(archive_helper.ArchivedMonthError):
+            TaggedEntryRepository().insert(conn=self.conn, tagged_entry=tagged_entry)
+
+        self.assertEqual([], self.get_tagged_entries(datetime.datetime(2020, 1, 15)))
+
+    def test_insert_overlapping_an_archived_entry_is_refused(self):
+        # The archived entry reaches into February, which isn't archived
+        tagged_entry = TaggedEntry(start=datetime.datetime(2020, 2, 1, 0, 30), stop=datetime.datetime(2020, 2, 1, 2),
+                                   category=self.category)
+        with self.assertRaises(archive_helper.ArchivedMonthError):
+            TaggedEntryRepository().insert(conn=self.conn, tagged_entry=tagged_entry)
+
+    def test_insert_after_the_archived_entries_is_allowed(self):
+        tagged_entry = TaggedEntry(start=datetime.datetime(2020, 2, 1, 1), stop=datetime.datetime(2020, 2, 1, 2),
+                                   category=self.category)
+        TaggedEntryRepository().insert(conn=self.conn, tagged_entry=tagged_entry)
+
+        self.assertEqual(2, len(self.get_tagged_entries(datetime.datetime(2020, 2, 1))))
+
+    def test_update_of_an_archived_entry_is_refused(self):
+        self.archived_entry.category = CategoryRepository().insert(conn=self.conn, main_name="Play", sub_name=None)
+        with self.assertRaises(archive_helper.ArchivedMonthError):
+            TaggedEntryRepository().update(conn=self.conn, tagged_entry=self.archived_entry)
+
+        self.assertEqual(["Work"], [te.category_str for te in self.get_tagged_entries(datetime.datetime(2020, 1, 31))])
+
+    def test_update_into_an_archived_month_is_refused(self):
+        self.kept_entry.start = datetime.datetime(2020, 1, 20, 8)
+        with self.assertRaises(archive_helper.ArchivedMonthError):
+            TaggedEntryRepository().update(conn=self.conn, tagged_entry=self.kept_entry)
+
+        self.assertEqual(1, len(self.get_tagged_entries(datetime.datetime(2020, 2, 3))))
+
+    def test_update_outside_of_the_archived_months_is_allowed(self):
+        self.kept_entry.category = CategoryRepository().insert(conn=self.conn, main_name="Play", sub_name=None)
+        TaggedEntryRepository().update(conn=self.conn, tagged_entry=self.kept_entry)
+
+        self.assertEqual(["Play"], [te.category_str for te in self.get_tagged_entries(datetime.datetime(2020, 2, 3))])
+
+    def test_delete_of_an_archived_entry_is_refused(self):
+        with self.assertRaises(archive_helper.ArchivedMonthError):
+            TaggedEntryRepository().delete(conn=self.conn, db_id=self.archived_entry.db_id)
+
+        self.assertEqual(1, len(self.get_tagged_entries(datetime.datetime(2020, 1, 31))))
+
+    def test_delete_outside_of_the_archived_months_is_allowed(self):
+        TaggedEntryRepository().delete(conn=self.conn, db_id=self.kept_entry.db_id)
+
+        self.assertEqual([], self.get_tagged_entries(datetime.datetime(2020, 2, 3)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import datetime
+import unittest
+
+from mtag.repository import ActivityEntryRepository, LoggedEntryRepository
+from mtag.watcher import watcher_helper
+from mtag.watcher.watcher_replay import ReplayClock
+from mtag.watcher.watcher_session import WatcherSession
+from tests.database_test_case import DatabaseTestCase
+
+
+class WatcherHelperTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.day = datetime.datetime(2020, 1, 15)
+        self.clock = ReplayClock(start=self.day.replace(hour=8))
+        self.session = WatcherSession(clock=self.clock.now)
+        self.session.open()
+
+    def tearDown(self):
+        self.session.close()
+        super().tearDown()
+
+    def _register_at(self, current: datetime.datetime, window_title: str = "README.md",
+                     idle_period: int = 0, locked_state: bool = False) -> None:
+        self.clock.set(current)
+        watcher_helper.register(session=self.session, window_title=window_title, application_name="code",
+                                application_path="/usr/bin/code", idle_period=idle_period,
+                                locked_state=locked_state)
+
+    def _get_logged_entries(self):
+        self.session.flush()
+        return [(le.start, le.stop, le.application_window.title)
+                for le in LoggedEntryRepository().get_all_by_date(conn=self.conn, date=self.day)]
+
+    def _get_activity_entries(self):
+        self.session.flush()
+        return [(ae.start, ae.stop, ae.active)
+                for ae in ActivityEntryRepository().get_all_by_date(conn=self.conn, date=self.day)]
+
+    def test_same_window_extends_the_open_entry(self):
+        for second in range(0, 10, 2):
+            self._register_at(self.day.replace(hour=8, second=second))
+
+        self.assertEqual([(self.day.replace(hour=8), self.day.replace(hour=8, second=8), "README.md")],
+                         self._get_logged_entries())
+
+    def test_window_change_starts_an_entry_where_the_previous_one_stopped(self):
+        self._register_at(self.day.replace(hour=8))
+        self._register_at(self.day.replace(hour=8, second=2))
+        self._register_at(self.day.replace(hour=8, second=4), window_title="schema.sql")
+
+        self.assertEqual([(self.day.replace(hour=8), self.day.replace(hour=8, second=2), "README.md"),
+                          (self.day.replace(hour=8, second=2), self.day.replace(hour=8, second=4), "schema.sql")],
+                         self._get_logged_entries())
+
+    def test_window_change_seen_by_the_backend_closes_the_previous_entry_now(self):
+        self._register_at(self.day.replace(hour=8))
+        self._register_at(self.day.replace(hour=8, second=5))
+        self.clock.set(self.day.replace(hour=8, second=9))
+        watcher_helper.register(session=self.session, window_title="schema.sql", application_name="code",
+                                application_path="/usr/bin/code", idle_period=0, window_changed=True)
+
+        self.assertEqual([(self.day.replace(hour=8), self.day.replace(hour=8, second=9), "README.md"),
+                          (self.day.replace(hour=8, second=9), self.day.replace(hour=8, second=10), "schema.sql")],
+                         self._get_logged_entries())
+
+    def test_gap_starts_a_new_entry(self):
+        self._register_at(self.day.replace(hour=8))
+        self._register_at(self.day.replace(hour=8, second=2))
+        self._register_at(self.day.replace(hour=9))
+
+        self.assertEqual([(self.day.replace(hour=8), self.day.replace(hour=8, second=2), "README.md"),
+                          (self.day.replace(hour=9), self.day.replace(hour=9, second=1), "README.md")],
+                         self._get_logged_entries())
+
+    def test_new_session_continues_the_latest_entry(self):
+        self._register_at(self.day.replace(hour=8))
+        self._register_at(self.day.replace(hour=8, second=2))
+        self.session.close()
+
+        self.session = WatcherSession(clock=self.clock.now)
+        self._register_at(self.day.replace(hour=8, second=4))
+
+        self.assertEqual([(self.day.replace(hour=8), self.day.replace(hour=8, second=4), "README.md")],
+                         self._get_logged_entries())
+
+    def test_idle_and_locked_periods_are_inactive(self):
+        self._register_at(self.day.replace(hour=8))
+        self._register_at(self.day.replace(hour=8, second=2))
+        self._register_at(self.day.replace(hour=8, second=4), idle_period=3600)
+        self._register_at(self.day.replace(hour=8, second=6), locked_state=True)
+        self._register_at(self.day.replace(hour=8, second=8))
+
+        self.assertEqual([(self.day.replace(hour=8), self.day.replace(hour=8, second=2), True),
+                          (self.day.replace(hour=8, second=2), self.day.replace(hour=8, second=6), False),
+                          (self.day.replace(hour=8, second=6), self.day.replace(hour=8, second=8), True)],
+                         self._get_activity_entries())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+import ctypes
+import ctypes.util
+import os
+import shutil
+import subprocess
+import sys
+import time
+import unittest
+from unittest import mock
+
+PROP_MODE_REPLACE = 0
+XA_STRING = 31
+XA_WINDOW = 33
+
+x11_libraries_available = sys.platform.startswith("linux") and ctypes.util.find_library("X11") is not None \
+                          and ctypes.util.find_library("Xss") is not None
+xvfb_available = x11_libraries_available and shutil.which("Xvfb") is not None
+
+
+class FakeWindowManager:
+    # Sets the properties which a window manager would, through a connection of its own
+    def __init__(self, display_name: str):
+        self.xlib = ctypes.CDLL(ctypes.util.find_library("X11"))
+        self.xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        self.xlib.XOpenDisplay.restype = ctypes.c_void_p
+        self.xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        self.xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        self.xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        self.xlib.XCreateSimpleWindow.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int,
+                                                  ctypes.c_uint, ctypes.c_uint, ctypes.c_uint, ctypes.c_ulong,
+                                                  ctypes.c_ulong]
+        self.xlib.XCreateSimpleWindow.restype = ctypes.c_ulong
+        self.xlib.XInternAtom.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+        self.xlib.XInternAtom.restype = ctypes.c_ulong
+        self.xlib.XChangeProperty.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong,
+                                              ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        self.xlib.XFlush.argtypes = [ctypes.c_void_p]
+        self.xlib.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+
+        self.dpy = self.xlib.XOpenDisplay(display_name.encode("utf-8"))
+        self.root = self.xlib.XDefaultRootWindow(self.dpy)
+
+    def close(self) -> None:
+        self.xlib.XCloseDisplay(self.dpy)
+
+    def create_window(self, class_name: str, title: str) -> int:
+        window = self.xlib.XCreateSimpleWindow(self.dpy, self.root, 0, 0, 10, 10, 0, 0, 0)
+        wm_class = f"{class_name.lower()}\0{class_name}\0".encode("utf-8")
+        self._change_property(window, "WM_CLASS", XA_STRING, 8, wm_class, len(wm_class))
+        self.set_title(window=window, title=title)
+        return window
+
+    def set_title(self, window: int, title: str) -> None:
+        encoded_title = title.encode("utf-8")
+        self._change_property(window, "_NET_WM_NAME", self._get_atom("UTF8_STRING"), 8, encoded_title,
+                              len(encoded_title))
+
+    def activate(self, window: int) -> None:
+        self._change_property(self.root, "_NET_ACTIVE_WINDOW", XA_WINDOW, 32, (ctypes.c_ulong * 1)(window), 1)
+
+    def _change_property(self, window: int, name: str, property_type: int, property_format: int, data,
+                         element_count: int) -> None:
+        self.xlib.XChangeProperty(self.dpy, window, self._get_atom(name), property_type, property_format,
+                                  PROP_MODE_REPLACE, ctypes.cast(data, ctypes.c_void_p), element_count)
+        self.xlib.XSync(self.dpy, False)
+
+    def _get_atom(self, name: str) -> int:
+        return self.xlib.XInternAtom(self.dpy, name.encode("utf-8"), False)
+
+
+@unittest.skipUnless(xvfb_available, "Xvfb, libX11 and libXss are needed")
+class X11WatcherTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Xvfb picks a free display and writes its number to the pipe once it's ready
+        read_fd, write_fd = os.pipe()
+        cls.xvfb = subprocess.Popen(["Xvfb", "-displayfd", str(write_fd), "-nolisten", "tcp"],
+                                    pass_fds=(write_fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as display_number_file:
+            cls.display_name = f":{display_number_file.readline().strip()}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.xvfb.terminate()
+        cls.xvfb.wait()
+
+    def setUp(self):
+        from mtag.watcher.watcher_linux_x11 import X11Watcher
+
+        self.window_manager = FakeWindowManager(display_name=self.display_name)
+        self.addCleanup(self.window_manager.close)
+        self.editor_window = self.window_manager.create_window(class_name="Code", title="README.md")
+        self.window_manager.activate(self.editor_window)
+
+        with mock.patch.dict(os.environ, {"DISPLAY": self.display_name}):
+            self.watcher = X11Watcher()
+            self.watcher.open()
+        self.addCleanup(self.watcher.close)
+
+    def _wait_for_change(self, timeout: float = 5):
+        wait_start = time.monotonic()
+        changed = self.watcher.wait_for_change(timeout)
+        return changed, time.monotonic() - wait_start
+
+    def test_window_information_of_the_active_window(self):
+        window_information = self.watcher.get_window_information()
+
+        self.assertEqual("README.md", window_information.title)
+        self.assertEqual("Code", window_information.application_name)
+
+    def test_active_window_change_is_sampled_right_away(self):
+        self.watcher.get_window_information()
+        terminal_window = self.window_manager.create_window(class_name="Terminal", title="bash")
+
+        self.window_manager.activate(terminal_window)
+        changed, waited_seconds = self._wait_for_change()
+
+        self.assertTrue(changed)
+        self.assertLess(waited_seconds, 0.5)
+        self.assertTrue(self.watcher.window_changed)
+        self.assertEqual("bash", self.watcher.get_window_information().title)
+
+    def test_title_change_of_the_focused_window_is_sampled_right_away(self):
+        self.watcher.get_window_information()
+
+        self.window_manager.set_title(window=self.editor_window, title="schema.sql")
+        changed, waited_seconds = self._wait_for_change()
+
+        self.assertTrue(changed)
+        self.assertLess(waited_seconds, 0.5)
+        self.assertEqual("schema.sql", self.watcher.get_window_information().title)
+
+    def test_change_right_after_a_sample_waits_for_the_second_to_pass(self):
+        self.watcher.get_window_information()
+        self.watcher.latest_sample_time = time.monotonic()
+
+        self.window_manager.set_title(window=self.editor_window, title="schema.sql")
+        self.window_manager.set_title(window=self.editor_window, title="watcher_helper.py")
+        changed, waited_seconds = self._wait_for_change()
+
+        self.assertTrue(changed)
+        self.assertLess(0.5, waited_seconds)
+        self.assertLess(waited_seconds, 1.5)
+        self.assertEqual("watcher_helper.py", self.watcher.get_window_information().title)
+
+    def test_first_tick_connects(self):
+        from mtag.watcher.watcher_linux_x11 import X11Watcher
+
+        watcher = X11Watcher()
+        self.addCleanup(watcher.close)
+        with mock.patch.dict(os.environ, {"DISPLAY": self.display_name}):
+            watcher.reconnect_if_needed()
+
+        self.assertTrue(watcher.is_open())
+        self.assertEqual("README.md", watcher.get_window_information().title)
+
+    def test_no_change_waits_for_the_timeout(self):
+        self.watcher.get_window_information()
+
+        changed, waited_seconds = self._wait_for_change(timeout=0.3)
+
+        self.assertFalse(changed)
+        self.assertLess(0.25, waited_seconds)
+
+
+@unittest.skipUnless(x11_libraries_available, "libX11 and libXss are needed")
+class X11WatcherWithoutDisplayTest(unittest.TestCase):
+    # Started before the X server, e.g. at login
+    def setUp(self):
+        from mtag.watcher.watcher_linux_x11 import X11Watcher
+
+        mock.patch.dict(os.environ, {"DISPLAY": ":9999"}).start()
+        self.addCleanup(mock.patch.stopall)
+        self.watcher = X11Watcher()
+        self.addCleanup(self.watcher.close)
+
+    def test_connecting_fails_on_each_tick_until_the_display_is_there(self):
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                self.watcher.reconnect_if_needed()
+            self.assertFalse(self.watcher.is_open())
+
+    def test_scheduler_can_wait_without_a_connection(self):
+        self.assertEqual(0, self.watcher.get_idle_time())
+        self.assertFalse(self.watcher.wait_for_change(0.01))
+
+
+if __name__ == "__main__":
+    unittest.main()
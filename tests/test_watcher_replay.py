@@ -0,0 +1,84 @@
+import datetime
+import itertools
+import os
+import unittest
+
+from mtag.repository import ActivityEntryRepository, LoggedEntryRepository
+from mtag.watcher import watcher_replay
+from mtag.watcher.watcher_replay import ReplayWatcher, TraceEvent
+from mtag.watcher.watcher_session import WatcherSession
+from tests.database_test_case import DatabaseTestCase
+
+
+class WatcherReplayTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start = datetime.datetime(2020, 1, 15, 8)
+
+    def _at(self, minutes: int = 0, seconds: int = 0) -> datetime.datetime:
+        return self.start + datetime.timedelta(minutes=minutes, seconds=seconds)
+
+    def _replay(self, events) -> watcher_replay.ReplayResult:
+        watcher = ReplayWatcher(events=events)
+        session = WatcherSession(clock=watcher.clock.now)
+        session.open()
+        try:
+            return watcher.run(session)
+        finally:
+            session.close()
+
+    def _get_logged_entries(self, date: datetime.date):
+        return [(le.start, le.stop, le.application_window.application.name, le.application_window.title)
+                for le in LoggedEntryRepository().get_all_by_date(conn=self.conn, date=date)]
+
+    def test_trace_is_replayed_into_entries(self):
+        result = self._replay([TraceEvent(self._at(), "code", "README.md", 0, False),
+                               TraceEvent(self._at(seconds=10), "code", "schema.sql", 0, False),
+                               TraceEvent(self._at(seconds=20), None, None, 0, True),
+                               TraceEvent(self._at(minutes=5), "firefox", "Inbox", 0, False),
+                               TraceEvent(self._at(minutes=5, seconds=10), "N/A", "N/A", 1, False)])
+
+        # A change is seen by the tick after it, so the previous entry ends at the tick before
+        self.assertEqual([(self._at(), self._at(seconds=8), "code", "README.md"),
+                          (self._at(seconds=8), self._at(seconds=18), "code", "schema.sql"),
+                          (self._at(seconds=18), self._at(minutes=4, seconds=58), "N/A", "N/A"),
+                          (self._at(minutes=4, seconds=58), self._at(minutes=5, seconds=8), "firefox", "Inbox"),
+                          (self._at(minutes=5, seconds=8), self._at(minutes=5, seconds=10), "N/A", "N/A")],
+                         self._get_logged_entries(self.start.date()))
+        self.assertEqual([(self._at(), self._at(seconds=18), True),
+                          (self._at(seconds=18), self._at(minutes=4, seconds=58), False),
+                          (self._at(minutes=4, seconds=58), self._at(minutes=5, seconds=10), True)],
+                         [(ae.start, ae.stop, ae.active)
+                          for ae in ActivityEntryRepository().get_all_by_date(conn=self.conn, date=self.start)])
+        self.assertEqual((5 * 60 + 10) / watcher_replay.SAMPLE_INTERVAL_SECONDS + 1, result.ticks)
+        self.assertEqual(5 * 60 + 10, result.simulated_seconds)
+
+    def test_generated_trace_is_followed_window_by_window(self):
+        start_date = datetime.date(2020, 1, 1)
+        trace_path = os.path.join(self.temporary_directory.name, "trace.jsonl")
+        watcher_replay.write_trace(trace_path, watcher_replay.generate_trace(start_date=start_date, days=1))
+        events = list(watcher_replay.read_trace(trace_path))
+
+        self._replay(events)
+
+        logged_entries = self._get_logged_entries(start_date)
+        # Each window of the trace gets an entry of its own, in the same order
+        window_events = [(window, next(group)) for window, group in itertools.groupby(events, key=self._get_window)]
+        self.assertEqual([window for window, _ in window_events],
+                         [(application_name, title) for _, _, application_name, title in logged_entries])
+        # Without gaps or overlaps, each starting by the tick before its event
+        for previous, current in zip(logged_entries, logged_entries[1:]):
+            self.assertEqual(previous[1], current[0])
+        for (_, event), (entry_start, _, _, _) in zip(window_events, logged_entries):
+            self.assertLessEqual(entry_start, event.timestamp)
+            self.assertLessEqual(event.timestamp - entry_start,
+                                 datetime.timedelta(seconds=watcher_replay.SAMPLE_INTERVAL_SECONDS))
+
+    @staticmethod
+    def _get_window(event: TraceEvent):
+        # Locked periods are logged as an unknown window
+        return ("N/A", "N/A") if event.locked else (event.application_name, event.window_title)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+from unittest import mock
+
+from mtag.helper import configuration_helper
+from mtag.watcher import watcher_scheduler
+from mtag.watcher.watcher_scheduler import Sample, WatcherScheduler
+from tests.database_test_case import DatabaseTestCase
+
+SAMPLE_INTERVAL_SECONDS = 5
+ACTIVE_SAMPLE = Sample(idle_seconds=0, locked=False)
+LOCKED_SAMPLE = Sample(idle_seconds=0, locked=True)
+
+
+class StopScheduler(Exception):
+    pass
+
+
+class WatcherSchedulerTest(DatabaseTestCase):
+    # Runs the scheduler against a fake monotonic clock, which only moves when the ticks or waits take time
+    def setUp(self):
+        super().setUp()
+        self.now = 0.0
+        self.tick_times = []
+        self.changes = []
+        self.idle_seconds = 0
+        mock.patch.object(watcher_scheduler.time, "monotonic", lambda: self.now).start()
+        self.addCleanup(mock.patch.stopall)
+
+        self.scheduler = WatcherScheduler(sample_interval_seconds=SAMPLE_INTERVAL_SECONDS,
+                                          wait_for_change=self._wait_for_change,
+                                          get_idle_seconds=lambda: self.idle_seconds)
+
+    def _wait_for_change(self, timeout: float) -> bool:
+        # A change scheduled within the timeout ends the wait at its time
+        if self.changes and self.changes[0] <= self.now + timeout:
+            self.now = max(self.now, self.changes.pop(0))
+            return True
+        self.now += timeout
+        return False
+
+    def _run(self, tick_count: int, tick_seconds: float = 0.1, sample: Sample = ACTIVE_SAMPLE):
+        def tick():
+            if len(self.tick_times) == tick_count:
+                raise StopScheduler()
+            self.tick_times.append(self.now)
+            self.now += tick_seconds
+            return sample
+
+        with self.assertRaises(StopScheduler):
+            self.scheduler.run(tick=tick)
+        return self.tick_times
+
+    def test_interval_while_active_samples_twice_before_a_new_entry(self):
+        self.assertEqual(SAMPLE_INTERVAL_SECONDS, self.scheduler.get_interval(sample=ACTIVE_SAMPLE))
+        self.assertEqual(SAMPLE_INTERVAL_SECONDS, self.scheduler.get_interval(sample=None))
+
+        configuration = configuration_helper.get_configuration()
+        configuration.seconds_before_new_entry = 6
+        configuration_helper.update_configuration(configuration)
+        self.assertEqual(3, self.scheduler.get_interval(sample=ACTIVE_SAMPLE))
+        self.assertEqual(6 - watcher_scheduler.MARGIN_BEFORE_NEW_ENTRY_SECONDS,
+                         self.scheduler.get_interval(sample=LOCKED_SAMPLE))
+
+    def test_interval_backs_off_while_locked_or_idle(self):
+        idle_sample = Sample(idle_seconds=600, locked=False)
+
+        self.assertTrue(self.scheduler.is_backing_off(sample=LOCKED_SAMPLE))
+        self.assertTrue(self.scheduler.is_backing_off(sample=idle_sample))
+        self.assertFalse(self.scheduler.is_backing_off(sample=Sample(idle_seconds=599, locked=False)))
+        # Capped by the time before a new entry, so the inactive period isn't split
+        self.assertEqual(10 - watcher_scheduler.MARGIN_BEFORE_NEW_ENTRY_SECONDS,
+                         self.scheduler.get_interval(sample=idle_sample))
+
+    def test_deadlines_are_based_on_the_start_of_the_tick(self):
+        tick_times = self._run(tick_count=3, tick_seconds=0.4)
+
+        self.assertEqual([0, SAMPLE_INTERVAL_SECONDS, 2 * SAMPLE_INTERVAL_SECONDS], tick_times)
+        self.assertEqual(0, self.scheduler.overrun_count)
+
+    def test_overrunning_tick_is_counted_and_followed_right_away(self):
+        tick_times = self._run(tick_count=3, tick_seconds=SAMPLE_INTERVAL_SECONDS + 2)
+
+        self.assertEqual([0, 7, 14], tick_times)
+        self.assertEqual(3, self.scheduler.overrun_count)
+
+    def test_change_ends_the_wait(self):
+        self.changes = [2.5]
+
+        tick_times = self._run(tick_count=3)
+
+        # The next deadline is based on the tick after the change
+        self.assertEqual([0, 2.5, 2.5 + SAMPLE_INTERVAL_SECONDS], tick_times)
+
+    def test_activity_while_locked_ends_the_wait(self):
+        def get_idle_seconds():
+            # The user is back after two seconds
+            return 0 if 2 <= self.now else self.now
+        self.scheduler.get_idle_seconds = get_idle_seconds
+
+        tick_times = self._run(tick_count=2, tick_seconds=0, sample=LOCKED_SAMPLE)
+
+        self.assertEqual([0, 2], tick_times)
+
+    def test_without_activity_while_locked_the_wait_lasts_the_inactive_interval(self):
+        self.scheduler.get_idle_seconds = lambda: self.now
+
+        tick_times = self._run(tick_count=2, tick_seconds=0, sample=LOCKED_SAMPLE)
+
+        self.assertEqual([0, 10 - watcher_scheduler.MARGIN_BEFORE_NEW_ENTRY_SECONDS], tick_times)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import datetime
+import os
+import unittest
+from typing import Optional
+from unittest import mock
+
+from mtag.helper import datetime_helper
+from mtag.repository import LoggedEntryRepository
+from mtag.watcher import watcher_session
+from mtag.watcher.watcher_replay import ReplayClock
+from mtag.watcher.watcher_session import WatcherSession
+from tests.database_test_case import DatabaseTestCase
+
+FLUSH_INTERVAL_SECONDS = 30
+
+
+class WatcherSessionJournalTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start = datetime.datetime(2020, 1, 15, 8)
+        self.logged_entry = self.insert_logged_entry(start=self.start,
+                                                     stop=self.start + datetime.timedelta(seconds=1))
+        self.clock = ReplayClock(start=self.start)
+        # The flush interval is measured in real time, apart from the clock of the entries
+        self.elapsed_seconds = 0.0
+        mock.patch.object(watcher_session.time, "monotonic", lambda: self.elapsed_seconds).start()
+        self.addCleanup(mock.patch.stopall)
+        self.session = WatcherSession(clock=self.clock.now)
+        self.session.open()
+
+    def tearDown(self):
+        self.session.close()
+        super().tearDown()
+
+    def _extend_to(self, seconds: int, elapsed_seconds: Optional[float] = None) -> None:
+        self.clock.set(self.start + datetime.timedelta(seconds=seconds))
+        self.elapsed_seconds = seconds if elapsed_seconds is None else elapsed_seconds
+        with self.session.tick(flush_interval_seconds=FLUSH_INTERVAL_SECONDS):
+            self.session.extend_entry(table="logged_entry", db_id=self.logged_entry.db_id, stop=self.clock.now())
+            self.session.open_logged_entry = watcher_session.OpenEntry(db_id=self.logged_entry.db_id,
+                                                                       key=None, stop=self.clock.now())
+
+    def _crash(self) -> None:
+        # Gone without flushing, like a killed watcher
+        self.session.conn.close()
+        self.session.journal.close()
+        self.session = WatcherSession(clock=self.clock.now)
+
+    def _get_stored_stop(self) -> datetime.datetime:
+        return LoggedEntryRepository().get_latest_entry(conn=self.conn).stop
+
+    def test_extensions_are_written_once_the_flush_interval_has_passed(self):
+        self._extend_to(seconds=10)
+        self.assertEqual(self.start + datetime.timedelta(seconds=1), self._get_stored_stop())
+
+        self._extend_to(seconds=FLUSH_INTERVAL_SECONDS + 1)
+        self.assertEqual(self.start + datetime.timedelta(seconds=FLUSH_INTERVAL_SECONDS + 1), self._get_stored_stop())
+        self.assertEqual(0, os.path.getsize(watcher_session.get_journal_path()))
+
+    def test_flush_interval_is_real_time_rather_than_the_clock(self):
+        # E.g. a replay running faster than real time, or the wall clock jumping ahead
+        self._extend_to(seconds=FLUSH_INTERVAL_SECONDS + 1, elapsed_seconds=1)
+        self.assertEqual(self.start + datetime.timedelta(seconds=1), self._get_stored_stop())
+
+        self._extend_to(seconds=FLUSH_INTERVAL_SECONDS + 2, elapsed_seconds=FLUSH_INTERVAL_SECONDS)
+        self.assertEqual(self.start + datetime.timedelta(seconds=FLUSH_INTERVAL_SECONDS + 2), self._get_stored_stop())
+
+    def test_unflushed_extensions_are_replayed_by_the_next_session(self):
+        self._extend_to(seconds=10)
+        self._extend_to(seconds=12)
+        self._crash()
+
+        self.session.open()
+
+        self.assertEqual(self.start + datetime.timedelta(seconds=12), self._get_stored_stop())
+        self.assertTrue(os.path.exists(watcher_session.get_journal_path()))
+        self.assertEqual(0, os.path.getsize(watcher_session.get_journal_path()))
+
+    def test_replaying_never_moves_the_end_backwards(self):
+        self._extend_to(seconds=10)
+        self._crash()
+        self.conn.execute("UPDATE logged_entry SET le_last_update=:stop",
+                          {"stop": datetime_helper.datetime_to_timestamp(self.start + datetime.timedelta(seconds=20))})
+        self.conn.commit()
+
+        self.session.open()
+
+        self.assertEqual(self.start + datetime.timedelta(seconds=20), self._get_stored_stop())
+
+    def test_malformed_journal_lines_are_skipped(self):
+        self._extend_to(seconds=10)
+        self.session.journal.write("logged_entry 1\nunknown_table 1 2\n")
+        self._crash()
+
+        self.session.open()
+
+        self.assertEqual(self.start + datetime.timedelta(seconds=10), self._get_stored_stop())
+
+    def test_closing_after_a_failed_open_keeps_the_error(self):
+        self._crash()
+        with mock.patch.object(WatcherSession, "_replay_journal", side_effect=OSError("Unreadable journal")):
+            with self.assertRaisesRegex(OSError, "Unreadable journal"):
+                self.session.open()
+
+        self.session.close()
+        self.assertIsNone(self.session.conn)
+
+
+if __name__ == "__main__":
+    unittest.main()
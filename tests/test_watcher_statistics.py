@@ -0,0 +1,59 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+
+from mtag.watcher import watcher_statistics
+from mtag.watcher.watcher_statistics import Histogram, WatcherStatistics
+from tests.database_test_case import DatabaseTestCase
+
+THREAD_COUNT = 8
+
+
+class SlowHistogram(Histogram):
+    # Lets the other threads run in between seeing a phase missing and adding it
+    def __init__(self, bucket_bounds):
+        time.sleep(0.05)
+        super().__init__(bucket_bounds)
+
+
+class WatcherStatisticsTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.statistics = WatcherStatistics()
+        self.statistics.enabled = True
+
+    def test_phases_are_recorded_per_name(self):
+        with self.statistics.tick():
+            with self.statistics.phase("database"):
+                pass
+            self.statistics.timed("idle_time", lambda: None)()
+
+        self.assertEqual({"tick": 1, "database": 1, "idle_time": 1},
+                         {name: h.asdict()["count"] for name, h in self.statistics.phases.items()})
+
+    def test_first_phase_recorded_from_several_threads_is_counted_for_each(self):
+        start = threading.Barrier(THREAD_COUNT)
+
+        def record_phase() -> None:
+            start.wait()
+            with self.statistics.phase("lock_state"):
+                pass
+
+        with mock.patch.object(watcher_statistics, "Histogram", SlowHistogram):
+            threads = [threading.Thread(target=record_phase) for _ in range(THREAD_COUNT)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(THREAD_COUNT, self.statistics.phases["lock_state"].asdict()["count"])
+        self.statistics.dump()
+        with open(watcher_statistics.get_statistics_path()) as statistics_file:
+            self.assertEqual(THREAD_COUNT,
+                             json.load(statistics_file)["phases_milliseconds"]["lock_state"]["count"])
+
+
+if __name__ == "__main__":
+    unittest.main()
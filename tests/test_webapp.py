@@ -0,0 +1,113 @@
+import datetime
+import http.client
+import json
+import threading
+import unittest
+from http.server import HTTPServer
+
+from mtag.helper import archive_helper, configuration_helper, database_helper
+from mtag.web import RequestHandler
+from tests.database_test_case import DatabaseTestCase
+
+
+class WebappTestCase(DatabaseTestCase):
+    # Serves the requests on a thread of its own, with its own connection to the test database
+    def setUp(self):
+        super().setUp()
+        self.http_server = HTTPServer(("127.0.0.1", 0), RequestHandler)
+        self.server_thread = threading.Thread(target=self._serve)
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.http_server.shutdown()
+        self.server_thread.join()
+        self.http_server.server_close()
+        super().tearDown()
+
+    def _serve(self) -> None:
+        try:
+            self.http_server.serve_forever()
+        finally:
+            database_helper.close_connection()
+
+    def request(self, method: str, path: str, body=None) -> http.client.HTTPResponse:
+        connection = http.client.HTTPConnection("127.0.0.1", self.http_server.server_port)
+        self.addCleanup(connection.close)
+        connection.request(method, path, body=None if body is None else json.dumps(body))
+        response = connection.getresponse()
+        response.read()
+        return response
+
+
+class WebappArchiveTest(WebappTestCase):
+    def setUp(self):
+        super().setUp()
+        self.archived_entry = self.insert_tagged_entry(start=datetime.datetime(2020, 1, 15, 8),
+                                                       stop=datetime.datetime(2020, 1, 15, 9))
+        archive_helper.archive_month(conn=self.conn, month="2020-01", month_start=datetime.datetime(2020, 1, 1),
+                                     month_end=datetime.datetime(2020, 2, 1))
+
+    def _count_categories(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM category").fetchone()[0]
+
+    def test_adding_to_an_archived_month_is_a_conflict(self):
+        response = self.request("POST", "/taggedentry/add", {"main": "Play", "sub": None,
+                                                             "start": "2020-01-20T08:00:00",
+                                                             "stop": "2020-01-20T09:00:00"})
+
+        self.assertEqual(409, response.status)
+        # The category isn't created for nothing
+        self.assertEqual(1, self._count_categories())
+        self.assertEqual([], self.get_tagged_entries(datetime.datetime(2020, 1, 20)))
+
+    def test_adding_outside_of_the_archived_months_is_allowed(self):
+        response = self.request("POST", "/taggedentry/add", {"main": "Play", "sub": None,
+                                                             "start": "2020-02-20T08:00:00",
+                                                             "stop": "2020-02-20T09:00:00"})
+
+        self.assertEqual(200, response.status)
+        self.assertEqual(["Play"], [te.category_str for te in self.get_tagged_entries(datetime.datetime(2020, 2, 20))])
+
+    def test_deleting_an_archived_entry_is_a_conflict(self):
+        response = self.request("DELETE", f"/taggedentry/{self.archived_entry.db_id}")
+
+        self.assertEqual(409, response.status)
+        self.assertEqual(1, len(self.get_tagged_entries(datetime.datetime(2020, 1, 15))))
+
+
+class WebappConfigurationTest(WebappTestCase):
+    def test_valid_values_are_saved(self):
+        response = self.request("POST", "/configuration/edit", {"watcher_probe_timeout_seconds": 0.5,
+                                                                "log_application_path": True,
+                                                                "backup_retention_count": 5})
+
+        self.assertEqual(200, response.status)
+        configuration = configuration_helper.get_configuration()
+        self.assertEqual(0.5, configuration.watcher_probe_timeout_seconds)
+        self.assertTrue(configuration.log_application_path)
+        self.assertEqual(5, configuration.backup_retention_count)
+
+    def test_invalid_values_are_a_bad_request(self):
+        for data in [{"unknown_key": 1},
+                     {"backup_retention_count": "5"},
+                     {"backup_retention_count": 2.5},
+                     {"backup_retention_count": -1},
+                     {"backup_retention_count": 0},
+                     {"watcher_cache_size": True},
+                     {"log_application_path": 1},
+                     [["backup_retention_count", 5]]]:
+            with self.subTest(data=data):
+                response = self.request("POST", "/configuration/edit", data)
+                self.assertEqual(400, response.status)
+
+    def test_nothing_is_saved_when_a_value_is_invalid(self):
+        response = self.request("POST", "/configuration/edit", {"backup_retention_count": 5,
+                                                                "seconds_before_new_entry": None})
+
+        self.assertEqual(400, response.status)
+        self.assertEqual(configuration_helper.Configuration.default_configuration["backup_retention_count"],
+                         configuration_helper.get_configuration().backup_retention_count)
+
+
+if __name__ == "__main__":
+    unittest.main()